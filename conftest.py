@@ -1,8 +1,9 @@
 import json
+import random
 
 from pytest import fixture
 
-from model_bakery import baker
+from model_bakery import baker, generators
 
 from vault.models import (
     Collection,
@@ -19,6 +20,12 @@ from vault.models import (
 # Factory Fixtures
 ###############################################################################
 
+# sizes are summed in bigint columns by triggers (see DepositFileStateCount),
+# so random ones are kept to file sizes which can't overflow when added up
+generators.add(
+    "django.db.models.PositiveBigIntegerField", lambda: random.randint(0, 2**40)
+)
+
 
 @fixture
 def make_geolocation():
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Load test of concurrent slow chunk uploads to ``api/flow_chunk`` (WSGI) or
+``api/flow_chunk_async`` (ASGI).
+
+A deposit of one file per simulated client is first registered in the
+collection given, with ``api/register_deposit`` next to the chunk endpoint.
+Each client then POSTs the chunks of its file one after the other at a
+limited rate over its own connection, like a browser on a slow link. Once
+all their chunks are saved, the files are UPLOADED and processed like any
+other, so use a collection set aside for testing.
+
+Compare the two paths by running the same load against each, e.g.::
+
+    dev/flow_chunk_load_test.py --url http://localhost:8000/api/flow_chunk \\
+        --session $SESSIONID --collection-id 1 --clients 1000 --rate 65536
+    dev/flow_chunk_load_test.py --url http://localhost:8001/api/flow_chunk_async \\
+        --session $SESSIONID --collection-id 1 --clients 1000 --rate 65536
+
+and looking at how many uploads complete, and how long they take, compared to
+the time a single upload at that rate needs (``file size / rate``). A server
+which pins a worker per upload serializes uploads beyond its worker count.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import ssl
+import statistics
+import sys
+import time
+import urllib.request
+import uuid
+from urllib.parse import urljoin, urlsplit
+
+BOUNDARY = "----vault-load-test"
+
+
+def multipart_body(fields, chunk):
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n".encode()
+        )
+    parts.append(
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; "
+        f'name="file"; filename="blob"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n".encode()
+    )
+    parts.append(chunk)
+    parts.append(f"\r\n--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+
+class Stats:
+    def __init__(self):
+        self.active = 0
+        self.peak_active = 0
+        self.durations = []
+        self.statuses = {}
+
+
+def file_identifier(args, client):
+    return f"{args.chunk_size * args.chunks}-loadtest-{args.run_id}-{client}"
+
+
+def register_deposit(args):
+    """Registers a deposit of the file of each client, returning its id"""
+    files = [
+        {
+            "flow_identifier": file_identifier(args, client),
+            "name": file_identifier(args, client),
+            "relative_path": file_identifier(args, client),
+            "size": args.chunk_size * args.chunks,
+        }
+        for client in range(args.clients)
+    ]
+    request = urllib.request.Request(
+        urljoin(args.url, "register_deposit"),
+        data=json.dumps({"collection_id": args.collection_id, "files": files}).encode(),
+        headers={
+            "Cookie": f"sessionid={args.session}",
+            "Content-Type": "application/json",
+        },
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["deposit_id"]
+
+
+async def upload(args, stats, client, url, chunk):
+    """Sends the chunks of the file of *client* in turn, recording in *stats*
+    how long they took, or the status of the first one not accepted.
+    """
+    start = time.monotonic()
+    stats.active += 1
+    stats.peak_active = max(stats.peak_active, stats.active)
+    try:
+        for number in range(1, args.chunks + 1):
+            status = await upload_chunk(args, client, url, chunk, number)
+            if not status.startswith("2"):
+                break
+    finally:
+        stats.active -= 1
+    stats.statuses[status] = stats.statuses.get(status, 0) + 1
+    if status.startswith("2"):
+        stats.durations.append(time.monotonic() - start)
+
+
+async def upload_chunk(args, client, url, chunk, number):
+    identifier = file_identifier(args, client)
+    body = multipart_body(
+        {
+            "depositId": args.deposit_id,
+            "flowChunkNumber": number,
+            "flowChunkSize": len(chunk),
+            "flowCurrentChunkSize": len(chunk),
+            "flowTotalSize": len(chunk) * args.chunks,
+            "flowIdentifier": identifier,
+            "flowFilename": identifier,
+            "flowRelativePath": identifier,
+            "flowTotalChunks": args.chunks,
+        },
+        chunk,
+    )
+    headers = (
+        f"POST {url.path} HTTP/1.1\r\n"
+        f"Host: {url.netloc}\r\n"
+        f"Cookie: sessionid={args.session}\r\n"
+        f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode()
+
+    try:
+        reader, writer = await asyncio.open_connection(
+            url.hostname,
+            url.port or (443 if url.scheme == "https" else 80),
+            ssl=ssl.create_default_context() if url.scheme == "https" else None,
+        )
+        # send the body at args.rate bytes per second, in 100ms slices
+        step = max(1, args.rate // 10)
+        # a small send buffer keeps the body from piling up in the kernel,
+        # where a server which doesn't read it yet would get it at once later
+        # instead of at args.rate, as over a slow link
+        writer.get_extra_info("socket").setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDBUF, step
+        )
+        writer.write(headers)
+        for offset in range(0, len(body), step):
+            writer.write(body[offset : offset + step])
+            await writer.drain()
+            await asyncio.sleep(0.1)
+        status_line = await asyncio.wait_for(reader.readline(), args.timeout)
+        status = status_line.split()[1].decode() if status_line else "no response"
+        writer.close()
+    except (OSError, asyncio.TimeoutError) as e:
+        status = type(e).__name__
+    return status
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    args.deposit_id = register_deposit(args)
+    chunk = os.urandom(args.chunk_size)
+    stats = Stats()
+    start = time.monotonic()
+    await asyncio.gather(
+        *(upload(args, stats, client, url, chunk) for client in range(args.clients))
+    )
+    elapsed = time.monotonic() - start
+
+    file_size = args.chunk_size * args.chunks
+    ideal = file_size / args.rate
+    print(
+        f"{args.url}: deposit {args.deposit_id}, {args.clients} clients, "
+        f"{args.chunks} x {args.chunk_size} B chunks at {args.rate} B/s"
+    )
+    print(f"  statuses: {stats.statuses}")
+    print(f"  peak concurrent uploads: {stats.peak_active}")
+    print(f"  wall time: {elapsed:.1f}s (a single upload takes {ideal:.1f}s)")
+    if stats.durations:
+        durations = sorted(stats.durations)
+        print(
+            f"  upload seconds: median {statistics.median(durations):.1f}, "
+            f"p95 {durations[int(len(durations) * 0.95) - 1]:.1f}, "
+            f"max {durations[-1]:.1f}"
+        )
+        print(f"  throughput: {len(durations) * file_size / elapsed / 2**20:.1f} MiB/s")
+    return 0 if stats.durations else 1
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Load test of concurrent slow flow chunk uploads",
+    )
+    parser.add_argument("--url", required=True, help="flow_chunk endpoint URL")
+    parser.add_argument("--session", required=True, help="sessionid cookie value")
+    parser.add_argument(
+        "--collection-id",
+        required=True,
+        type=int,
+        help="collection to register the test deposit in",
+    )
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--chunks", type=int, default=1, help="chunks per file")
+    parser.add_argument(
+        "--rate", type=int, default=64 * 1024, help="bytes per second per client"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="seconds to wait for a response"
+    )
+    args = parser.parse_args(argv[1:])
+    args.run_id = uuid.uuid4().hex[:8]
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,106 @@
+from django.db import connection
+from pytest import fixture, mark
+
+from vault.accounting import (
+    ACCOUNTING_SETTING,
+    aggregate_journal,
+    deferred_treenode_accounting,
+)
+from vault.models import Collection, TreeNode, TreeNodeAccountingDelta
+
+
+def accounting_setting():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT current_setting(%s, true)", [ACCOUNTING_SETTING])
+        return cursor.fetchone()[0]
+
+
+@fixture
+def journal_accounting():
+    # tests run in a transaction, so this is reset after each test
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config(%s, 'journal', true)", [ACCOUNTING_SETTING])
+
+
+def accounting(node):
+    node = TreeNode.objects.with_exact_accounting().get(pk=node.pk)
+    return (node.file_count, node.size), (node.exact_file_count, node.exact_size)
+
+
+@mark.django_db
+def test_journal__defers_ancestor_updates(
+    treenode_stack, make_treenode, journal_accounting
+):
+    folder = treenode_stack["FOLDER"]
+    make_treenode(parent=folder, node_type="FILE", size=80)
+
+    # base values are unchanged until aggregation; exact values aren't
+    assert accounting(folder) == ((1, 420), (2, 500))
+    assert accounting(treenode_stack["ORGANIZATION"]) == ((2, 420), (3, 500))
+    assert TreeNodeAccountingDelta.objects.count() == 3
+
+    assert aggregate_journal() == 3
+    assert accounting(folder) == ((2, 500), (2, 500))
+    assert accounting(treenode_stack["ORGANIZATION"]) == ((3, 500), (3, 500))
+    assert not TreeNodeAccountingDelta.objects.exists()
+
+
+@mark.django_db
+def test_journal__aggregates_in_batches(
+    treenode_stack, make_treenode, journal_accounting
+):
+    folder = treenode_stack["FOLDER"]
+    file_node = treenode_stack["FILE"]
+    file_node.size = 20
+    file_node.save()
+    make_treenode(parent=folder, node_type="FILE", size=5)
+
+    assert aggregate_journal(batch_size=4) == 4
+    assert aggregate_journal(batch_size=4) == 2
+    assert aggregate_journal(batch_size=4) == 0
+    assert accounting(treenode_stack["COLLECTION"]) == ((3, 25), (3, 25))
+
+
+@mark.django_db
+def test_journal__move_carries_pending_deltas(
+    treenode_stack, make_treenode, journal_accounting
+):
+    collection = treenode_stack["COLLECTION"]
+    source = treenode_stack["FOLDER"]
+    dest = make_treenode(parent=collection, node_type="FOLDER", size=0)
+    # not aggregated before the move
+    make_treenode(parent=source, node_type="FILE", size=80)
+
+    source.parent = dest
+    source.save()
+    aggregate_journal()
+
+    assert accounting(source)[0] == (2, 500)
+    assert accounting(dest)[0] == (3, 500)
+    assert accounting(collection)[0] == (4, 500)
+
+
+@mark.django_db
+def test_collection_exact_accounting(
+    make_collection, make_treenode, journal_accounting
+):
+    collection = make_collection()
+    make_treenode(parent=collection.tree_node, node_type="FILE", size=80)
+
+    collection = Collection.objects.with_exact_accounting().get(pk=collection.pk)
+    assert (collection.exact_file_count, collection.exact_size) == (1, 80)
+
+
+@mark.django_db
+def test_immediate__updates_ancestors(treenode_stack, make_treenode):
+    make_treenode(parent=treenode_stack["FOLDER"], node_type="FILE", size=80)
+
+    assert not TreeNodeAccountingDelta.objects.exists()
+    assert accounting(treenode_stack["FOLDER"]) == ((2, 500), (2, 500))
+
+
+@mark.django_db
+def test_deferred_treenode_accounting__restores_setting(journal_accounting):
+    with deferred_treenode_accounting():
+        assert accounting_setting() == "deferred"
+    assert accounting_setting() == "journal"
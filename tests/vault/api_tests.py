@@ -1,10 +1,27 @@
+import asyncio
+import hashlib
 import json
+import time
+from datetime import timedelta
+from types import SimpleNamespace
 from unittest.mock import patch
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import Http404, HttpResponse
+from django.test import AsyncClient
 from django.urls import reverse
+from django.utils import timezone
 from model_bakery import baker
 import pytest
-from vault import api
-from vault.models import Collection, DepositFile, File, Organization, Report, TreeNode
+from vault import api, chunks
+from vault.models import (
+    Collection,
+    Deposit,
+    DepositFile,
+    File,
+    Organization,
+    Report,
+    TreeNode,
+)
 
 
 @pytest.mark.django_db
@@ -25,11 +42,10 @@ def test_api_collections(rf, coll_count):
 
 
 @pytest.mark.django_db
-@patch("vault.api.is_migration")
-def test_api_reports(mock_is_migration, rf):
-    # is_migration returns True for a hard-coded list of IDs.
-    # This causes the test to be flaky as ID sequences may not reset between runs.
-    mock_is_migration.return_value = False
+# Migration deposits are a hard-coded range of IDs. This causes the test to be
+# flaky as ID sequences may not reset between runs.
+@patch("vault.timeline.MIGRATION_DEPOSIT_IDS", (0, 0))
+def test_api_reports(rf):
     user = baker.make("vault.User", _fill_optional=["organization"])
     collection = baker.make("Collection", organization=user.organization)
     deposit = baker.make(
@@ -57,6 +73,91 @@ def test_api_reports(mock_is_migration, rf):
     assert len(reports) == 3
 
 
+@pytest.mark.django_db
+@patch("vault.timeline.MIGRATION_DEPOSIT_IDS", (0, 0))
+def test_api_reports__pages(rf):
+    """Deposits and Reports are merged newest first, a page at a time"""
+    user = baker.make("vault.User", _fill_optional=["organization"])
+    collection = baker.make("Collection", organization=user.organization)
+    now = timezone.now()
+    expected = []
+    for days in range(5):
+        deposit = baker.make(
+            "Deposit",
+            user=user,
+            organization=user.organization,
+            collection=collection,
+            parent_node_id=collection.tree_node.id,
+        )
+        # registered_at is auto_now_add
+        Deposit.objects.filter(pk=deposit.pk).update(
+            registered_at=now - timedelta(days=2 * days)
+        )
+        report = baker.make(
+            "Report",
+            collection=collection,
+            started_at=now - timedelta(days=2 * days + 1),
+        )
+        expected += [("Deposit", deposit.id), (report.report_type, report.id)]
+    # in another organization
+    baker.make("Report", started_at=now)
+
+    seen = []
+    params = {"limit": 3}
+    while True:
+        request = rf.get("/api/reports", params)
+        request.user = user
+        body = json.loads(api.reports(request).content)
+        assert len(body["reports"]) <= 3
+        seen += [(event["model"], event["id"]) for event in body["reports"]]
+        if body["next"] is None:
+            break
+        params["after"] = body["next"]
+    assert seen == expected
+
+    request = rf.get("/api/reports", {"after": "bogus"})
+    request.user = user
+    assert api.reports(request).status_code == 400
+
+
+@pytest.mark.django_db
+def test_report_files(rf):
+    user = baker.make("vault.User", _fill_optional=["organization"])
+    collection = baker.make("Collection", organization=user.organization)
+    report = baker.make(
+        "Report",
+        collection=collection,
+        report_type=Report.ReportType.FIXITY,
+        report_json_version=2,
+    )
+    for index, status in enumerate(["OK", "MISSING", "OK", "MISMATCH", "OK"]):
+        baker.make("FixityResult", report=report, filename=f"f{index}", status=status)
+
+    def get(**params):
+        query = "&".join(f"{key}={value}" for key, value in params.items())
+        request = rf.get(f"/api/report_files/{collection.id}/{report.id}?{query}")
+        request.user = user
+        return api.report_files(request, collection.id, report.id)
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        body = json.loads(get(**params).content)
+        pages.append([file_json["filename"] for file_json in body["files"]])
+        if body["next"] is None:
+            break
+        params["after"] = body["next"].rsplit("after=", 1)[1]
+    assert pages == [["f0", "f1"], ["f2", "f3"], ["f4"]]
+
+    body = json.loads(get(filter="errors").content)
+    assert [file_json["filename"] for file_json in body["files"]] == ["f1", "f3"]
+    assert not any(file_json["success"] for file_json in body["files"])
+    body = json.loads(get(filter="mismatches").content)
+    assert [file_json["filename"] for file_json in body["files"]] == ["f3"]
+    assert get(filter="bogus").status_code == 400
+    assert get(limit=0).status_code == 400
+
+
 @pytest.mark.django_db
 class TestWarningDepositApi:
     """
@@ -193,11 +294,10 @@ class TestEventsApi:
     API path: api/get_events
     """
 
-    @patch("vault.api.is_migration")
-    def test_deposit_events(self, mock_is_migration, rf):
-        # is_migration returns True for a hard-coded list of IDs.
-        # This causes the test to be flaky as ID sequences may not reset between runs.
-        mock_is_migration.return_value = False
+    # Migration deposits are a hard-coded range of IDs. This causes the test to
+    # be flaky as ID sequences may not reset between runs.
+    @patch("vault.timeline.MIGRATION_DEPOSIT_IDS", (0, 0))
+    def test_deposit_events(self, rf):
         user, collection = self.create_collection()
         self.deposit_files_in_db(user, collection)
         response = self.request_response(rf, collection, user)
@@ -240,3 +340,192 @@ class TestEventsApi:
 
     def create_fixity_event(self, collection):
         fixity_event = baker.make("Report", collection=collection, _quantity=1)
+
+
+@pytest.mark.django_db
+def test_api_flow_chunks_saved(rf, settings, tmp_path):
+    settings.FILE_UPLOAD_TEMP_DIR = tmp_path / "tmp"
+    settings.SHADIR_ROOT = tmp_path / "shadir"
+    user = baker.make("vault.User", _fill_optional=["organization"])
+    collection = baker.make("Collection", organization=user.organization)
+    deposit = baker.make(
+        "Deposit",
+        user=user,
+        organization=user.organization,
+        collection=collection,
+        parent_node_id=collection.tree_node.id,
+    )
+    baker.make("DepositFile", deposit=deposit, flow_identifier="10-a")
+    baker.make(
+        "DepositFile",
+        deposit=deposit,
+        flow_identifier="20-b",
+        state=DepositFile.State.UPLOADED,
+    )
+    chunk_dir = tmp_path / "tmp" / str(user.organization_id) / "chunks" / "10-a"
+    chunk_dir.mkdir(parents=True)
+    for number in (1, 2, 3, 5):
+        chunks.record_chunk_saved(str(chunk_dir), "10-a", number, 4)
+    for number in (1, 2):
+        chunks.record_chunk_digest(str(chunk_dir), "10-a", number, "ab" * 32)
+
+    request = rf.get(reverse("api_flow_chunks_saved"), {"deposit_id": deposit.id})
+    request.user = user
+    response = api.flow_chunks_saved(request)
+
+    assert response.status_code == 200
+    assert json.loads(response.content) == {
+        "deposit_id": deposit.id,
+        "files": {
+            "10-a": {
+                "state": "REGISTERED",
+                "chunks": [[1, 3], [5, 5]],
+                "verified": [[1, 2]],
+                "size": 16,
+            },
+            "20-b": {"state": "UPLOADED", "chunks": [], "verified": [], "size": 0},
+        },
+    }
+
+
+@pytest.mark.django_db
+def test_api_flow_chunk__verifies_chunk_digest(rf, settings, tmp_path):
+    settings.FILE_UPLOAD_TEMP_DIR = tmp_path / "tmp"
+    settings.FILE_UPLOAD_TEMP_DIR.mkdir()
+    settings.SHADIR_ROOT = tmp_path / "shadir"
+    user = baker.make("vault.User", _fill_optional=["organization"])
+    collection = baker.make("Collection", organization=user.organization)
+    deposit = baker.make(
+        "Deposit",
+        user=user,
+        organization=user.organization,
+        collection=collection,
+        parent_node_id=collection.tree_node.id,
+    )
+    baker.make("DepositFile", deposit=deposit, flow_identifier="8-a")
+    chunk_dir = chunks.file_chunk_dir(user.organization_id, "8-a")
+
+    def post(content, sha256_sum):
+        request = rf.post(
+            reverse("api_flow_chunk"),
+            {
+                "depositId": deposit.id,
+                "flowIdentifier": "8-a",
+                "flowFilename": "a",
+                "flowRelativePath": "a",
+                "flowChunkNumber": 1,
+                "flowChunkSize": 4,
+                "flowCurrentChunkSize": 4,
+                "flowTotalSize": 8,
+                "flowTotalChunks": 2,
+                "flowChunkSha256": sha256_sum,
+                "file": SimpleUploadedFile("blob", content),
+            },
+        )
+        request.user = user
+        return api.flow_chunk(request)
+
+    sha256_sum = hashlib.sha256(b"good").hexdigest()
+    response = post(b"b4d!", sha256_sum)
+    assert response.status_code == 400
+    assert not chunks.is_chunk_recorded(chunk_dir, "8-a", 1)
+
+    response = post(b"good", sha256_sum.upper())
+    assert response.status_code == 200
+    assert chunks.is_chunk_recorded(chunk_dir, "8-a", 1)
+    assert chunks.read_chunk_digests(chunk_dir, "8-a") == {1: sha256_sum}
+
+
+@pytest.mark.django_db
+def test_api_flow_chunk__only_saves_registered_files(rf, settings, tmp_path):
+    """Chunks are only saved for registered files with a safe identifier"""
+    settings.FILE_UPLOAD_TEMP_DIR = tmp_path / "tmp"
+    settings.FILE_UPLOAD_TEMP_DIR.mkdir()
+    settings.SHADIR_ROOT = tmp_path / "shadir"
+    user = baker.make("vault.User", _fill_optional=["organization"])
+    collection = baker.make("Collection", organization=user.organization)
+    deposit = baker.make(
+        "Deposit",
+        user=user,
+        organization=user.organization,
+        collection=collection,
+        parent_node_id=collection.tree_node.id,
+    )
+    baker.make("DepositFile", deposit=deposit, flow_identifier="8-a")
+
+    def post(flow_identifier):
+        request = rf.post(
+            reverse("api_flow_chunk"),
+            {
+                "depositId": deposit.id,
+                "flowIdentifier": flow_identifier,
+                "flowFilename": "a",
+                "flowRelativePath": "a",
+                "flowChunkNumber": 1,
+                "flowChunkSize": 4,
+                "flowCurrentChunkSize": 4,
+                "flowTotalSize": 4,
+                "flowTotalChunks": 1,
+                "file": SimpleUploadedFile("blob", b"blob"),
+            },
+        )
+        request.user = user
+        return api.flow_chunk(request)
+
+    assert post("../../escaped").status_code == 400
+    with pytest.raises(Http404):
+        post("8-b")
+    assert not any(tmp_path.rglob("*.tmp"))
+
+
+def test_api_flow_chunk_async__is_async_view():
+    """Django awaits the view, instead of running it in a thread"""
+    response = asyncio.run(AsyncClient().post(reverse("api_flow_chunk_async")))
+    # login_required of flow_chunk
+    assert response.status_code == 302
+
+
+def test_api_flow_chunk_async__closes_connection_while_waiting(rf):
+    """The connection of the user lookup isn't held while waiting for a slot"""
+    calls = []
+
+    def flow_chunk(request):
+        calls.append("flow_chunk")
+        return HttpResponse()
+
+    request = rf.post(reverse("api_flow_chunk_async"))
+    request.user = SimpleNamespace(is_authenticated=True, organization_id=1)
+    with patch("vault.api.flow_chunk", flow_chunk), patch(
+        "vault.api.close_old_connections", lambda: calls.append("close")
+    ):
+        asyncio.run(api.flow_chunk_async(request))
+
+    assert calls == ["close", "flow_chunk", "close"]
+
+
+def test_api_flow_chunk_async__bounds_concurrency_per_org(rf, settings):
+    settings.FLOW_CHUNK_ORG_CONCURRENCY = 2
+    saving = {1: 0, 2: 0}
+    peak = {1: 0, 2: 0}
+
+    def flow_chunk(request):
+        org_id = request.user.organization_id
+        saving[org_id] += 1
+        peak[org_id] = max(peak[org_id], saving[org_id])
+        time.sleep(0.05)
+        saving[org_id] -= 1
+        return HttpResponse()
+
+    def post(org_id):
+        request = rf.post(reverse("api_flow_chunk_async"))
+        request.user = SimpleNamespace(is_authenticated=True, organization_id=org_id)
+        return api.flow_chunk_async(request)
+
+    async def upload():
+        return await asyncio.gather(*(post(org_id) for org_id in [1] * 5 + [2] * 5))
+
+    with patch("vault.api.flow_chunk", flow_chunk):
+        responses = asyncio.run(upload())
+
+    assert all(response.status_code == 200 for response in responses)
+    assert peak == {1: 2, 2: 2}
@@ -0,0 +1,214 @@
+import hashlib
+import os
+
+import pytest
+
+from vault import chunks
+from vault.hashing import RESUMABLE_HASH_AVAILABLE
+
+pytestmark = pytest.mark.skipif(
+    not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable"
+)
+
+IDENTIFIER = "1234-file"
+
+
+def save_chunk(chunk_dir, number, content):
+    path = chunk_dir / chunks.chunk_filename(IDENTIFIER, number)
+    path.write_bytes(content)
+
+
+def test_advance_hash_checkpoint__in_order(tmp_path):
+    """Chunks saved in order are hashed as they arrive"""
+    save_chunk(tmp_path, 1, b"a" * 100)
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+    save_chunk(tmp_path, 2, b"b" * 100)
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+    save_chunk(tmp_path, 3, b"c" * 50)
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+
+    checkpoint = chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER)
+    content = b"a" * 100 + b"b" * 100 + b"c" * 50
+    assert checkpoint.hashed_chunks == 3
+    assert checkpoint.size == len(content)
+    assert checkpoint.hashes["md5"].hexdigest() == hashlib.md5(content).hexdigest()
+    assert (
+        checkpoint.hashes["sha256"].hexdigest() == hashlib.sha256(content).hexdigest()
+    )
+
+
+def test_advance_hash_checkpoint__out_of_order(tmp_path):
+    """Chunks arriving ahead of a missing chunk are hashed once it arrives"""
+    save_chunk(tmp_path, 2, b"b" * 100)
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+    assert chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER) is None
+
+    save_chunk(tmp_path, 1, b"a" * 100)
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+
+    checkpoint = chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER)
+    assert checkpoint.hashed_chunks == 2
+    assert checkpoint.size == 200
+
+
+def test_load_hash_checkpoint__invalid(tmp_path):
+    """A corrupt checkpoint is ignored"""
+    (tmp_path / chunks.hash_checkpoint_filename(IDENTIFIER)).write_text("{")
+
+    assert chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER) is None
+
+
+def test_remove_hash_checkpoint(tmp_path):
+    save_chunk(tmp_path, 1, b"a")
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 2)
+
+    chunks.remove_hash_checkpoint(str(tmp_path), IDENTIFIER)
+
+    assert os.listdir(tmp_path) == [chunks.chunk_filename(IDENTIFIER, 1)]
+
+
+def test_write_chunk_in_place(tmp_path):
+    """Chunks are written at their offset in the preallocated file, in any order"""
+    chunks.preallocate(str(tmp_path), IDENTIFIER, 250)
+    assert chunks.is_preallocated(str(tmp_path), IDENTIFIER)
+
+    chunks.write_chunk_in_place(str(tmp_path), IDENTIFIER, 3, 100, [b"c" * 50])
+    chunks.write_chunk_in_place(
+        str(tmp_path), IDENTIFIER, 1, 100, [b"a" * 60, b"a" * 40]
+    )
+    assert chunks.read_chunk_marker(str(tmp_path), IDENTIFIER, 2) is None
+    chunks.write_chunk_in_place(str(tmp_path), IDENTIFIER, 2, 100, [b"b" * 100])
+
+    path = tmp_path / chunks.preallocated_filename(IDENTIFIER)
+    assert path.read_bytes() == b"a" * 100 + b"b" * 100 + b"c" * 50
+    assert chunks.read_chunk_marker(str(tmp_path), IDENTIFIER, 3) == (200, 50)
+
+    # registering again keeps the chunks written
+    chunks.preallocate(str(tmp_path), IDENTIFIER, 250)
+    assert path.read_bytes()[:100] == b"a" * 100
+
+    chunks.remove_chunk_markers(str(tmp_path), IDENTIFIER)
+    assert os.listdir(tmp_path) == [chunks.preallocated_filename(IDENTIFIER)]
+
+
+def test_file_chunk_dir(settings, tmp_path):
+    settings.FILE_UPLOAD_TEMP_DIR = tmp_path
+
+    assert chunks.file_chunk_dir(7, IDENTIFIER) == str(
+        tmp_path / "7" / "chunks" / IDENTIFIER
+    )
+    for identifier in ("", "..", "../../8/chunks/x", "/etc"):
+        with pytest.raises(ValueError):
+            chunks.file_chunk_dir(7, identifier)
+
+
+def test_preallocate__outside_of_chunk_dir(tmp_path):
+    chunk_dir = tmp_path / "incoming"
+
+    with pytest.raises(ValueError):
+        chunks.preallocate(str(chunk_dir), "../escaped", 10)
+    assert not (tmp_path / "escaped.part").exists()
+
+
+def test_advance_hash_checkpoint__in_place(tmp_path):
+    """Chunks written in place are hashed from the preallocated file"""
+    chunks.preallocate(str(tmp_path), IDENTIFIER, 250)
+    chunks.write_chunk_in_place(str(tmp_path), IDENTIFIER, 2, 100, [b"b" * 100])
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+    assert chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER) is None
+
+    chunks.write_chunk_in_place(str(tmp_path), IDENTIFIER, 1, 100, [b"a" * 100])
+    chunks.advance_hash_checkpoint(str(tmp_path), IDENTIFIER, 3)
+
+    checkpoint = chunks.load_hash_checkpoint(str(tmp_path), IDENTIFIER)
+    content = b"a" * 100 + b"b" * 100
+    assert checkpoint.hashed_chunks == 2
+    assert checkpoint.size == 200
+    assert (
+        checkpoint.hashes["sha256"].hexdigest() == hashlib.sha256(content).hexdigest()
+    )
+
+
+def test_record_chunk_saved(tmp_path):
+    """Each chunk is counted once, however often it is recorded"""
+    assert chunks.read_chunk_progress(str(tmp_path), IDENTIFIER).chunks == 0
+    assert not chunks.is_chunk_recorded(str(tmp_path), IDENTIFIER, 9)
+
+    chunks.record_chunk_saved(str(tmp_path), IDENTIFIER, 9, 100)
+    chunks.record_chunk_saved(str(tmp_path), IDENTIFIER, 1, 100)
+    progress = chunks.record_chunk_saved(str(tmp_path), IDENTIFIER, 9, 100)
+
+    assert progress == chunks.ChunkProgress(chunks=2, size=200)
+    assert chunks.read_chunk_progress(str(tmp_path), IDENTIFIER) == progress
+    assert chunks.is_chunk_recorded(str(tmp_path), IDENTIFIER, 9)
+    assert not chunks.is_chunk_recorded(str(tmp_path), IDENTIFIER, 8)
+    assert not chunks.is_chunk_recorded(str(tmp_path), IDENTIFIER, 100)
+
+    chunks.remove_chunk_progress(str(tmp_path), IDENTIFIER)
+    assert os.listdir(tmp_path) == []
+
+
+def test_saved_chunk_ranges(tmp_path):
+    assert chunks.saved_chunk_ranges(str(tmp_path), IDENTIFIER) == []
+
+    for number in [*range(1, 20), 21, *range(30, 41)]:
+        chunks.record_chunk_saved(str(tmp_path), IDENTIFIER, number, 1)
+
+    assert chunks.saved_chunk_ranges(str(tmp_path), IDENTIFIER) == [
+        (1, 19),
+        (21, 21),
+        (30, 40),
+    ]
+
+
+def test_record_chunk_digest(tmp_path):
+    first = hashlib.sha256(b"first").hexdigest()
+    third = hashlib.sha256(b"third").hexdigest()
+    assert chunks.read_chunk_digests(str(tmp_path), IDENTIFIER) == {}
+
+    chunks.record_chunk_digest(str(tmp_path), IDENTIFIER, 3, third)
+    chunks.record_chunk_digest(str(tmp_path), IDENTIFIER, 1, first)
+
+    assert chunks.read_chunk_digests(str(tmp_path), IDENTIFIER) == {
+        1: first,
+        3: third,
+    }
+    chunks.remove_chunk_digests(str(tmp_path), IDENTIFIER)
+    assert os.listdir(tmp_path) == []
+
+
+def test_saved_chunk_paths(tmp_path):
+    assert chunks.saved_chunk_paths(str(tmp_path / "missing"), IDENTIFIER) == []
+    for number in (10, 2, 1):
+        save_chunk(tmp_path, number, b"x")
+    (tmp_path / chunks.chunk_progress_filename(IDENTIFIER)).write_bytes(b"")
+
+    assert chunks.saved_chunk_paths(str(tmp_path), IDENTIFIER) == [
+        str(tmp_path / chunks.chunk_filename(IDENTIFIER, number))
+        for number in (1, 2, 10)
+    ]
+
+
+def test_move_into_file_chunk_dirs(tmp_path, settings):
+    settings.FILE_UPLOAD_TEMP_DIR = tmp_path
+    org_chunks_dir = tmp_path / "1" / "chunks"
+    org_chunks_dir.mkdir(parents=True)
+    names = {
+        "10-a": ["10-a-1.tmp", "10-a-2.tmp", "10-a.progress", "10-a.hashstate"],
+        "20-b-2": ["20-b-2-1.tmp", "20-b-2.merged.tmp", "20-b-2.mergestate"],
+    }
+    for identifier_names in names.values():
+        for name in identifier_names:
+            (org_chunks_dir / name).write_bytes(name.encode())
+    (org_chunks_dir / "unrelated.txt").write_bytes(b"")
+
+    assert chunks.move_into_file_chunk_dirs(1) == 7
+    assert chunks.move_into_file_chunk_dirs(1) == 0
+
+    for identifier, identifier_names in names.items():
+        chunk_dir = chunks.file_chunk_dir(1, identifier)
+        assert sorted(os.listdir(chunk_dir)) == sorted(identifier_names)
+        for name in identifier_names:
+            with open(os.path.join(chunk_dir, name), "rb") as f:
+                assert f.read() == name.encode()
+    assert sorted(os.listdir(org_chunks_dir)) == ["10-a", "20-b-2", "unrelated.txt"]
@@ -0,0 +1,82 @@
+from model_bakery import baker
+from pytest import fixture, mark
+
+from vault.dedup import link_replicas
+from vault.models import DepositFile, Organization, TreeNode
+
+SHA256 = "a" * 64
+
+
+@fixture
+def make_org_collection(make_collection):
+    def maker():
+        org = baker.make(Organization)
+        return make_collection(parent_node=org.tree_node, organization=org)
+
+    return maker
+
+
+def make_hashed_file(make_treenode, collection, size=10, sha256_sum=SHA256):
+    deposit = baker.make(
+        "Deposit",
+        organization=collection.organization,
+        collection=collection,
+        parent_node=collection.tree_node,
+    )
+    tree_node = make_treenode(
+        parent=collection.tree_node, sha256_sum=sha256_sum, size=size
+    )
+    deposit_file = baker.make(
+        DepositFile,
+        deposit=deposit,
+        state=DepositFile.State.HASHED,
+        sha256_sum=sha256_sum,
+        size=size,
+        tree_node=tree_node,
+    )
+    # loaded like replication loads them, with the paths set by the database
+    return DepositFile.objects.select_related(
+        "tree_node", "deposit__organization__tree_node"
+    ).get(pk=deposit_file.pk)
+
+
+def make_replica(make_treenode, collection, pbox_path, size=10, state=None):
+    deposit_file = make_hashed_file(make_treenode, collection, size=size)
+    TreeNode.objects.filter(pk=deposit_file.tree_node_id).update(pbox_path=pbox_path)
+    DepositFile.objects.filter(pk=deposit_file.pk).update(
+        state=state or DepositFile.State.REPLICATED
+    )
+
+
+@mark.django_db
+def test_link_replicas__links_replicated_content(make_org_collection, make_treenode):
+    collection = make_org_collection()
+    make_replica(make_treenode, collection, "ITEM-00001/Deposit:1/a.txt")
+    deposit_file = make_hashed_file(make_treenode, collection)
+
+    assert link_replicas([deposit_file]) == [deposit_file]
+    tree_node = TreeNode.objects.get(pk=deposit_file.tree_node_id)
+    assert tree_node.pbox_path == "ITEM-00001/Deposit:1/a.txt"
+
+
+@mark.django_db
+def test_link_replicas__ignores_other_content(make_org_collection, make_treenode):
+    collection = make_org_collection()
+    other_collection = make_org_collection()
+    # replicated, but for another organization
+    make_replica(make_treenode, other_collection, "ITEM-00001/Deposit:1/a.txt")
+    # same digest, different size
+    make_replica(make_treenode, collection, "ITEM-00002/Deposit:2/a.txt", size=11)
+    # has a pbox_path, but its DepositFile isn't REPLICATED
+    make_replica(
+        make_treenode,
+        collection,
+        "ITEM-00003/Deposit:3/a.txt",
+        state=DepositFile.State.HASHED,
+    )
+    # not replicated yet
+    make_hashed_file(make_treenode, collection)
+    deposit_file = make_hashed_file(make_treenode, collection)
+
+    assert link_replicas([deposit_file]) == []
+    assert TreeNode.objects.get(pk=deposit_file.tree_node_id).pbox_path is None
@@ -3,6 +3,7 @@ from unittest.mock import patch
 
 import pytest
 from django.conf import settings
+from model_bakery import baker
 
 from vault import fixity_api
 from vault import models
@@ -10,16 +11,13 @@ from vault import models
 
 @pytest.mark.django_db
 @patch("requests.get")
-def test_postback(m_get, rf, make_collection, fixity_report_json_body):
-    """postback view calls fixitter to fetch report and creates Report inst"""
+def test_postback(m_get, rf, make_collection):
+    """postback view queues the report for import, without fetching it"""
     collection = make_collection()
     col_id = collection.id
     org_id = collection.organization.id
     token = "foobarbaz"
     api_key = settings.FIXITY_API_KEY
-    fixity_report = json.loads(fixity_report_json_body)
-
-    m_get.return_value.json.return_value = fixity_report
 
     body = {"reportUrl": "cool-report-url"}
     request = rf.post(
@@ -30,14 +28,103 @@ def test_postback(m_get, rf, make_collection, fixity_report_json_body):
     response = fixity_api.postback(request, org_id, col_id, token)
     assert response.status_code == 202
 
-    m_get.assert_called_once_with(
-        "cool-report-url",
-        params={"apikey": "FIXITTER_API_KEY", "format": "json"},
+    m_get.assert_not_called()
+    assert not models.Report.objects.exists()
+    (pending,) = models.PendingFixityReport.objects.all()
+    assert pending.collection_id == col_id
+    assert pending.report_url == "cool-report-url"
+
+
+@pytest.fixture
+def collection_tree(make_collection, make_treenode):
+    """A collection with files at its root, and in folder ``a`` and its
+    subfolder ``b``
+    """
+    org = baker.make(models.Organization)
+    collection = make_collection(parent_node=org.tree_node, organization=org)
+    folder_a = make_treenode(
+        parent=collection.tree_node, node_type="FOLDER", name="a", size=0
+    )
+    folder_b = make_treenode(parent=folder_a, node_type="FOLDER", name="b", size=0)
+    for parent, names in (
+        (collection.tree_node, ["root.txt"]),
+        (folder_a, ["a1.txt", "a2.txt", "a3.txt"]),
+        (folder_b, ["b1.txt"]),
+    ):
+        for name in names:
+            make_treenode(parent=parent, node_type="FILE", name=name, size=1)
+    return collection
+
+
+def get_listing(rf, collection, path="", **params):
+    org_id = collection.organization_id
+    query = "&".join(f"{key}={value}" for key, value in params.items())
+    request = rf.get(
+        f"/fixitter/files/{org_id}/{collection.name}/{path}"
+        f"?api_key={settings.FIXITY_API_KEY}&{query}"
+    )
+    return read_listing(request, collection, path)
+
+
+def follow_next(rf, collection, listing, path=""):
+    return read_listing(rf.get(listing["next"]), collection, path)
+
+
+def read_listing(request, collection, path):
+    org_id = collection.organization_id
+    response = fixity_api.list_files(request, org_id, f"{collection.name}/{path}")
+    assert response.status_code == 200
+    if response.streaming:
+        return json.loads(b"".join(response.streaming_content))
+    return json.loads(response.content)
+
+
+@pytest.mark.django_db
+def test_list_files__stream_matches_listing(rf, collection_tree):
+    """stream=1 lists the same files and children as the plain listing"""
+    listing = get_listing(rf, collection_tree, "a")
+    streamed = get_listing(rf, collection_tree, "a", stream=1)
+
+    assert sorted(f["filename"] for f in streamed["files"]) == sorted(
+        f["filename"] for f in listing["files"]
     )
+    assert [f["filename"] for f in streamed["files"]] == [
+        "a/a1.txt",
+        "a/a2.txt",
+        "a/a3.txt",
+    ]
+    assert list(streamed["children"]) == list(listing["children"]) == ["b"]
+    assert streamed["next"] is None
+
+
+@pytest.mark.django_db
+def test_list_files__stream_keyset_pagination(rf, collection_tree):
+    """limit pages through the files with the cursor in the next URL"""
+    first = get_listing(rf, collection_tree, "a", stream=1, limit=2)
+    assert [f["name"] for f in first["files"]] == ["a1.txt", "a2.txt"]
+    assert "after=a2.txt" in first["next"]
+    assert f"api_key={settings.FIXITY_API_KEY}" in first["next"]
+
+    second = follow_next(rf, collection_tree, first, "a")
+    assert [f["name"] for f in second["files"]] == ["a3.txt"]
+    assert second["children"] == {}
+    assert second["next"] is None
+
+
+@pytest.mark.django_db
+def test_list_files__stream_recursive(rf, collection_tree, monkeypatch):
+    """recursive=1 lists the whole subtree, across pages and batches"""
+    monkeypatch.setattr(fixity_api, "STREAM_BATCH_SIZE", 2)
+    page = get_listing(rf, collection_tree, stream=1, recursive=1, limit=2)
+    filenames = [f["filename"] for f in page["files"]]
+    while page["next"]:
+        page = follow_next(rf, collection_tree, page)
+        filenames += [f["filename"] for f in page["files"]]
 
-    all_reports = list(models.Report.objects.all())
-    assert len(all_reports) == 1
-    report = all_reports[0]
-    assert report.collection_id == col_id
-    assert report.report_type == models.Report.ReportType.FIXITY
-    assert report.report_json == fixity_report
+    assert sorted(filenames) == [
+        "a/a1.txt",
+        "a/a2.txt",
+        "a/a3.txt",
+        "a/b/b1.txt",
+        "root.txt",
+    ]
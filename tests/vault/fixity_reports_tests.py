@@ -0,0 +1,164 @@
+import json
+from unittest.mock import patch
+
+import pytest
+import requests
+from django.db import DataError
+from django.utils import timezone
+
+from vault import fixity_reports, models
+
+
+def chunked(data, size):
+    return [data[start : start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100000])
+def test_iter_report_items(fixity_report_json_body, size):
+    """Reports are parsed the same whatever the chunks they arrive in"""
+    report = json.loads(fixity_report_json_body)
+    items = list(
+        fixity_reports.iter_report_items(
+            chunked(fixity_report_json_body.encode(), size)
+        )
+    )
+
+    assert [value for key, value in items if key == "files"] == report["files"]
+    assert dict(item for item in items if item[0] != "files") == {
+        key: value for key, value in report.items() if key != "files"
+    }
+
+
+def test_iter_report_items__numbers_across_chunks():
+    data = b'{"fileCount": 12345, "files": [], "totalSize": 67890}'
+    items = list(fixity_reports.iter_report_items(chunked(data, 3)))
+    assert items == [("fileCount", 12345), ("totalSize", 67890)]
+
+
+def test_iter_report_items__multibyte_characters():
+    data = '{"files": [{"filename": "café/日本.txt"}]}'.encode()
+    items = list(fixity_reports.iter_report_items(chunked(data, 1)))
+    assert items == [("files", {"filename": "café/日本.txt"})]
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"[]", b'{"files": [{}', b'{"files": [] "fileCount": 1}']
+)
+def test_iter_report_items__invalid(data):
+    with pytest.raises(json.JSONDecodeError):
+        list(fixity_reports.iter_report_items([data]))
+
+
+@pytest.mark.django_db
+@patch("requests.get")
+def test_import_pending_reports(m_get, make_collection, fixity_report_json_body):
+    collection = make_collection()
+    pending = models.PendingFixityReport.objects.create(
+        collection=collection, report_url="cool-report-url"
+    )
+    m_get.return_value.iter_content.return_value = chunked(
+        fixity_report_json_body.encode(), 100
+    )
+
+    assert fixity_reports.import_pending_reports() == (1, 0)
+    m_get.assert_called_once_with(
+        "cool-report-url",
+        params={"apikey": "FIXITTER_API_KEY", "format": "json"},
+        stream=True,
+        timeout=fixity_reports.FIXITTER_TIMEOUT,
+    )
+    assert not models.PendingFixityReport.objects.filter(pk=pending.pk).exists()
+
+    fixity_report = json.loads(fixity_report_json_body)
+    report = models.Report.objects.get(collection=collection)
+    assert report.report_type == models.Report.ReportType.FIXITY
+    assert report.file_count == fixity_report["fileCount"]
+    assert report.total_size == fixity_report["totalSize"]
+    assert "files" not in report.report_json
+    files, next_after = report.files_page(None, 0, 100)
+    assert next_after is None
+    assert [file_json["filename"] for file_json in files] == [
+        file_json["filename"] for file_json in fixity_report["files"]
+    ]
+    assert files[0]["canonicalChecksums"] == (
+        fixity_report["files"][0]["canonicalChecksums"]
+    )
+
+
+@pytest.mark.django_db
+@patch("requests.get")
+def test_import_pending_reports__failure_is_retried(m_get, make_collection):
+    pending = models.PendingFixityReport.objects.create(
+        collection=make_collection(), report_url="cool-report-url"
+    )
+    m_get.side_effect = requests.ConnectionError("down")
+
+    assert fixity_reports.import_pending_reports() == (0, 1)
+    pending.refresh_from_db()
+    assert pending.attempts == 1
+    assert "down" in pending.last_error
+    assert pending.retry_after > timezone.now()
+    assert not models.Report.objects.exists()
+
+    # Not retried before its retry_after
+    assert fixity_reports.import_pending_reports() == (0, 0)
+    assert m_get.call_count == 1
+
+    pending.retry_after = timezone.now()
+    pending.save()
+    assert fixity_reports.import_pending_reports() == (0, 1)
+    pending.refresh_from_db()
+    assert pending.attempts == 2
+
+
+@pytest.mark.django_db
+@patch("requests.get")
+def test_import_pending_reports__unexpected_error_is_retried(m_get, make_collection):
+    pending = models.PendingFixityReport.objects.create(
+        collection=make_collection(), report_url="cool-report-url"
+    )
+    m_get.return_value.iter_content.side_effect = TypeError("bad")
+
+    assert fixity_reports.import_pending_reports() == (0, 1)
+    pending.refresh_from_db()
+    assert pending.attempts == 1
+    assert "bad" in pending.last_error
+    assert not models.Report.objects.exists()
+
+
+@pytest.mark.django_db
+@patch("requests.get")
+def test_import_pending_reports__gives_up(m_get, make_collection):
+    pending = models.PendingFixityReport.objects.create(
+        collection=make_collection(),
+        report_url="cool-report-url",
+        attempts=fixity_reports.MAX_IMPORT_ATTEMPTS - 1,
+    )
+    m_get.side_effect = requests.ConnectionError("down")
+
+    assert fixity_reports.import_pending_reports() == (0, 1)
+    pending.refresh_from_db()
+    assert pending.attempts == fixity_reports.MAX_IMPORT_ATTEMPTS
+
+    pending.retry_after = None
+    pending.save()
+    assert fixity_reports.import_pending_reports() == (0, 0)
+    assert m_get.call_count == 1
+
+
+@pytest.mark.django_db
+@patch("requests.get")
+def test_import_pending_reports__failure_not_recorded(m_get, make_collection):
+    """A failure to record a failed import doesn't stop the others"""
+    collection = make_collection()
+    for _ in range(2):
+        models.PendingFixityReport.objects.create(
+            collection=collection, report_url="cool-report-url"
+        )
+    m_get.side_effect = requests.ConnectionError("down")
+
+    with patch.object(
+        models.PendingFixityReport, "save", side_effect=DataError("overflow")
+    ):
+        assert fixity_reports.import_pending_reports() == (0, 2)
+    assert m_get.call_count == 2
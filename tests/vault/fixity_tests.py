@@ -0,0 +1,154 @@
+import hashlib
+from datetime import timedelta
+from pathlib import Path
+
+from django.utils import timezone
+from model_bakery import baker
+from pytest import fixture, mark, raises
+
+from vault import fixity, fixity_worker, models, shafs
+from vault.fixity_worker import hash_blob
+from vault.hashing import ALGORITHMS
+
+
+def digests(content):
+    return {name: hashlib.new(name, content).hexdigest() for name in ALGORITHMS}
+
+
+def test_hash_blob(tmp_path):
+    content = b"fixity" * 10000
+    path = tmp_path / "blob"
+    path.write_bytes(content)
+
+    check = hash_blob(str(path), buffer_size=4096)
+    assert check.size == len(content)
+    assert check.digests == digests(content)
+    assert check.error is None
+
+
+def test_hash_blob__throttled(tmp_path, monkeypatch):
+    """hash_blob sleeps when it reads faster than its rate"""
+    path = tmp_path / "blob"
+    path.write_bytes(b"x" * 8192)
+    sleeps = []
+    monkeypatch.setattr(fixity_worker.time, "sleep", sleeps.append)
+
+    hash_blob(str(path), max_bytes_per_second=1024, buffer_size=4096)
+    assert len(sleeps) == 2
+    assert sum(sleeps) > 7
+
+
+def test_hash_blob__missing(tmp_path):
+    check = hash_blob(str(tmp_path / "missing"))
+    assert check.digests == {}
+    assert check.error
+
+
+@fixture
+def checked_collection(tmp_path, settings, make_collection, make_treenode):
+    """A collection with an intact, a corrupted and a missing file"""
+    settings.SHADIR_ROOT = tmp_path
+    org = baker.make(models.Organization)
+    collection = make_collection(parent_node=org.tree_node, organization=org)
+    for name, content, stored in (
+        ("intact.txt", b"intact", b"intact"),
+        ("corrupt.txt", b"corrupt", b"c0rrupt"),
+        ("missing.txt", b"missing", None),
+    ):
+        sums = digests(content)
+        make_treenode(
+            parent=collection.tree_node,
+            name=name,
+            size=len(content),
+            **{f"{name}_sum": value for name, value in sums.items()},
+        )
+        if stored is not None:
+            path = Path(shafs.blob_path(org.id, sums["sha256"]))
+            path.parent.mkdir(parents=True)
+            path.write_bytes(stored)
+    return collection
+
+
+@mark.django_db
+def test_check_collection(checked_collection):
+    report = fixity.check_collection(
+        checked_collection, workers=2, max_bytes_per_second=0
+    )
+    assert report.report_type == models.Report.ReportType.FIXITY
+    assert report.file_count == 3
+    assert report.total_size == len(b"intact" + b"corrupt" + b"missing")
+    assert (report.error_count, report.missing_location_count) == (2, 1)
+    assert report.mismatch_count == 1
+
+    files = {f["filename"]: f for f in report.files_page(None, 0, 10)[0]}
+    assert list(files) == ["intact.txt", "corrupt.txt", "missing.txt"]
+    assert files["intact.txt"]["success"]
+    assert files["corrupt.txt"]["mismatchGroups"][1]["checksums"][2] == (
+        f"sha256:{hashlib.sha256(b'c0rrupt').hexdigest()}"
+    )
+    assert len(files["missing.txt"]["missingLocations"]) == 1
+    assert report.report_json["errors"] == {
+        "missingLocationCount": 1,
+        "mismatchCount": 1,
+    }
+
+
+@mark.django_db
+def test_due_files__least_recently_verified_first(checked_collection):
+    """Never verified files come first, then the least recently verified,
+    until the budget is spent, leaving out those without a local copy
+    """
+    files = list(
+        models.TreeNode.objects.filter(
+            parent=checked_collection.tree_node, node_type="FILE"
+        ).order_by("path")
+    )
+    files[0].last_verified_at = timezone.now() - timedelta(days=2)
+    files[0].save()
+    files[1].last_verified_at = timezone.now() - timedelta(days=1)
+    files[1].save()
+
+    due = [filename for filename, _ in fixity.due_files(checked_collection, 1)]
+    assert due == ["intact.txt"]
+    due = [filename for filename, _ in fixity.due_files(checked_collection, 10**9)]
+    assert due == ["intact.txt", "corrupt.txt"]
+
+
+@mark.django_db
+def test_run_scheduled(checked_collection):
+    checked_collection.fixity_frequency = models.FixityFrequency.MONTHLY
+    checked_collection.save()
+    checked_collection.tree_node.refresh_from_db()
+    assert fixity.daily_budget(checked_collection) == 1
+
+    (report,) = fixity.run_scheduled([checked_collection], workers=1)
+    assert report.file_count == 1
+    assert report.collection_file_count == 3
+    assert (
+        models.TreeNode.objects.filter(
+            parent=checked_collection.tree_node, last_verified_at__isnull=False
+        ).count()
+        == 1
+    )
+
+
+@mark.django_db
+def test_check_collection__only_passed_files_are_verified(checked_collection):
+    fixity.check_collection(checked_collection, workers=1, max_bytes_per_second=0)
+    verified = models.TreeNode.objects.filter(
+        parent=checked_collection.tree_node, last_verified_at__isnull=False
+    )
+    assert [node.name for node in verified] == ["intact.txt"]
+
+
+@mark.django_db
+def test_check_collection__failure_leaves_no_report(checked_collection):
+    def files():
+        yield from fixity.due_files(checked_collection, 1)
+        raise OSError("interrupted")
+
+    with raises(OSError):
+        fixity.check_collection(
+            checked_collection, workers=1, max_bytes_per_second=0, files=files()
+        )
+    assert not models.Report.objects.exists()
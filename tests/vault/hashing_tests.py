@@ -0,0 +1,55 @@
+import hashlib
+
+import pytest
+
+from vault.hashing import (
+    ALGORITHMS,
+    RESUMABLE_HASH_AVAILABLE,
+    MultiHash,
+    ResumableHash,
+)
+
+
+def test_multi_hash__matches_hashlib():
+    """MultiHash produces the same digests as hashlib over several updates"""
+    data = [b"a" * 5000, b"b" * 3, b"", b"c" * 100000]
+    with MultiHash() as hasher:
+        for buf in data:
+            hasher.update(buf)
+        digests = hasher.hexdigests()
+
+    joined = b"".join(data)
+    assert digests == {
+        "md5": hashlib.md5(joined).hexdigest(),
+        "sha1": hashlib.sha1(joined).hexdigest(),
+        "sha256": hashlib.sha256(joined).hexdigest(),
+    }
+
+
+def test_multi_hash__empty():
+    """MultiHash produces the digests of the empty string when not updated"""
+    with MultiHash() as hasher:
+        assert hasher.hexdigests()["sha256"] == hashlib.sha256(b"").hexdigest()
+
+
+@pytest.mark.skipif(not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable")
+@pytest.mark.parametrize("name", ALGORITHMS)
+def test_resumable_hash__state_round_trip(name):
+    """A ResumableHash restored from saved state continues the same digest"""
+    first = ResumableHash(name)
+    first.update(b"a" * 1000)
+    first.update(memoryview(bytearray(b"b" * 10)))
+
+    resumed = ResumableHash(name, first.state())
+    resumed.update(b"c" * 5)
+
+    expected = hashlib.new(name, b"a" * 1000 + b"b" * 10 + b"c" * 5).hexdigest()
+    assert resumed.hexdigest() == expected
+    # taking a digest doesn't finalize the hash
+    assert resumed.hexdigest() == expected
+
+
+@pytest.mark.skipif(not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable")
+def test_resumable_hash__invalid_state():
+    with pytest.raises(ValueError):
+        ResumableHash("sha256", b"too short")
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.utils import timezone
+import pytest
+
+from vault.models import Collection, Deposit, DepositFile
+from vault.management.commands.pipeline_latency import pipeline_latency
+
+
+@pytest.mark.django_db
+def test_pipeline_latency(super_user):
+    org = super_user.organization
+    coll = Collection.objects.create(name="Test Collection", organization=org)
+    deposit = Deposit.objects.create(
+        organization=org,
+        collection=coll,
+        user=super_user,
+        state=Deposit.State.HASHED,
+        parent_node_id=coll.tree_node.id,
+    )
+    uploaded_at = timezone.now()
+    for i in range(3):
+        DepositFile.objects.create(
+            deposit=deposit,
+            flow_identifier=str(i),
+            name=str(i),
+            relative_path=str(i),
+            size=100,
+            state=DepositFile.State.REPLICATED if i else DepositFile.State.HASHED,
+            uploaded_at=uploaded_at,
+            hashed_at=uploaded_at + timedelta(seconds=10 * (i + 1)),
+            replicated_at=uploaded_at + timedelta(seconds=60) if i else None,
+        )
+
+    latency = pipeline_latency(uploaded_at - timedelta(hours=1))
+
+    assert latency["upload->hash"]["count"] == 3
+    assert latency["upload->hash"]["p50"] == timedelta(seconds=20)
+    assert latency["upload->hash"]["max"] == timedelta(seconds=30)
+    assert latency["hash->replicate"]["count"] == 2
+    assert latency["upload->replicate"]["avg"] == timedelta(seconds=60)
@@ -0,0 +1,90 @@
+from model_bakery import baker
+from pytest import fixture, mark
+
+from vault.materialize import materialize_deposit_files
+from vault.models import DepositFile, TreeNode
+
+
+@fixture
+def make_deposit(make_collection):
+    def maker(collection=None):
+        collection = collection or make_collection()
+        return baker.make(
+            "Deposit",
+            organization=collection.organization,
+            collection=collection,
+            parent_node=collection.tree_node,
+        )
+
+    return maker
+
+
+def make_hashed_file(deposit, relative_path, size):
+    return baker.make(
+        DepositFile,
+        deposit=deposit,
+        state=DepositFile.State.HASHED,
+        relative_path=relative_path,
+        name=relative_path.split("/")[-1],
+        size=size,
+    )
+
+
+@mark.django_db
+def test_materialize_deposit_files__creates_tree(make_deposit):
+    deposit = make_deposit()
+    make_hashed_file(deposit, "a/b/one.txt", 10)
+    make_hashed_file(deposit, "a/b/two.txt", 20)
+    make_hashed_file(deposit, "a/three.txt", 30)
+    make_hashed_file(deposit, "four.txt", 40)
+
+    materialized = materialize_deposit_files(deposit)
+
+    assert len(materialized) == 4
+    assert not DepositFile.objects.filter(
+        deposit=deposit, tree_node__isnull=True
+    ).exists()
+    folder_a = TreeNode.objects.get(parent=deposit.parent_node, name="a")
+    folder_b = TreeNode.objects.get(parent=folder_a, name="b")
+    assert folder_b.node_type == TreeNode.Type.FOLDER
+    assert folder_b.path.startswith(folder_a.path + ".")
+    assert (folder_b.file_count, folder_b.size) == (2, 30)
+    # file_count includes folders
+    assert (folder_a.file_count, folder_a.size) == (4, 60)
+    collection_node = TreeNode.objects.get(pk=deposit.parent_node_id)
+    assert (collection_node.file_count, collection_node.size) == (6, 100)
+    org_node = collection_node.parent
+    assert (org_node.file_count, org_node.size) == (6, 100)
+
+    one = DepositFile.objects.get(deposit=deposit, name="one.txt").tree_node
+    assert one.parent_id == folder_b.id
+    assert one.size == 10
+
+
+@mark.django_db
+def test_materialize_deposit_files__replaces_existing_files(make_deposit):
+    first = make_deposit()
+    make_hashed_file(first, "a/one.txt", 10)
+    materialize_deposit_files(first)
+
+    second = make_deposit(first.collection)
+    make_hashed_file(second, "a/one.txt", 25)
+    make_hashed_file(second, "a/two.txt", 5)
+    materialize_deposit_files(second)
+
+    folder_a = TreeNode.objects.get(parent=first.parent_node, name="a")
+    assert TreeNode.objects.filter(parent=folder_a, name="one.txt").count() == 1
+    assert (folder_a.file_count, folder_a.size) == (2, 30)
+    collection_node = TreeNode.objects.get(pk=first.parent_node_id)
+    assert (collection_node.file_count, collection_node.size) == (3, 30)
+
+
+@mark.django_db
+def test_materialize_deposit_files__skips_materialized_files(make_deposit):
+    deposit = make_deposit()
+    make_hashed_file(deposit, "one.txt", 10)
+    assert len(materialize_deposit_files(deposit)) == 1
+    assert materialize_deposit_files(deposit) == []
+
+    collection_node = TreeNode.objects.get(pk=deposit.parent_node_id)
+    assert (collection_node.file_count, collection_node.size) == (1, 10)
@@ -0,0 +1,211 @@
+import hashlib
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from vault.chunks import HashCheckpoint
+from vault.hashing import ALGORITHMS, RESUMABLE_HASH_AVAILABLE, ResumableHash
+from vault.merge import (
+    IN_PLACE,
+    CopyMethod,
+    MergeAborted,
+    hash_in_place,
+    merge_chunks,
+    verify_partial_merge,
+)
+
+
+@pytest.fixture
+def chunk_paths(tmp_path):
+    contents = [b"x" * 10, b"", b"y" * 1000, b"z" * 7]
+    paths = []
+    for i, content in enumerate(contents, 1):
+        path = tmp_path / f"identifier-{i}.tmp"
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths, b"".join(contents)
+
+
+@pytest.mark.parametrize(
+    "copy_method", [v for k, v in vars(CopyMethod).items() if k.isupper()]
+)
+def test_merge_chunks(tmp_path, chunk_paths, copy_method):
+    """merge_chunks concatenates chunks and hashes the result with any copy method"""
+    paths, expected = chunk_paths
+    dest = tmp_path / "identifier.merged.tmp"
+
+    # a small buffer size exercises buffer alternation
+    result = merge_chunks(paths, str(dest), buffer_size=64, copy_method=copy_method)
+
+    assert dest.read_bytes() == expected
+    assert result.size == len(expected)
+    assert result.digests["md5"] == hashlib.md5(expected).hexdigest()
+    assert result.digests["sha1"] == hashlib.sha1(expected).hexdigest()
+    assert result.digests["sha256"] == hashlib.sha256(expected).hexdigest()
+
+
+def test_merge_chunks__truncates_partial_output(tmp_path, chunk_paths):
+    """merge_chunks overwrites output left behind by an interrupted merge"""
+    paths, expected = chunk_paths
+    dest = tmp_path / "identifier.merged.tmp"
+    dest.write_bytes(b"partial output" * 100)
+
+    merge_chunks(paths, str(dest))
+
+    assert dest.read_bytes() == expected
+
+
+def test_merge_chunks__falls_back_to_write(tmp_path, chunk_paths):
+    """merge_chunks writes from its buffer when in-kernel copies are unsupported"""
+    paths, expected = chunk_paths
+    dest = tmp_path / "identifier.merged.tmp"
+    with patch("os.copy_file_range", side_effect=OSError(18, "EXDEV")), patch(
+        "os.sendfile", side_effect=OSError(22, "EINVAL")
+    ):
+        result = merge_chunks(paths, str(dest))
+
+    assert result.copy_method == CopyMethod.WRITE
+    assert dest.read_bytes() == expected
+
+
+def test_merge_chunks__empty_file(tmp_path):
+    """merge_chunks creates an empty file from a single empty chunk"""
+    chunk = tmp_path / "identifier-1.tmp"
+    chunk.write_bytes(b"")
+    dest = tmp_path / "identifier.merged.tmp"
+
+    result = merge_chunks([str(chunk)], str(dest))
+
+    assert dest.exists()
+    assert result.size == 0
+    assert result.digests["sha256"] == hashlib.sha256(b"").hexdigest()
+
+
+@pytest.mark.skipif(not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable")
+def test_merge_chunks__resumes_hashing(tmp_path, chunk_paths):
+    """merge_chunks only hashes chunks after those already hashed"""
+    paths, expected = chunk_paths
+    hashes = {name: ResumableHash(name) for name in ALGORITHMS}
+    for path in paths[:2]:
+        for _hash in hashes.values():
+            _hash.update(open(path, "rb").read())
+    dest = tmp_path / "identifier.merged.tmp"
+
+    result = merge_chunks(paths, str(dest), hashes=hashes, hashed_chunks=2)
+
+    assert dest.read_bytes() == expected
+    assert result.size == len(expected)
+    assert result.digests["sha1"] == hashlib.sha1(expected).hexdigest()
+    assert result.digests["sha256"] == hashlib.sha256(expected).hexdigest()
+
+
+def test_merge_chunks__aborted(tmp_path, chunk_paths):
+    """merge_chunks stops once its abort event is set"""
+    paths, _ = chunk_paths
+    abort = threading.Event()
+    abort.set()
+
+    with pytest.raises(MergeAborted):
+        merge_chunks(paths, str(tmp_path / "identifier.merged.tmp"), abort=abort)
+
+
+def test_hash_in_place__aborted(tmp_path):
+    """hash_in_place stops once its abort event is set"""
+    path = tmp_path / "identifier.part"
+    path.write_bytes(b"x" * 1000)
+    abort = threading.Event()
+    abort.set()
+
+    with pytest.raises(MergeAborted):
+        hash_in_place(str(path), abort=abort)
+
+
+def test_hash_in_place(tmp_path):
+    """hash_in_place hashes a file without copying it"""
+    content = b"x" * 1000 + b"y" * 7
+    path = tmp_path / "identifier.part"
+    path.write_bytes(content)
+
+    result = hash_in_place(str(path), buffer_size=64)
+
+    assert result.copy_method == IN_PLACE
+    assert result.size == len(content)
+    assert result.digests["md5"] == hashlib.md5(content).hexdigest()
+    assert result.digests["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.skipif(not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable")
+def test_hash_in_place__resumes_hashing(tmp_path):
+    """hash_in_place only hashes bytes after those already hashed"""
+    content = b"x" * 1000 + b"y" * 7
+    path = tmp_path / "identifier.part"
+    path.write_bytes(content)
+    hashes = {name: ResumableHash(name) for name in ALGORITHMS}
+    for _hash in hashes.values():
+        _hash.update(content[:1000])
+
+    result = hash_in_place(str(path), hashes=hashes, hashed_size=1000)
+
+    assert result.size == len(content)
+    assert result.digests["sha1"] == hashlib.sha1(content).hexdigest()
+    assert result.digests["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+@pytest.mark.skipif(not RESUMABLE_HASH_AVAILABLE, reason="libcrypto unavailable")
+def test_merge_chunks__resumes_from_checkpoint(tmp_path, chunk_paths):
+    """An interrupted merge resumes from its last checkpoint, dropping the
+    bytes written after it
+    """
+    paths, expected = chunk_paths
+    dest = tmp_path / "identifier.merged.tmp"
+    checkpoints = []
+
+    def checkpoint(chunks, size, hashes):
+        checkpoints.append(
+            HashCheckpoint(next_chunk=chunks + 1, size=size, hashes=hashes).to_json()
+        )
+        if chunks == 3:
+            raise KeyboardInterrupt  # killed
+
+    with pytest.raises(KeyboardInterrupt):
+        merge_chunks(
+            paths,
+            str(dest),
+            hashes={name: ResumableHash(name) for name in ALGORITHMS},
+            checkpoint=checkpoint,
+            checkpoint_interval=1,
+        )
+    resumed = HashCheckpoint.from_json(checkpoints[-1])
+    assert (resumed.hashed_chunks, resumed.size) == (3, 1010)
+    with open(dest, "ab") as f:
+        f.write(b"written after the checkpoint")
+    assert verify_partial_merge(paths, str(dest), 3, 1010)
+
+    result = merge_chunks(
+        paths,
+        str(dest),
+        hashes=resumed.hashes,
+        merged_chunks=3,
+        merged_size=1010,
+    )
+
+    assert dest.read_bytes() == expected
+    assert result.size == len(expected)
+    assert result.digests["md5"] == hashlib.md5(expected).hexdigest()
+    assert result.digests["sha256"] == hashlib.sha256(expected).hexdigest()
+
+
+def test_verify_partial_merge(tmp_path, chunk_paths):
+    paths, expected = chunk_paths
+    dest = tmp_path / "identifier.merged.tmp"
+    dest.write_bytes(expected[:1010])
+
+    assert verify_partial_merge(paths, str(dest), 3, 1010)
+    # sizes don't add up
+    assert not verify_partial_merge(paths, str(dest), 3, 1000)
+    # truncated
+    assert not verify_partial_merge(paths, str(dest), 4, 1017)
+
+    dest.write_bytes(expected[:1009] + b"!")
+    assert not verify_partial_merge(paths, str(dest), 3, 1010)
@@ -3,12 +3,15 @@ from django.db.transaction import atomic
 import django.db
 
 from freezegun import freeze_time
+from model_bakery import baker
 from pytest import (
     mark,
     raises,
 )
 
 from vault.models import (
+    DepositFile,
+    PetaboxItem,
     Report,
     TreeNode,
     TreeNodeException,
@@ -923,6 +926,109 @@ class TestTreeNodeAccountingTriggers:
         assert folder.file_count == 1
 
 
+class TestDepositFile:
+    """Tests for DepositFile lease management"""
+
+    @staticmethod
+    def make_deposit_files(make_collection, quantity):
+        collection = make_collection()
+        deposit = baker.make(
+            "Deposit",
+            organization=collection.organization,
+            collection=collection,
+            parent_node=collection.tree_node,
+        )
+        return baker.make(
+            DepositFile,
+            deposit=deposit,
+            state=DepositFile.State.UPLOADED,
+            _quantity=quantity,
+        )
+
+    @mark.django_db
+    def test_claim_next__claims_oldest_unleased(self, make_collection):
+        """claim_next leases DepositFiles in id order, one worker at a time"""
+        first, second = self.make_deposit_files(make_collection, 2)
+
+        claimed = DepositFile.claim_next(DepositFile.State.UPLOADED, "a", 60)
+        assert claimed.pk == first.pk
+        assert claimed.lease_owner == "a"
+
+        claimed = DepositFile.claim_next(DepositFile.State.UPLOADED, "b", 60)
+        assert claimed.pk == second.pk
+
+        assert DepositFile.claim_next(DepositFile.State.UPLOADED, "c", 60) is None
+
+    @mark.django_db
+    def test_claim_next__respects_exclude_ids(self, make_collection):
+        """claim_next skips excluded DepositFiles"""
+        first, second = self.make_deposit_files(make_collection, 2)
+        claimed = DepositFile.claim_next(
+            DepositFile.State.UPLOADED, "a", 60, exclude_ids={first.pk}
+        )
+        assert claimed.pk == second.pk
+
+    @mark.django_db
+    def test_claim_next__reclaims_expired_lease(self, make_collection):
+        """A crashed worker's expired lease may be claimed by another worker"""
+        (deposit_file,) = self.make_deposit_files(make_collection, 1)
+        with freeze_time("2022-01-01 00:00:00"):
+            DepositFile.claim_next(DepositFile.State.UPLOADED, "crashed", 60)
+        with freeze_time("2022-01-01 00:00:30"):
+            assert DepositFile.claim_next(DepositFile.State.UPLOADED, "b", 60) is None
+        with freeze_time("2022-01-01 00:01:01"):
+            claimed = DepositFile.claim_next(DepositFile.State.UPLOADED, "b", 60)
+        assert claimed.pk == deposit_file.pk
+        assert claimed.lease_owner == "b"
+
+    @mark.django_db
+    def test_file_state_totals__follow_transitions(self, make_collection):
+        """DepositFile state counts are kept up to date by a trigger"""
+        first, second = self.make_deposit_files(make_collection, 2)
+        deposit = first.deposit
+        DepositFile.objects.filter(pk=first.pk).update(size=10)
+        DepositFile.objects.filter(pk=second.pk).update(size=5)
+
+        first.refresh_from_db()
+        first.state = DepositFile.State.HASHED
+        first.save()
+        baker.make(DepositFile, deposit=deposit, size=1)
+
+        state_count, state_sizes = deposit.file_state_totals()
+        assert state_count == {"UPLOADED": 1, "HASHED": 1, "REGISTERED": 1}
+        assert state_sizes == {"UPLOADED": 5, "HASHED": 10, "REGISTERED": 1}
+
+        second.delete()
+        state_count, state_sizes = deposit.file_state_totals()
+        assert state_count["UPLOADED"] == 0
+        assert state_sizes["UPLOADED"] == 0
+
+    @mark.django_db
+    def test_renew_and_release_lease(self, make_collection):
+        """Only the lease owner may renew or release a lease"""
+        self.make_deposit_files(make_collection, 1)
+        claimed = DepositFile.claim_next(DepositFile.State.UPLOADED, "a", 60)
+        assert claimed.renew_lease("a", 60)
+        assert not claimed.renew_lease("b", 60)
+
+        claimed.release_lease("a")
+        claimed.refresh_from_db()
+        assert claimed.lease_owner is None
+        assert claimed.lease_expires_at is None
+
+    @mark.django_db
+    def test_save_if_leased(self, make_collection):
+        """Only the lease owner may save a claimed file"""
+        self.make_deposit_files(make_collection, 1)
+        claimed = DepositFile.claim_next(DepositFile.State.UPLOADED, "a", 60)
+        claimed.state = DepositFile.State.HASHED
+        assert not claimed.save_if_leased("b", ["state"])
+        assert DepositFile.objects.get(pk=claimed.pk).state == "UPLOADED"
+
+        assert claimed.save_if_leased("a", ["state"])
+        assert DepositFile.objects.get(pk=claimed.pk).state == "HASHED"
+
+
 class TestReport:
     """Tests for the Report model"""
 
@@ -1007,3 +1113,101 @@ def test_organization_type_treenode_name_length_cannot_exceed_organization_name_
     node.name += "!"
     with raises(FieldError):
         node.save()
+
+
+class TestPetaboxItem:
+    """Tests for allocating DepositFiles to Petabox items"""
+
+    @staticmethod
+    def make_deposit_files(make_collection, sizes):
+        collection = make_collection()
+        deposit = baker.make(
+            "Deposit",
+            organization=collection.organization,
+            collection=collection,
+            parent_node=collection.tree_node,
+        )
+        return [baker.make(DepositFile, deposit=deposit, size=size) for size in sizes]
+
+    @mark.django_db
+    def test_allocate__packs_items_in_sequence(self, make_collection, monkeypatch):
+        monkeypatch.setattr(PetaboxItem, "MAX_FILES", 2)
+        deposit_files = self.make_deposit_files(make_collection, [1, 2, 3])
+        org_id = deposit_files[0].deposit.organization_id
+
+        PetaboxItem.allocate(org_id, "PREFIX", deposit_files)
+
+        first, second = PetaboxItem.objects.order_by("sequence")
+        assert first.name == "PREFIX-00001"
+        assert (first.allocated_file_count, first.allocated_size) == (2, 3)
+        assert second.name == "PREFIX-00002"
+        assert (second.allocated_file_count, second.allocated_size) == (1, 3)
+        assert [f.pbox_item_id for f in DepositFile.objects.order_by("id")] == [
+            first.pk,
+            first.pk,
+            second.pk,
+        ]
+
+    @mark.django_db
+    def test_allocate__continues_last_item(self, make_collection, monkeypatch):
+        monkeypatch.setattr(PetaboxItem, "MAX_BYTES", 10)
+        deposit_files = self.make_deposit_files(make_collection, [4, 4, 20])
+        org_id = deposit_files[0].deposit.organization_id
+
+        PetaboxItem.allocate(org_id, "PREFIX", deposit_files[:1])
+        PetaboxItem.allocate(org_id, "PREFIX", deposit_files[1:])
+
+        first, second = PetaboxItem.objects.order_by("sequence")
+        assert (first.allocated_file_count, first.allocated_size) == (2, 8)
+        # files larger than an item get an item of their own
+        assert (second.allocated_file_count, second.allocated_size) == (1, 20)
+
+    @mark.django_db
+    def test_record_upload(self, make_collection):
+        deposit_files = self.make_deposit_files(make_collection, [5])
+        org_id = deposit_files[0].deposit.organization_id
+        (item,) = PetaboxItem.allocate(org_id, "PREFIX", deposit_files)
+
+        PetaboxItem.record_upload(item.pk, 5)
+
+        item.refresh_from_db()
+        assert (item.file_count, item.size) == (1, 5)
+
+    @mark.django_db
+    def test_release(self, make_collection):
+        deposit_files = self.make_deposit_files(make_collection, [5, 7])
+        org_id = deposit_files[0].deposit.organization_id
+        (item,) = PetaboxItem.allocate(org_id, "PREFIX", deposit_files)
+        # loaded before it was allocated
+        stale = DepositFile.objects.get(pk=deposit_files[1].pk)
+        stale.pbox_item = None
+
+        PetaboxItem.release([stale])
+
+        item.refresh_from_db()
+        assert (item.allocated_file_count, item.allocated_size) == (1, 5)
+        assert stale.pbox_item_id is None
+        assert DepositFile.objects.get(pk=stale.pk).pbox_item_id is None
+
+
+def test_report_files_page__report_json():
+    """Reports from before FixityResults page through their report_json"""
+    report = Report(
+        report_json={
+            "files": [{"filename": str(i), "success": i % 2 == 0} for i in range(5)]
+        }
+    )
+
+    assert report.files_page(None, 0, 2) == (
+        [{"filename": "0", "success": True}, {"filename": "1", "success": False}],
+        2,
+    )
+    assert report.files_page(None, 4, 2) == ([{"filename": "4", "success": True}], None)
+    assert report.files_page("errors", 0, 1) == (
+        [{"filename": "1", "success": False}],
+        2,
+    )
+    assert report.files_page("errors", 2, 1) == (
+        [{"filename": "3", "success": False}],
+        None,
+    )
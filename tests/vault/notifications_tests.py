@@ -0,0 +1,21 @@
+import threading
+from unittest.mock import patch
+
+import psycopg2
+
+from vault.notifications import StateListener
+
+
+def test_state_listener__degrades_to_sleeping():
+    """StateListener waits out the timeout when it can't listen"""
+    with patch("psycopg2.connect", side_effect=psycopg2.OperationalError("down")):
+        with StateListener(["UPLOADED"]) as listener:
+            assert listener.wait(0.01) is False
+
+
+def test_state_listener__returns_on_shutdown():
+    shutdown = threading.Event()
+    shutdown.set()
+    with patch("psycopg2.connect", side_effect=psycopg2.OperationalError("down")):
+        with StateListener(["UPLOADED"], shutdown) as listener:
+            assert listener.wait(60) is False
@@ -0,0 +1,200 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from requests import Response
+from requests.exceptions import HTTPError
+
+from vault.models import PetaboxItem
+from vault.petabox import AIMDLimiter, PetaboxUploader, reconcile_items, seed_items
+
+
+def test_aimd_limiter__additive_increase_multiplicative_decrease():
+    limiter = AIMDLimiter(8, backoff_seconds=0)
+
+    limiter.on_slowdown()
+    assert limiter.limit == 4
+    limiter.on_slowdown()
+    assert limiter.limit == 2
+
+    for _ in range(10):
+        limiter.on_success()
+    assert 4 < limiter.limit <= 8
+
+    for _ in range(10):
+        limiter.on_slowdown()
+    assert limiter.limit == 1
+
+
+def test_aimd_limiter__bounds_concurrency():
+    limiter = AIMDLimiter(2)
+    shutdown = threading.Event()
+    assert limiter.acquire(shutdown)
+    assert limiter.acquire(shutdown)
+
+    # a third upload waits until shutdown
+    shutdown.set()
+    assert not limiter.acquire(shutdown)
+
+    limiter.release()
+    assert limiter.in_flight == 1
+
+
+def test_aimd_limiter__backoff_doubles():
+    limiter = AIMDLimiter(4, backoff_seconds=1, max_backoff_seconds=3)
+
+    assert limiter.on_slowdown() == 1
+    assert limiter.on_slowdown() == 2
+    assert limiter.on_slowdown() == 3
+    limiter.on_success()
+    assert limiter.on_slowdown() == 1
+
+
+def response(status_code):
+    resp = Response()
+    resp.status_code = status_code
+    return resp
+
+
+@pytest.fixture
+def deposit_file_path(tmp_path):
+    path = tmp_path / "sha256"
+    path.write_bytes(b"content")
+    return str(path)
+
+
+@pytest.fixture
+def ia_item():
+    item = MagicMock()
+    with patch("vault.petabox.get_session") as get_session:
+        get_session.return_value.get_item.return_value = item
+        yield item
+
+
+def test_petabox_uploader__retries_slowdowns(ia_item, deposit_file_path):
+    """Uploads are retried after 503 Slow Down, and counted"""
+    ia_item.upload.side_effect = [
+        HTTPError(response=response(503)),
+        [response(200)],
+    ]
+    with PetaboxUploader(workers=2) as uploader:
+        uploader.limiter.base_backoff_seconds = 0
+        uploader.limiter._backoff_seconds = 0
+        result = uploader.submit(
+            "item", "Deposit:1/file", deposit_file_path, 7, None, {}
+        ).result()
+
+    assert result.status_code == 200
+    assert result.item_file_path == "item/Deposit:1/file"
+    assert uploader.stats.files == 1
+    assert uploader.stats.bytes == 7
+    assert uploader.stats.slowdowns == 1
+    assert uploader.stats.retries == 1
+
+
+def test_petabox_uploader__sends_content_md5(ia_item, deposit_file_path):
+    """Known md5 digests are sent instead of being recomputed by the library"""
+    ia_item.upload.return_value = [response(200)]
+    with PetaboxUploader() as uploader:
+        uploader.submit(
+            "item",
+            "Deposit:1/file",
+            deposit_file_path,
+            7,
+            "9a0364b9e99bb480dd25e1f0284c8555",
+            {},
+        ).result()
+
+    kwargs = ia_item.upload.call_args.kwargs
+    assert kwargs["verify"] is False
+    assert kwargs["headers"]["Content-MD5"] == "9a0364b9e99bb480dd25e1f0284c8555"
+
+
+def test_petabox_uploader__failure(ia_item, deposit_file_path):
+    ia_item.upload.side_effect = HTTPError(response=response(403))
+    with PetaboxUploader() as uploader:
+        result = uploader.submit(
+            "item", "Deposit:1/file", deposit_file_path, 7, None, {}
+        ).result()
+
+    assert result.status_code == 403
+    assert uploader.stats.failures == 1
+    assert ia_item.upload.call_count == 1
+
+
+def test_petabox_uploader__holds_back_saturated_items(ia_item, deposit_file_path):
+    """Uploads to an item with per_item uploads in flight are held back
+    without taking up a worker thread, so that other items' uploads run
+    """
+    started = threading.Event()
+    finish = threading.Event()
+
+    def upload(files, **kwargs):
+        if "Deposit:1/first" in files:
+            started.set()
+            finish.wait(5)
+        return [response(200)]
+
+    ia_item.upload.side_effect = upload
+    with PetaboxUploader(workers=2, per_item=1) as uploader:
+        first = uploader.submit("a", "Deposit:1/first", deposit_file_path, 7, None, {})
+        assert started.wait(5)
+        second = uploader.submit(
+            "a", "Deposit:1/second", deposit_file_path, 7, None, {}
+        )
+        other = uploader.submit("b", "Deposit:2/other", deposit_file_path, 7, None, {})
+
+        assert other.result(5).status_code == 200
+        assert not second.done()
+        finish.set()
+        assert first.result(5).status_code == 200
+        assert second.result(5).status_code == 200
+
+    assert uploader.scheduled == 0
+
+
+@pytest.mark.django_db
+def test_reconcile_items(make_collection):
+    """Recorded counts follow Petabox; allocated counts are only raised"""
+    collection = make_collection()
+    item = PetaboxItem.objects.create(
+        organization=collection.organization,
+        name="PREFIX-00001",
+        prefix="PREFIX",
+        sequence=1,
+        file_count=1,
+        size=10,
+        allocated_file_count=3,
+        allocated_size=30,
+    )
+    session = MagicMock()
+    session.get_item.return_value.exists = True
+    session.get_item.return_value.files_count = 2
+    session.get_item.return_value.item_size = 50
+
+    reconcile_items(session)
+
+    item.refresh_from_db()
+    assert (item.file_count, item.size) == (2, 50)
+    assert (item.allocated_file_count, item.allocated_size) == (3, 50)
+    assert item.reconciled_at is not None
+
+    # recently reconciled items are skipped
+    session.get_item.reset_mock()
+    reconcile_items(session)
+    session.get_item.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_seed_items(make_collection):
+    """Items which already exist in Petabox are recorded"""
+    collection = make_collection()
+    existing = MagicMock(exists=True, files_count=10, item_size=100)
+    session = MagicMock()
+    session.get_item.side_effect = [existing, MagicMock(exists=False)]
+
+    seed_items(collection.organization_id, "PREFIX", session)
+
+    (item,) = PetaboxItem.objects.all()
+    assert item.name == "PREFIX-00001"
+    assert (item.allocated_file_count, item.allocated_size) == (10, 100)
@@ -0,0 +1,136 @@
+from model_bakery import baker
+from pytest import fixture, mark
+
+from vault import shafs
+from vault.models import Organization, ShafsBlob
+
+SHA_A = "a" * 64
+SHA_B = "b" * 64
+SHA_C = "c" * 64
+
+
+@fixture
+def shadir(tmp_path, settings):
+    settings.SHADIR_ROOT = tmp_path
+    return tmp_path
+
+
+@fixture
+def org():
+    return baker.make(Organization)
+
+
+def write_blob(shadir, org_id, sha256_sum, *shards):
+    folder = shadir.joinpath(str(org_id), *shards)
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / sha256_sum).write_bytes(b"blob")
+    return folder / sha256_sum
+
+
+@mark.django_db
+def test_record_blob(shadir, org):
+    write_blob(shadir, org.id, SHA_A)
+    shafs.record_blob(org.id, SHA_A)
+    shafs.record_blob(org.id, SHA_A)
+
+    assert ShafsBlob.objects.filter(organization=org).count() == 1
+    assert shafs.present_sha256_sums(org.id, [SHA_A, SHA_B, None]) == {SHA_A}
+
+
+@mark.django_db
+def test_present_sha256_sums__per_store_and_org(shadir, org):
+    other_org = baker.make(Organization)
+    shafs.record_blob(org.id, SHA_A)
+    baker.make(ShafsBlob, store="elsewhere", organization=org, sha256_sum=SHA_B)
+
+    assert shafs.present_sha256_sums(org.id, [SHA_A, SHA_B]) == {SHA_A}
+    assert shafs.present_sha256_sums(other_org.id, [SHA_A]) == set()
+
+
+@mark.django_db
+def test_present_sha256_sums__unindexed_org(shadir, org):
+    """Organizations the store has no index of are looked for on disk"""
+    write_blob(shadir, org.id, SHA_A, "aa", "aa")
+    baker.make(ShafsBlob, store="elsewhere", organization=org, sha256_sum=SHA_B)
+
+    assert shafs.present_sha256_sums(org.id, [SHA_A, SHA_B]) == {SHA_A}
+
+
+@mark.django_db
+def test_rebuild_index(shadir, org):
+    write_blob(shadir, org.id, SHA_A)
+    write_blob(shadir, org.id, SHA_B, "bb", "bb")
+    (shadir / str(org.id) / "not-a-blob.tmp").write_bytes(b"")
+    # indexed, but no longer on disk
+    shafs.record_blob(org.id, SHA_C)
+    shafs.record_blob(org.id, SHA_A)
+
+    assert shafs.rebuild_index(org.id) == (1, 1)
+    assert shafs.present_sha256_sums(org.id, [SHA_A, SHA_B, SHA_C]) == {SHA_A, SHA_B}
+    assert shafs.rebuild_index(org.id) == (0, 0)
+
+
+@mark.django_db
+def test_rebuild_index__missing_folder(shadir, org):
+    shafs.record_blob(org.id, SHA_A)
+
+    assert shafs.rebuild_index(org.id) == (0, 1)
+
+
+def test_blob_path(shadir, settings):
+    settings.SHADIR_FANOUT_LEVELS = 2
+    sha = "0123" + "f" * 60
+
+    assert shafs.blob_path(7, sha) == str(shadir / "7" / "01" / "23" / sha)
+    assert shafs.blob_path(7, sha, 0) == str(shadir / "7" / sha)
+
+
+def test_locate_blob__any_layout(shadir, settings):
+    settings.SHADIR_FANOUT_LEVELS = 2
+    flat = write_blob(shadir, 7, SHA_A)
+    sharded = write_blob(shadir, 7, SHA_B, "bb", "bb")
+
+    assert shafs.locate_blob(7, SHA_A) == str(flat)
+    assert shafs.locate_blob(7, SHA_B) == str(sharded)
+    assert shafs.locate_blob(7, SHA_C) is None
+    assert shafs.locate_blob(8, SHA_A) is None
+    assert shafs.locate_blob(7, "../" + SHA_A) is None
+
+
+def test_reshard(shadir, settings):
+    write_blob(shadir, 7, SHA_A)
+    write_blob(shadir, 7, SHA_B, "bb")
+    write_blob(shadir, 7, SHA_C, "cc", "cc")
+    (shadir / "7" / "not-a-blob.tmp").write_bytes(b"")
+
+    settings.SHADIR_FANOUT_LEVELS = 2
+    assert shafs.reshard(7) == 2
+    assert shafs.reshard(7) == 0
+    assert sorted(shafs.iter_blobs(7)) == [
+        (sha, shafs.blob_path(7, sha)) for sha in (SHA_A, SHA_B, SHA_C)
+    ]
+    # the emptied shard folder is removed
+    assert not (shadir / "7" / "bb" / SHA_B).exists()
+    assert (shadir / "7" / "not-a-blob.tmp").exists()
+
+    settings.SHADIR_FANOUT_LEVELS = 0
+    assert shafs.reshard(7) == 3
+    assert sorted(p.name for p in (shadir / "7").iterdir()) == sorted(
+        [SHA_A, SHA_B, SHA_C, "not-a-blob.tmp"]
+    )
+
+
+@mark.django_db
+def test_add_blob(shadir, settings, org, tmp_path_factory):
+    settings.SHADIR_FANOUT_LEVELS = 2
+    merged = tmp_path_factory.mktemp("merged")
+    (merged / "first").write_bytes(b"blob")
+    (merged / "second").write_bytes(b"blob")
+
+    path = shafs.add_blob(org.id, SHA_A, merged / "first")
+    assert path == shafs.blob_path(org.id, SHA_A)
+    assert open(path, "rb").read() == b"blob"
+    # identical content already in the store
+    assert shafs.add_blob(org.id, SHA_A, merged / "second") == path
+    assert not any(merged.iterdir())
+    assert shafs.present_sha256_sums(org.id, [SHA_A]) == {SHA_A}
@@ -0,0 +1,50 @@
+import hashlib
+import os
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from vault.uploadhandler import save_upload, upload_hexdigest
+
+CONTENT = b"chunk" * 1000
+
+
+def upload(rf, settings, tmp_path):
+    settings.FILE_UPLOAD_TEMP_DIR = str(tmp_path)
+    request = rf.post(
+        "/api/flow_chunk", data={"file": SimpleUploadedFile("a.txt", CONTENT)}
+    )
+    return request.FILES["file"]
+
+
+def test_hashing_upload_handler(rf, settings, tmp_path):
+    uploaded_file = upload(rf, settings, tmp_path)
+
+    assert uploaded_file.hashes["sha256"].hexdigest() == (
+        hashlib.sha256(CONTENT).hexdigest()
+    )
+    assert upload_hexdigest(uploaded_file, "sha256") == (
+        hashlib.sha256(CONTENT).hexdigest()
+    )
+    assert upload_hexdigest(uploaded_file, "md5") == hashlib.md5(CONTENT).hexdigest()
+
+
+def test_save_upload__renames_temporary_file(rf, settings, tmp_path):
+    uploaded_file = upload(rf, settings, tmp_path)
+    temporary_file_path = uploaded_file.temporary_file_path()
+    dest = tmp_path / "identifier-1.tmp"
+
+    save_upload(uploaded_file, dest)
+    uploaded_file.close()
+
+    assert dest.read_bytes() == CONTENT
+    assert not os.path.exists(temporary_file_path)
+    assert os.stat(dest).st_mode & 0o777 == settings.FILE_UPLOAD_PERMISSIONS
+
+
+def test_save_upload__in_memory(tmp_path):
+    dest = tmp_path / "identifier-1.tmp"
+
+    save_upload(SimpleUploadedFile("a.txt", CONTENT), dest)
+
+    assert dest.read_bytes() == CONTENT
+    assert os.listdir(tmp_path) == ["identifier-1.tmp"]
@@ -0,0 +1,153 @@
+"""TreeNode ancestor accounting outside of the per-row triggers.
+
+The accounting triggers (see ``vault/sql/triggers-reference.sql``) keep the
+``file_count`` and ``size`` of every ancestor of a FILE or FOLDER TreeNode up
+to date. How they do so depends on the ``vault.treenode_accounting`` setting:
+
+* unset: each trigger updates all the ancestors of the changed node right
+  away. Concurrent writers to the same Collection contend on the row locks of
+  its COLLECTION and ORGANIZATION nodes.
+* ``journal``: each trigger appends the deltas for the ancestors to
+  :py:class:`vault.models.TreeNodeAccountingDelta` instead, which takes no
+  locks on TreeNodes. :py:func:`aggregate_journal` folds the journal into the
+  ancestors in batches, see the ``aggregate_treenode_accounting`` management
+  command. Exact totals are the TreeNode values plus the pending journal, see
+  :py:meth:`vault.models.TreeNodeQuerySet.with_exact_accounting`.
+* ``deferred``: the INSERT and UPDATE triggers don't fire at all, and the
+  transaction applies the accounting itself, see
+  :py:func:`deferred_treenode_accounting`.
+
+The setting is usually set for every connection with the
+``TREENODE_ACCOUNTING`` Django setting.
+"""
+
+import logging
+import typing
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+#: Setting selecting how the TreeNode accounting triggers apply changes.
+#: See migrations 0041 and 0042.
+ACCOUNTING_SETTING = "vault.treenode_accounting"
+
+#: Classid of the advisory lock serializing journal aggregation
+AGGREGATE_LOCK_CLASS = 8
+
+AGGREGATE_BATCH_SIZE = 10000
+
+#: Deltas to apply to a TreeNode: (file_count delta, size delta)
+Deltas = typing.Dict[int, typing.List[int]]
+
+
+@contextmanager
+def deferred_treenode_accounting():
+    """Defers TreeNode ancestor accounting on INSERT and UPDATE for the body
+    of the ``with`` block, which must run in a transaction. The caller is
+    responsible for applying the accounting, see :py:func:`apply_deltas`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT current_setting(%s, true), set_config(%s, 'deferred', true)",
+            [ACCOUNTING_SETTING, ACCOUNTING_SETTING],
+        )
+        previous = cursor.fetchone()[0] or ""
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config(%s, %s, true)", [ACCOUNTING_SETTING, previous]
+            )
+
+
+def add_to_ancestors(deltas: Deltas, parent_path: str, file_count: int, size: int):
+    """Adds a node's contribution to the accounting of all the TreeNodes on
+    *parent_path*, i.e. its parent and the parent's ancestors.
+    """
+    for node_id in parent_path.split("."):
+        delta = deltas[int(node_id)]
+        delta[0] += file_count
+        delta[1] += size
+
+
+def apply_deltas(deltas: Deltas) -> None:
+    """Applies accumulated accounting *deltas* with a single ``UPDATE``. Must
+    be called with accounting deferred, since the update trigger rejects
+    direct changes to the size of non-FILE nodes.
+    """
+    deltas = {node_id: delta for node_id, delta in deltas.items() if delta != [0, 0]}
+    if not deltas:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            UPDATE vault_treenode AS node
+            SET
+                file_count = node.file_count + delta.file_count,
+                size = COALESCE(node.size, 0) + delta.size
+            FROM
+                unnest(%s::bigint[], %s::bigint[], %s::bigint[])
+                    AS delta(id, file_count, size)
+            WHERE node.id = delta.id
+            """,
+            [
+                list(deltas),
+                [delta[0] for delta in deltas.values()],
+                [delta[1] for delta in deltas.values()],
+            ],
+        )
+
+
+def aggregate_journal(batch_size: int = AGGREGATE_BATCH_SIZE) -> int:
+    """Folds up to *batch_size* of the oldest journaled deltas into their
+    TreeNodes, in one transaction so that exact reads never count a delta
+    twice or not at all.
+
+    Only one aggregation runs at a time; returns the number of journal rows
+    folded, or 0 if another aggregation is running.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_try_advisory_xact_lock(%s, 0)", [AGGREGATE_LOCK_CLASS]
+            )
+            if not cursor.fetchone()[0]:
+                return 0
+            cursor.execute(
+                """
+                WITH folded AS (
+                    DELETE FROM vault_treenodeaccountingdelta
+                    WHERE id IN (
+                        SELECT id
+                        FROM vault_treenodeaccountingdelta
+                        ORDER BY id
+                        LIMIT %s
+                    )
+                    RETURNING tree_node_id, file_count, size
+                )
+                SELECT
+                    tree_node_id,
+                    SUM(file_count)::bigint,
+                    SUM(size)::bigint,
+                    COUNT(*)
+                FROM folded
+                GROUP BY tree_node_id
+                ORDER BY tree_node_id
+                """,
+                [batch_size],
+            )
+            rows = cursor.fetchall()
+
+        deltas = {node_id: [file_count, size] for node_id, file_count, size, _ in rows}
+        with deferred_treenode_accounting():
+            apply_deltas(deltas)
+
+    folded = sum(count for *_, count in rows)
+    if folded:
+        logger.info(
+            f"Folded {folded} TreeNode accounting deltas into {len(deltas)} TreeNodes"
+        )
+    return folded
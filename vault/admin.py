@@ -160,4 +160,25 @@ class DepositFileAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(models.PetaboxItem)
+class PetaboxItemAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "organization",
+        "file_count",
+        "size",
+        "allocated_file_count",
+        "allocated_size",
+        "reconciled_at",
+    )
+    search_fields = ("name",)
+
+
+@admin.register(models.ShafsBlob)
+class ShafsBlobAdmin(admin.ModelAdmin):
+    list_display = ("sha256_sum", "organization", "store", "created_at")
+    list_filter = ("store",)
+    search_fields = ("sha256_sum",)
+
+
 admin.site.site_header = "Vault Administration"
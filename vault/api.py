@@ -1,16 +1,16 @@
+import asyncio
 import json
 import logging
-import os
-from collections import defaultdict
+import weakref
 from functools import partial
 from itertools import chain
-from typing import Union
 
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import F, Q, Sum, Count, Value
-from django.db.models.functions import Coalesce
+from django.db import close_old_connections
+from django.db.models import F, Value
 from django.http import (
     Http404,
     JsonResponse,
@@ -22,11 +22,11 @@ from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-import fs.errors
 from fs.osfs import OSFS
 
-from vault import models
+from vault import chunks, models, timeline
 from vault.filters import ExtendedJSONEncoder
+from vault.uploadhandler import save_upload, upload_hexdigest
 from vault.forms import (
     FlowChunkGetForm,
     FlowChunkPostForm,
@@ -34,6 +34,14 @@ from vault.forms import (
 )
 
 DATE_FORMAT = "%B %-d, %Y"
+
+#: default and maximum number of events per page of the timeline endpoints
+TIMELINE_PAGE_SIZE = 100
+TIMELINE_MAX_PAGE_SIZE = 1000
+
+#: default and maximum number of files per page of report_files
+REPORT_FILES_PAGE_SIZE = 100
+REPORT_FILES_MAX_PAGE_SIZE = 1000
 ExtendedJsonResponse = partial(JsonResponse, encoder=ExtendedJSONEncoder)
 
 logger = logging.getLogger(__name__)
@@ -54,23 +62,18 @@ def collections(request):
 
 @login_required
 def reports(request):
+    """Pages through the Deposits and Reports of the user's organization,
+    newest first, see :py:func:`_timeline_page`.
+    """
     org_id = request.user.organization_id
-    _reports = models.Report.objects.filter(collection__organization_id=org_id)
-    deposits = models.Deposit.objects.filter(organization_id=org_id)
-
-    def event_time(event):
-        if isinstance(event, models.Deposit):
-            return event.registered_at
-
-        return event.started_at
+    page = _timeline_page(request, org_id)
+    if isinstance(page, HttpResponse):
+        return page
+    events, next_cursor = page
 
-    events = sorted(chain(deposits, _reports), key=event_time, reverse=True)
     formatted_events = []
     for event in events:
         if isinstance(event, models.Deposit):
-            # Filter out "Migration" events
-            if is_migration(event.id):
-                continue
             formatted_events.append(
                 {
                     "id": event.id,
@@ -93,22 +96,51 @@ def reports(request):
     return JsonResponse(
         {
             "reports": formatted_events,
+            "next": next_cursor,
         }
     )
 
 
+def _timeline_page(request, org_id, collection_id=None, newest_first=True):
+    """Returns the page of the timeline of *org_id*, or of *collection_id*,
+    requested by the query parameters, see :py:func:`vault.timeline.events_page`,
+    or a response to the invalid request.
+
+    Query parameters:
+
+    * ``limit``: return at most this many events, by default
+      :py:data:`TIMELINE_PAGE_SIZE`. When there are more, the ``next`` key of
+      the response holds the cursor of the next page.
+    * ``after``: the cursor of the page, taken from a ``next`` key
+    """
+    try:
+        limit = int(request.GET.get("limit") or TIMELINE_PAGE_SIZE)
+        if not 0 < limit <= TIMELINE_MAX_PAGE_SIZE:
+            raise ValueError(limit)
+        return timeline.events_page(
+            org_id,
+            collection_id=collection_id,
+            newest_first=newest_first,
+            after=request.GET.get("after") or None,
+            limit=limit,
+        )
+    except ValueError:
+        return HttpResponseBadRequest(
+            f"limit must be between 1 and {TIMELINE_MAX_PAGE_SIZE}, "
+            "after a cursor from next"
+        )
+
+
 @csrf_exempt
 @login_required
 def collections_stats(request):
     org_id = request.user.organization_id
     org_node_id = request.user.organization.tree_node_id
     if org_node_id:
-        _collections = models.Collection.objects.filter(
-            organization_id=org_id
-        ).annotate(
-            last_modified=F("tree_node__modified_at"),
-            file_count=Coalesce(F("tree_node__file_count"), 0),
-            size=Coalesce(F("tree_node__size"), 0),
+        _collections = (
+            models.Collection.objects.filter(organization_id=org_id)
+            .with_exact_accounting()
+            .annotate(last_modified=F("tree_node__modified_at"))
         )
     else:
         _collections = []
@@ -129,8 +161,8 @@ def collections_stats(request):
                 {
                     "id": collection.id,
                     "time": collection.last_modified,
-                    "fileCount": collection.file_count,
-                    "totalSize": collection.size,
+                    "fileCount": collection.exact_file_count,
+                    "totalSize": collection.exact_size,
                 }
                 for collection in _collections
             ],
@@ -142,36 +174,19 @@ def collections_stats(request):
 @login_required
 def reports_files(request, collection_id=None):
     """Provides data for the Total Files Deposited dashboard widget. See the function
-    fetchFilesEvolutions in the dashboard js."""
+    fetchFilesEvolutions in the dashboard js. Events are paged through oldest
+    first, see :py:func:`_timeline_page`."""
     org_id = request.user.organization_id
     if collection_id:
-        collection = get_object_or_404(
-            models.Collection, pk=collection_id, organization_id=org_id
-        )
-        _reports = models.Report.objects.filter(collection=collection)
-        deposits = models.Deposit.objects.filter(collection=collection).annotate(
-            file_count=Coalesce(Count("files"), 0),
-        )
-    else:
-        _reports = models.Report.objects.filter(collection__organization_id=org_id)
-        deposits = models.Deposit.objects.filter(organization_id=org_id).annotate(
-            file_count=Coalesce(Count("files"), 0),
-        )
-
-    def event_time(event):
-        if isinstance(event, models.Deposit):
-            return event.registered_at
-
-        return event.started_at
-
-    events = sorted(chain(deposits, _reports), key=event_time, reverse=False)
+        get_object_or_404(models.Collection, pk=collection_id, organization_id=org_id)
+    page = _timeline_page(request, org_id, collection_id or None, newest_first=False)
+    if isinstance(page, HttpResponse):
+        return page
+    events, next_cursor = page
 
     formatted_events = []
     for event in events:
         if isinstance(event, models.Deposit):
-            # filter out the "Migration" deposits
-            if is_migration(event.id):
-                continue
             formatted_events.append(
                 {
                     "id": event.id,
@@ -195,6 +210,7 @@ def reports_files(request, collection_id=None):
     return JsonResponse(
         {
             "reports": formatted_events,
+            "next": next_cursor,
         }
     )
 
@@ -202,12 +218,12 @@ def reports_files(request, collection_id=None):
 @login_required
 def collections_summary(request):
     org = request.user.organization
-    collection_stats = models.Collection.objects.filter(
-        organization_id=org.id
-    ).annotate(
-        file_count=Coalesce(F("tree_node__file_count"), 0),
-        size=Coalesce(F("tree_node__size"), 0),
-        regions=ArrayAgg(F("target_geolocations__name"), default=Value([])),
+    collection_stats = (
+        models.Collection.objects.filter(organization_id=org.id)
+        .with_exact_accounting()
+        .annotate(
+            regions=ArrayAgg(F("target_geolocations__name"), default=Value([])),
+        )
     )
     collection_output = []
     for collection in collection_stats:
@@ -215,9 +231,9 @@ def collections_summary(request):
             {
                 "id": collection.pk,
                 "name": collection.name,
-                "fileCount": collection.file_count,
+                "fileCount": collection.exact_file_count,
                 "regions": {
-                    region: collection.file_count
+                    region: collection.exact_file_count
                     for region in collection.regions
                     if region
                 },
@@ -261,19 +277,47 @@ def report_summary(request, collection_id, report_id):
 
 @login_required
 def report_files(request, collection_id, report_id):
-    # pylint: disable=unused-argument
-    return JsonResponse({"files": []})
+    """Pages through the files of a report, in the order they were checked.
 
+    Query parameters:
 
-def _chunk_out_filename(file_identifier: str, chunk_number: int) -> str:
-    """Return a different filename for the chunk while it is being written
-    so we don't erroneously assume all chunks are fully written to disk.
+    * ``filter``: ``errors`` for only the unsuccessful files, ``mismatches``
+      for only those with mismatched checksums
+    * ``limit``: return at most this many files, by default
+      :py:data:`REPORT_FILES_PAGE_SIZE`. When there are more, the ``next``
+      key holds the URL of the next page.
+    * ``after``: the cursor of the page, taken from a ``next`` URL
     """
-    return f"{file_identifier}-{chunk_number}.out"
-
+    org_id = request.user.organization_id
+    report = get_object_or_404(
+        models.Report,
+        pk=report_id,
+        collection_id=collection_id,
+        collection__organization_id=org_id,
+    )
+    file_filter = request.GET.get("filter") or None
+    if file_filter is not None and file_filter not in models.Report.FILE_FILTERS:
+        return HttpResponseBadRequest(
+            f"filter must be one of {', '.join(models.Report.FILE_FILTERS)}"
+        )
+    try:
+        limit = int(request.GET.get("limit") or REPORT_FILES_PAGE_SIZE)
+        after = int(request.GET.get("after") or 0)
+        if not 0 < limit <= REPORT_FILES_MAX_PAGE_SIZE or after < 0:
+            raise ValueError(limit, after)
+    except ValueError:
+        return HttpResponseBadRequest(
+            f"limit must be between 1 and {REPORT_FILES_MAX_PAGE_SIZE}, "
+            "after a non-negative integer"
+        )
 
-def _chunk_filename(file_identifier: str, chunk_number: int) -> str:
-    return f"{file_identifier}-{chunk_number}.tmp"
+    files, next_after = report.files_page(file_filter, after, limit)
+    next_url = None
+    if next_after is not None:
+        query = request.GET.copy()
+        query["after"] = next_after
+        next_url = request.build_absolute_uri("?" + query.urlencode())
+    return JsonResponse({"files": files, "next": next_url})
 
 
 @csrf_exempt
@@ -343,6 +387,19 @@ def register_deposit(request):
         )
     models.DepositFile.objects.bulk_create(deposit_files)
 
+    if settings.CHUNK_STORAGE == chunks.ChunkStorage.PREALLOCATED:
+        chunk_dir = chunks.incoming_dir(org_id)
+        for deposit_file in deposit_files:
+            try:
+                chunks.preallocate(
+                    chunk_dir, deposit_file.flow_identifier, deposit_file.size
+                )
+            except OSError as e:
+                # its chunks are saved as separate files instead
+                logger.warning(
+                    "failed to preallocate %s: %s", deposit_file.flow_identifier, e
+                )
+
     return JsonResponse(
         {
             "deposit_id": deposit.pk,
@@ -546,71 +603,255 @@ def flow_chunk(request):
         pk=chunk.deposit_id,
         organization_id=request.user.organization_id,
     )
+    # only chunks of registered files are saved
+    deposit_file = get_object_or_404(
+        models.DepositFile, deposit=deposit, flow_identifier=chunk.file_identifier
+    )
 
-    org_tmp_path = str(request.user.organization_id)
-    org_chunk_tmp_path = os.path.join(org_tmp_path, "chunks")
-    chunk_filename = _chunk_filename(chunk.file_identifier, chunk.number)
-    chunk_out_filename = _chunk_out_filename(chunk.file_identifier, chunk.number)
+    chunk_filename = chunks.chunk_filename(chunk.file_identifier, chunk.number)
 
+    if request.method == "POST":
+        rejected = _verify_chunk(chunk)
+        if rejected is not None:
+            return rejected
+
+    incoming_dir = chunks.incoming_dir(request.user.organization_id)
+    if chunks.is_preallocated(incoming_dir, chunk.file_identifier):
+        return _flow_chunk_in_place(request, chunk, deposit_file, incoming_dir)
+
+    chunk_dir = chunks.file_chunk_dir(
+        request.user.organization_id, chunk.file_identifier
+    )
     if request.method == "GET":
         # do we need this chunk?
-        with OSFS(settings.FILE_UPLOAD_TEMP_DIR) as tmp_fs:
-            no_tmp = not tmp_fs.exists(f"{org_chunk_tmp_path}/{chunk_filename}")
-            no_out = not tmp_fs.exists(f"{org_chunk_tmp_path}/{chunk_out_filename}")
-        if no_tmp and no_out:
+        if not chunks.is_chunk_recorded(chunk_dir, chunk.file_identifier, chunk.number):
             return HttpResponse(status=204)  # please send us this chunk
+        progress = chunks.read_chunk_progress(chunk_dir, chunk.file_identifier)
 
     if request.method == "POST":
-        # Save the chunk to the org's tmp chunks dir
+        # Save the chunk to the file's tmp chunks dir
         logger.info("saving chunk to tmp: %s", chunk_filename)
-        with OSFS(settings.FILE_UPLOAD_TEMP_DIR) as tmp_fs:
-            with tmp_fs.makedirs(org_chunk_tmp_path, recreate=True) as org_fs:
-                if org_fs.exists(chunk_filename) or org_fs.exists(chunk_out_filename):
-                    logger.warning("chunk already exists, skipping: %s", chunk_filename)
-                    return HttpResponse()
-                chunk_out = org_fs.openbin(chunk_out_filename, "a")
-                for chunk_bytes in chunk.file.chunks():
-                    chunk_out.write(chunk_bytes)
-                chunk_out.flush()
-                os.fsync(chunk_out.fileno())
-                chunk_out.close()
-                org_fs.move(chunk_out_filename, chunk_filename, overwrite=True)
-
-    if all_chunks_uploaded(chunk, org_chunk_tmp_path):
-        logger.info("all chunks saved for %s", chunk.file_identifier)
-        deposit_file = get_object_or_404(
-            models.DepositFile,
-            deposit=deposit,
-            flow_identifier=chunk.file_identifier,
+        with OSFS(chunk_dir, create=True) as chunk_fs:
+            if chunk_fs.exists(chunk_filename):
+                # saved, but maybe not recorded before a crash
+                logger.warning("chunk already exists, skipping: %s", chunk_filename)
+            else:
+                # renames the upload's temporary file into place
+                save_upload(chunk.file, chunk_fs.getsyspath(chunk_filename))
+                _record_chunk_digest(chunk_dir, chunk)
+            saved_size = chunk_fs.getsize(chunk_filename)
+        progress = chunks.record_chunk_saved(
+            chunk_dir, chunk.file_identifier, chunk.number, saved_size
+        )
+        chunks.advance_hash_checkpoint(
+            chunk_dir, chunk.file_identifier, chunk.file_total_chunks
         )
-        if deposit_file.state != models.DepositFile.State.REGISTERED:
-            logger.warning("chunk request for already uploaded file")
-            return HttpResponse()  # this DepositFile is already uploaded
-        deposit_file.state = models.DepositFile.State.UPLOADED
-        deposit_file.uploaded_at = timezone.now()
-        deposit_file.save()
+
+    if all_chunks_uploaded(chunk, progress):
+        _mark_uploaded(deposit_file)
     return HttpResponse()
 
 
-def all_chunks_uploaded(chunk, org_chunk_tmp_path) -> bool:
-    # Check if we have all chunks for the file
-    with OSFS(
-        os.path.join(settings.FILE_UPLOAD_TEMP_DIR, org_chunk_tmp_path)
-    ) as org_fs:
-        total_saved_size = 0
-        for i in reversed(range(1, chunk.file_total_chunks + 1)):
-            try:
-                saved_size = org_fs.getsize(_chunk_filename(chunk.file_identifier, i))
-                total_saved_size += saved_size
-            except fs.errors.ResourceNotFound:
-                return False
-        if not total_saved_size == chunk.file_total_size:
+def _verify_chunk(chunk):
+    """Returns a response rejecting *chunk* if the client sent its digest and
+    the chunk received doesn't match it, so that only this chunk is sent
+    again; flow.js retries chunks which get an error status.
+    """
+    if chunk.sha256_sum is None:
+        return None
+    received_sum = upload_hexdigest(chunk.file, "sha256")
+    if received_sum == chunk.sha256_sum:
+        return None
+    logger.warning(
+        "chunk digest mismatch, rejecting: %s-%d, expected %s, received %s",
+        chunk.file_identifier,
+        chunk.number,
+        chunk.sha256_sum,
+        received_sum,
+    )
+    return JsonResponse(
+        status=400,
+        data={"flowChunkSha256": ["Chunk content does not match its digest."]},
+    )
+
+
+def _record_chunk_digest(chunk_dir, chunk):
+    if chunk.sha256_sum is not None:
+        chunks.record_chunk_digest(
+            chunk_dir, chunk.file_identifier, chunk.number, chunk.sha256_sum
+        )
+
+
+#: per event loop, the semaphore bounding the flow_chunk_async requests of
+#: each organization which are saving a chunk
+_org_chunk_slots = weakref.WeakKeyDictionary()
+
+
+async def flow_chunk_async(request):
+    """:py:func:`flow_chunk` for ASGI servers, where a request only occupies
+    the event loop while its body is received, however slow the client.
+
+    The chunk is then saved by ``flow_chunk`` in a thread, with at most
+    ``FLOW_CHUNK_ORG_CONCURRENCY`` chunks of an organization being saved at
+    once per process; further requests wait without holding a thread.
+    """
+    # Django 3.2 runs the sync code of all ASGI requests in a single thread
+    # unless they have a context of their own
+    async with ThreadSensitiveContext():
+        org_id = await sync_to_async(_organization_id)(request)
+        slots = _org_chunk_slots.setdefault(asyncio.get_running_loop(), {})
+        if org_id not in slots:
+            slots[org_id] = asyncio.Semaphore(settings.FLOW_CHUNK_ORG_CONCURRENCY)
+        async with slots[org_id]:
+            return await sync_to_async(_save_chunk)(request)
+
+
+# Django 3.2's csrf_exempt would wrap the view in a sync function, which
+# would then be run in a thread instead of awaited
+flow_chunk_async.csrf_exempt = True
+
+
+def _organization_id(request):
+    try:
+        if not request.user.is_authenticated:
+            return None  # flow_chunk redirects to login
+        return request.user.organization_id
+    finally:
+        # not held while the request waits for a slot of its organization
+        close_old_connections()
+
+
+def _save_chunk(request):
+    try:
+        return flow_chunk(request)
+    finally:
+        # this thread's connection isn't closed when the request finishes
+        close_old_connections()
+
+
+def _flow_chunk_in_place(request, chunk, deposit_file, chunk_dir):
+    """Handles a flow.js chunk of a file preallocated by register_deposit,
+    writing it straight into place.
+    """
+    if request.method == "GET":
+        if not chunks.is_chunk_recorded(chunk_dir, chunk.file_identifier, chunk.number):
+            return HttpResponse(status=204)  # please send us this chunk
+        progress = chunks.read_chunk_progress(chunk_dir, chunk.file_identifier)
+    else:
+        saved = chunks.read_chunk_marker(chunk_dir, chunk.file_identifier, chunk.number)
+        if saved is not None:
+            # saved, but maybe not recorded before a crash
             logger.warning(
-                "file has all chunks but wrong total size: %s", chunk.file_identifier
+                "chunk already exists, skipping: %s-%d",
+                chunk.file_identifier,
+                chunk.number,
+            )
+            saved_size = saved[1]
+        else:
+            logger.info(
+                "writing chunk in place: %s-%d", chunk.file_identifier, chunk.number
+            )
+            saved_size = chunks.write_chunk_in_place(
+                chunk_dir,
+                chunk.file_identifier,
+                chunk.number,
+                chunk.target_chunk_size,
+                chunk.file.chunks(),
+            )
+            _record_chunk_digest(chunk_dir, chunk)
+        progress = chunks.record_chunk_saved(
+            chunk_dir, chunk.file_identifier, chunk.number, saved_size
+        )
+        chunks.advance_hash_checkpoint(
+            chunk_dir, chunk.file_identifier, chunk.file_total_chunks
+        )
+
+    if all_chunks_uploaded(chunk, progress):
+        _mark_uploaded(deposit_file)
+    return HttpResponse()
+
+
+@csrf_exempt
+@login_required
+def flow_chunks_saved(request):
+    """Returns the chunks already saved of the REGISTERED files of a deposit,
+    or of those of them given as ``flow_identifier`` (repeatable), so that a
+    client can resume an upload with one request instead of a flow_chunk GET
+    per chunk.
+
+    Chunks are listed as inclusive ``[first, last]`` ranges of chunk numbers;
+    ``verified`` are the chunks whose digest was sent and verified.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(permitted_methods=["GET"])
+    org_id = request.user.organization_id
+    deposit_id = request.GET.get("deposit_id")
+    if not deposit_id:
+        return HttpResponseBadRequest()
+    deposit = get_object_or_404(models.Deposit, pk=deposit_id, organization_id=org_id)
+
+    deposit_files = models.DepositFile.objects.filter(deposit=deposit)
+    flow_identifiers = request.GET.getlist("flow_identifier")
+    if flow_identifiers:
+        deposit_files = deposit_files.filter(flow_identifier__in=flow_identifiers)
+
+    incoming_dir = chunks.incoming_dir(org_id)
+    files = {}
+    for flow_identifier, state in deposit_files.values_list(
+        "flow_identifier", "state"
+    ).iterator():
+        saved = {"state": state, "chunks": [], "verified": [], "size": 0}
+        if state == models.DepositFile.State.REGISTERED:
+            try:
+                chunk_dir = (
+                    incoming_dir
+                    if chunks.is_preallocated(incoming_dir, flow_identifier)
+                    else chunks.file_chunk_dir(org_id, flow_identifier)
+                )
+            except ValueError:
+                # registered before flow identifiers were validated
+                files[flow_identifier] = saved
+                continue
+            saved["chunks"] = chunks.saved_chunk_ranges(chunk_dir, flow_identifier)
+            saved["verified"] = _number_ranges(
+                chunks.read_chunk_digests(chunk_dir, flow_identifier)
             )
-            raise DepositException
+            saved["size"] = chunks.read_chunk_progress(chunk_dir, flow_identifier).size
+        files[flow_identifier] = saved
+    return JsonResponse({"deposit_id": deposit.pk, "files": files})
+
+
+def _number_ranges(numbers):
+    """Returns *numbers* as ascending, inclusive ``[first, last]`` ranges."""
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ranges
+
 
-        return True
+def _mark_uploaded(deposit_file):
+    logger.info("all chunks saved for %s", deposit_file.flow_identifier)
+    if deposit_file.state != models.DepositFile.State.REGISTERED:
+        logger.warning("chunk request for already uploaded file")
+        return  # this DepositFile is already uploaded
+    deposit_file.state = models.DepositFile.State.UPLOADED
+    deposit_file.uploaded_at = timezone.now()
+    deposit_file.save()
+
+
+def all_chunks_uploaded(chunk, progress: chunks.ChunkProgress) -> bool:
+    # Check if we have all chunks for the file
+    if progress.chunks < chunk.file_total_chunks:
+        return False
+    if not progress.size == chunk.file_total_size:
+        logger.warning(
+            "file has all chunks but wrong total size: %s", chunk.file_identifier
+        )
+        raise DepositException
+    return True
 
 
 class DepositException(Exception):
@@ -628,17 +869,8 @@ def hashed_status(request):
         return HttpResponseBadRequest()
     deposit = get_object_or_404(models.Deposit, pk=deposit_id, organization_id=org_id)
 
-    state_count_qs = (
-        models.DepositFile.objects.filter(deposit=deposit)
-        .values_list("state")
-        .annotate(files=Count("state"))
-    )
-
-    total_files = 0
-    state_count = defaultdict(int)
-    for state, file_count in state_count_qs:
-        state_count[state] = file_count
-        total_files += file_count
+    state_count, _ = deposit.file_state_totals()
+    total_files = sum(state_count.values())
 
     return JsonResponse(
         {
@@ -677,29 +909,16 @@ def get_events(request, collection_id):
     collection_node = get_object_or_404(
         models.Collection, id=collection_id, organization=user_org
     )
-    collection_node_id = collection_node.id
-    _reports = models.Report.objects.filter(collection=collection_node_id)
-    deposits = models.Deposit.objects.filter(collection=collection_node).annotate(
-        file_count=Count("files"),
-        total_size=Coalesce(Sum("files__size"), 0),
-        error_count=Count("pk", filter=Q(files__state=models.DepositFile.State.ERROR)),
-    )
-
-    def extract_event_sort_key(event: Union[models.Deposit, models.Report]):
-        if isinstance(event, models.Deposit):
-            return event.registered_at
-
-        return event.started_at
+    page = _timeline_page(request, user_org.id, collection_node.id)
+    if isinstance(page, HttpResponse):
+        return page
+    events, next_cursor = page
 
     formatted_events = []
     deposit_events = []
     fixity_events = []
-    events = sorted(chain(deposits, _reports), key=extract_event_sort_key, reverse=True)
     for event in events:
         if isinstance(event, models.Deposit):
-            # filter out the "Migration" deposits
-            if is_migration(event.id):
-                continue
             link = reverse("deposit_report", kwargs={"deposit_id": event.id})
             formatted = {
                 "Event Id": event.id,
@@ -738,13 +957,6 @@ def get_events(request, collection_id):
             "formatted_events": formatted_events,
             "deposit_events": deposit_events,
             "fixity_events": fixity_events,
+            "next": next_cursor,
         }
     )
-
-
-def is_migration(event_id):
-    """
-    Deposits records between 15 and 96 on production environment are
-    migrated files from the old system into the new system.
-    """
-    return 15 <= event_id <= 96
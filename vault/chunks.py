@@ -0,0 +1,675 @@
+"""Helpers for the flow.js chunks of a DepositFile saved under
+``FILE_UPLOAD_TEMP_DIR/<org id>/chunks/<flow identifier>``, see
+:py:func:`file_chunk_dir`. Each file has a folder of its own, so that listing
+its chunks doesn't mean scanning those of every file being uploaded.
+
+In the ``preallocated`` :py:class:`ChunkStorage` mode, the chunks of a file
+are instead written straight into place in a sparse file preallocated when
+the deposit is registered, under :py:func:`incoming_dir`. Each saved chunk is
+recorded by a small marker file next to it. Since that file is on the same
+filesystem as ``SHADIR_ROOT``, it is moved into the shafs store with a rename
+once hashed, and every byte uploaded is written twice (to the upload handler's
+temporary file, then into place) instead of three times.
+
+Which chunks of a file were saved, and their total size, is tracked in a
+small progress file next to them (see :py:func:`record_chunk_saved`), so that
+each chunk request checks completion with a constant number of syscalls
+rather than a ``stat`` of every chunk.
+
+Chunks which arrive in order are hashed as they are saved, see
+:py:func:`advance_hash_checkpoint`. The intermediate hash state is saved in a
+checkpoint file next to the chunks, so that hashing picks up where it left off
+across requests, processes and restarts, and the merge of the chunks in
+``process_chunked_files`` only needs to hash the chunks the checkpoint does
+not cover.
+
+A client may send the sha256 digest of each chunk along with it. The chunk is
+then rejected, to be sent again, unless its content matches, and the verified
+digest is recorded in a digest file next to the chunks, see
+:py:func:`record_chunk_digest`.
+"""
+
+import base64
+import errno
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import typing
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from vault.hashing import ALGORITHMS, RESUMABLE_HASH_AVAILABLE, ResumableHash
+
+logger = logging.getLogger(__name__)
+
+HASH_CHECKPOINT_VERSION = 1
+HASH_READ_BUFFER_SIZE = 2 * 1024 * 1024
+
+#: header of a progress file: chunks saved, bytes saved. It is followed by a
+#: bitmap of the chunks saved.
+_PROGRESS_HEADER = struct.Struct("<QQ")
+
+#: size of a sha256 digest in a digest file
+_DIGEST_SIZE = 32
+_NO_DIGEST = bytes(_DIGEST_SIZE)
+
+#: flow identifiers name the files and folders of chunks, so they may only
+#: use characters which can't take a path out of its folder
+FLOW_IDENTIFIER_REGEX = r"\A[A-Za-z0-9_-]+\Z"
+
+
+class ChunkStorage:
+    """Where uploaded chunks are saved, set with ``CHUNK_STORAGE``."""
+
+    #: one file per chunk under ``FILE_UPLOAD_TEMP_DIR``, merged once all
+    #: chunks are uploaded
+    FILES = "files"
+    #: written in place into a file preallocated by ``register_deposit``
+    PREALLOCATED = "preallocated"
+
+
+def chunk_filename(file_identifier: str, chunk_number: int) -> str:
+    return f"{file_identifier}-{chunk_number}.tmp"
+
+
+def _org_chunks_dir(org_id: int) -> str:
+    return os.path.join(settings.FILE_UPLOAD_TEMP_DIR, str(org_id), "chunks")
+
+
+def file_chunk_dir(org_id: int, file_identifier: str) -> str:
+    """Returns the folder of the chunks of *file_identifier*, and of the
+    progress, checkpoint and digest files next to them.
+
+    :raises ValueError: if it isn't inside the chunks folder of *org_id*
+    """
+    org_chunks_dir = _org_chunks_dir(org_id)
+    return _inside(org_chunks_dir, os.path.join(org_chunks_dir, file_identifier))
+
+
+def saved_chunk_paths(chunk_dir: str, file_identifier: str) -> typing.List[str]:
+    """Returns the paths of the chunk files of *file_identifier* in
+    *chunk_dir*, in chunk order.
+    """
+    pattern = re.compile(rf"{re.escape(file_identifier)}-(\d+)\.tmp")
+    numbered = []
+    try:
+        with os.scandir(chunk_dir) as entries:
+            for entry in entries:
+                match = pattern.fullmatch(entry.name)
+                if match and entry.is_file():
+                    numbered.append((int(match.group(1)), entry.path))
+    except FileNotFoundError:
+        return []
+    return [path for _, path in sorted(numbered)]
+
+
+#: the files of the chunks of a file, and the files next to them, in the
+#: per-organization chunks folder used before per-file folders
+_ORG_CHUNKS_FILE_RE = re.compile(
+    r"(?P<identifier>.+?)"
+    r"(?:-\d+\.tmp|\.merged\.tmp|\.progress|\.sha256|\.hashstate|\.hashlock|\.mergestate)"
+)
+
+
+def move_into_file_chunk_dirs(org_id: int) -> int:
+    """Moves the chunk files of *org_id* left directly in its chunks folder,
+    and the files next to them, into the :py:func:`file_chunk_dir` of their
+    file. Files already present there are left alone.
+
+    :return: the number of files moved
+    """
+    org_chunks_dir = _org_chunks_dir(org_id)
+    moved = 0
+    try:
+        entries = list(os.scandir(org_chunks_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        match = _ORG_CHUNKS_FILE_RE.fullmatch(entry.name)
+        if not match or not entry.is_file(follow_symlinks=False):
+            continue
+        try:
+            chunk_dir = file_chunk_dir(org_id, match.group("identifier"))
+        except ValueError:
+            logger.warning("not moving %s, its flow identifier is unsafe", entry.path)
+            continue
+        target = os.path.join(chunk_dir, entry.name)
+        os.makedirs(chunk_dir, exist_ok=True)
+        if os.path.exists(target):
+            logger.warning("not moving %s, %s already exists", entry.path, target)
+            continue
+        os.rename(entry.path, target)
+        moved += 1
+    return moved
+
+
+def preallocated_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.part"
+
+
+def chunk_progress_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.progress"
+
+
+def chunk_marker_filename(file_identifier: str, chunk_number: int) -> str:
+    return f"{file_identifier}-{chunk_number}.written"
+
+
+def incoming_dir(org_id: int) -> str:
+    """Returns the folder of the preallocated files of *org_id*, on the
+    filesystem of ``SHADIR_ROOT``.
+    """
+    return os.path.join(settings.SHADIR_ROOT, "incoming", str(org_id))
+
+
+def preallocated_path(chunk_dir: str, file_identifier: str) -> str:
+    """Returns the path of the preallocated file of *file_identifier* in
+    *chunk_dir*.
+
+    :raises ValueError: if it isn't inside *chunk_dir*
+    """
+    return _inside(
+        chunk_dir, os.path.join(chunk_dir, preallocated_filename(file_identifier))
+    )
+
+
+def _inside(folder: str, path: str) -> str:
+    """Returns *path*, once checked to resolve to a path inside *folder*.
+
+    :raises ValueError: if it doesn't
+    """
+    if not os.path.realpath(path).startswith(
+        os.path.join(os.path.realpath(folder), "")
+    ):
+        raise ValueError(f"{path} is outside of {folder}")
+    return path
+
+
+def preallocate(chunk_dir: str, file_identifier: str, size: int) -> None:
+    """Creates the sparse file of *size* bytes into which the chunks of
+    *file_identifier* are written, unless it already exists.
+    """
+    path = preallocated_path(chunk_dir, file_identifier)
+    os.makedirs(chunk_dir, exist_ok=True)
+    # "a" so that chunks already written by an earlier registration are kept
+    with open(path, "ab") as f:
+        if os.fstat(f.fileno()).st_size != size:
+            f.truncate(size)
+
+
+def is_preallocated(chunk_dir: str, file_identifier: str) -> bool:
+    return os.path.isfile(preallocated_path(chunk_dir, file_identifier))
+
+
+def write_chunk_in_place(
+    chunk_dir: str,
+    file_identifier: str,
+    chunk_number: int,
+    chunk_size: int,
+    data: typing.Iterable[bytes],
+) -> int:
+    """Writes the bytes of chunk *chunk_number* from *data* at their offset,
+    ``(chunk_number - 1) * chunk_size``, in the preallocated file of
+    *file_identifier*, syncs them and records the chunk as saved.
+
+    :return: the number of bytes written
+    """
+    offset = (chunk_number - 1) * chunk_size
+    position = offset
+    fd = os.open(preallocated_path(chunk_dir, file_identifier), os.O_WRONLY)
+    try:
+        for block in data:
+            view = memoryview(block)
+            while view:
+                num_written = os.pwrite(fd, view, position)
+                view = view[num_written:]
+                position += num_written
+        os.fdatasync(fd)
+    finally:
+        os.close(fd)
+
+    marker_path = os.path.join(
+        chunk_dir, chunk_marker_filename(file_identifier, chunk_number)
+    )
+    with open(f"{marker_path}.out", "w", encoding="utf-8") as f:
+        f.write(f"{offset} {position - offset}")
+    os.replace(f"{marker_path}.out", marker_path)
+    return position - offset
+
+
+def read_chunk_marker(
+    chunk_dir: str, file_identifier: str, chunk_number: int
+) -> typing.Optional[typing.Tuple[int, int]]:
+    """Returns the offset and size of chunk *chunk_number* of a preallocated
+    file, or ``None`` if it hasn't been saved yet.
+    """
+    path = os.path.join(chunk_dir, chunk_marker_filename(file_identifier, chunk_number))
+    try:
+        with open(path, encoding="utf-8") as f:
+            offset, size = f.read().split()
+    except FileNotFoundError:
+        return None
+    return int(offset), int(size)
+
+
+def remove_chunk_markers(chunk_dir: str, file_identifier: str) -> None:
+    pattern = re.compile(rf"{re.escape(file_identifier)}-\d+\.written")
+    with os.scandir(chunk_dir) as entries:
+        for entry in entries:
+            if pattern.fullmatch(entry.name):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+@dataclass
+class ChunkProgress:
+    """How many chunks of a file were saved, and how many bytes."""
+
+    chunks: int
+    size: int
+
+
+def record_chunk_saved(
+    chunk_dir: str, file_identifier: str, chunk_number: int, size: int
+) -> ChunkProgress:
+    """Records that chunk *chunk_number* of *file_identifier*, of *size*
+    bytes, was saved, unless it already was. Returns the progress including
+    it.
+
+    Only the header and the bitmap byte of the chunk are read and written,
+    under an exclusive lock on the progress file. The progress file isn't
+    synced: a chunk saved but not recorded before a crash is requested again
+    by flow.js, and recorded then.
+    """
+    bitmap_offset = _PROGRESS_HEADER.size + (chunk_number - 1) // 8
+    bit = 1 << ((chunk_number - 1) % 8)
+    fd = os.open(
+        os.path.join(chunk_dir, chunk_progress_filename(file_identifier)),
+        os.O_RDWR | os.O_CREAT,
+        0o644,
+    )
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        progress = _read_progress_header(fd)
+        bitmap_byte = os.pread(fd, 1, bitmap_offset)
+        bitmap_byte = bitmap_byte[0] if bitmap_byte else 0
+        if not bitmap_byte & bit:
+            os.pwrite(fd, bytes([bitmap_byte | bit]), bitmap_offset)
+            progress.chunks += 1
+            progress.size += size
+            os.pwrite(fd, _PROGRESS_HEADER.pack(progress.chunks, progress.size), 0)
+        return progress
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def is_chunk_recorded(chunk_dir: str, file_identifier: str, chunk_number: int) -> bool:
+    """Returns whether :py:func:`record_chunk_saved` recorded chunk
+    *chunk_number* of *file_identifier*.
+    """
+    try:
+        fd = os.open(
+            os.path.join(chunk_dir, chunk_progress_filename(file_identifier)),
+            os.O_RDONLY,
+        )
+    except FileNotFoundError:
+        return False
+    try:
+        bitmap_byte = os.pread(fd, 1, _PROGRESS_HEADER.size + (chunk_number - 1) // 8)
+    finally:
+        os.close(fd)
+    return bool(bitmap_byte) and bool(bitmap_byte[0] & 1 << ((chunk_number - 1) % 8))
+
+
+def read_chunk_progress(chunk_dir: str, file_identifier: str) -> ChunkProgress:
+    try:
+        fd = os.open(
+            os.path.join(chunk_dir, chunk_progress_filename(file_identifier)),
+            os.O_RDONLY,
+        )
+    except FileNotFoundError:
+        return ChunkProgress(chunks=0, size=0)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        return _read_progress_header(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_progress_header(fd: int) -> ChunkProgress:
+    header = os.pread(fd, _PROGRESS_HEADER.size, 0)
+    if len(header) < _PROGRESS_HEADER.size:
+        return ChunkProgress(chunks=0, size=0)
+    chunks, size = _PROGRESS_HEADER.unpack(header)
+    return ChunkProgress(chunks=chunks, size=size)
+
+
+def saved_chunk_ranges(
+    chunk_dir: str, file_identifier: str
+) -> typing.List[typing.Tuple[int, int]]:
+    """Returns the chunks of *file_identifier* recorded by
+    :py:func:`record_chunk_saved`, as ascending, inclusive ranges of chunk
+    numbers.
+    """
+    path = os.path.join(chunk_dir, chunk_progress_filename(file_identifier))
+    try:
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            bitmap = f.read()[_PROGRESS_HEADER.size :]
+    except FileNotFoundError:
+        return []
+
+    ranges = []
+    start = None
+    for index, byte in enumerate(bitmap):
+        # whole bytes continuing the current run or gap
+        if byte == (0 if start is None else 0xFF):
+            continue
+        for bit in range(8):
+            number = index * 8 + bit + 1
+            if byte >> bit & 1:
+                if start is None:
+                    start = number
+            elif start is not None:
+                ranges.append((start, number - 1))
+                start = None
+    if start is not None:
+        ranges.append((start, len(bitmap) * 8))
+    return ranges
+
+
+def remove_chunk_progress(chunk_dir: str, file_identifier: str) -> None:
+    try:
+        os.remove(os.path.join(chunk_dir, chunk_progress_filename(file_identifier)))
+    except FileNotFoundError:
+        pass
+
+
+def chunk_digests_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.sha256"
+
+
+def record_chunk_digest(
+    chunk_dir: str, file_identifier: str, chunk_number: int, sha256_sum: str
+) -> None:
+    """Records *sha256_sum*, the verified digest of chunk *chunk_number* of
+    *file_identifier*.
+
+    The digest file holds the raw digest of chunk *n* at offset
+    ``(n - 1) * 32``, and zeroes for chunks without one, so that a digest is
+    recorded with a single write and no lock.
+    """
+    fd = os.open(
+        os.path.join(chunk_dir, chunk_digests_filename(file_identifier)),
+        os.O_WRONLY | os.O_CREAT,
+        0o644,
+    )
+    try:
+        os.pwrite(fd, bytes.fromhex(sha256_sum), (chunk_number - 1) * _DIGEST_SIZE)
+    finally:
+        os.close(fd)
+
+
+def read_chunk_digests(chunk_dir: str, file_identifier: str) -> typing.Dict[int, str]:
+    """Returns the digests recorded by :py:func:`record_chunk_digest`, by
+    chunk number.
+    """
+    path = os.path.join(chunk_dir, chunk_digests_filename(file_identifier))
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    digests = {}
+    for offset in range(0, len(data) - _DIGEST_SIZE + 1, _DIGEST_SIZE):
+        digest = data[offset : offset + _DIGEST_SIZE]
+        if digest != _NO_DIGEST:
+            digests[offset // _DIGEST_SIZE + 1] = digest.hex()
+    return digests
+
+
+def remove_chunk_digests(chunk_dir: str, file_identifier: str) -> None:
+    try:
+        os.remove(os.path.join(chunk_dir, chunk_digests_filename(file_identifier)))
+    except FileNotFoundError:
+        pass
+
+
+def is_chunk_saved(chunk_dir: str, file_identifier: str, chunk_number: int) -> bool:
+    return os.path.exists(
+        os.path.join(chunk_dir, chunk_filename(file_identifier, chunk_number))
+    ) or os.path.exists(
+        os.path.join(chunk_dir, chunk_marker_filename(file_identifier, chunk_number))
+    )
+
+
+def hash_checkpoint_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.hashstate"
+
+
+def hash_lock_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.hashlock"
+
+
+@dataclass
+class HashCheckpoint:
+    """Digest state of the first ``next_chunk - 1`` chunks of a file."""
+
+    next_chunk: int
+    size: int
+    hashes: typing.Dict[str, ResumableHash]
+
+    @classmethod
+    def start(cls) -> "HashCheckpoint":
+        return cls(
+            next_chunk=1,
+            size=0,
+            hashes={name: ResumableHash(name) for name in ALGORITHMS},
+        )
+
+    @property
+    def hashed_chunks(self) -> int:
+        return self.next_chunk - 1
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "version": HASH_CHECKPOINT_VERSION,
+                "next_chunk": self.next_chunk,
+                "size": self.size,
+                "states": {
+                    name: base64.b64encode(_hash.state()).decode("ascii")
+                    for name, _hash in self.hashes.items()
+                },
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "HashCheckpoint":
+        """:raises: :py:exc:`ValueError` if *data* isn't a valid checkpoint"""
+        try:
+            parsed = json.loads(data)
+            if parsed["version"] != HASH_CHECKPOINT_VERSION:
+                raise ValueError(f"unsupported version {parsed['version']}")
+            return cls(
+                next_chunk=int(parsed["next_chunk"]),
+                size=int(parsed["size"]),
+                hashes={
+                    name: ResumableHash(name, base64.b64decode(parsed["states"][name]))
+                    for name in ALGORITHMS
+                },
+            )
+        except (KeyError, TypeError, json.JSONDecodeError) as e:
+            raise ValueError(f"invalid hash checkpoint: {e}") from e
+
+
+def load_hash_checkpoint(
+    chunk_dir: str, file_identifier: str
+) -> typing.Optional[HashCheckpoint]:
+    """Returns the saved checkpoint for *file_identifier*, or ``None`` if there
+    is no usable one.
+    """
+    return _load_checkpoint(
+        os.path.join(chunk_dir, hash_checkpoint_filename(file_identifier))
+    )
+
+
+def _load_checkpoint(path: str) -> typing.Optional[HashCheckpoint]:
+    if not RESUMABLE_HASH_AVAILABLE:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return HashCheckpoint.from_json(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("ignoring hash checkpoint %s: %s", path, e)
+        return None
+
+
+def save_hash_checkpoint(
+    chunk_dir: str, file_identifier: str, checkpoint: HashCheckpoint
+) -> None:
+    _save_checkpoint(
+        os.path.join(chunk_dir, hash_checkpoint_filename(file_identifier)),
+        checkpoint,
+    )
+
+
+def _save_checkpoint(path: str, checkpoint: HashCheckpoint) -> None:
+    tmp_path = f"{path}.out"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(checkpoint.to_json())
+    os.replace(tmp_path, path)
+
+
+def remove_hash_checkpoint(chunk_dir: str, file_identifier: str) -> None:
+    for filename in (
+        hash_checkpoint_filename(file_identifier),
+        hash_lock_filename(file_identifier),
+    ):
+        try:
+            os.remove(os.path.join(chunk_dir, filename))
+        except FileNotFoundError:
+            pass
+
+
+def merge_checkpoint_filename(file_identifier: str) -> str:
+    return f"{file_identifier}.mergestate"
+
+
+def load_merge_checkpoint(
+    chunk_dir: str, file_identifier: str
+) -> typing.Optional[HashCheckpoint]:
+    """Returns the checkpoint of an interrupted merge of the chunks of
+    *file_identifier*: its first ``hashed_chunks`` chunks are in the merged
+    file, which was synced, and hashed. Returns ``None`` if there is no
+    usable one.
+    """
+    return _load_checkpoint(
+        os.path.join(chunk_dir, merge_checkpoint_filename(file_identifier))
+    )
+
+
+def save_merge_checkpoint(
+    chunk_dir: str, file_identifier: str, checkpoint: HashCheckpoint
+) -> None:
+    # a checkpoint lost in a crash only means merging more chunks again
+    _save_checkpoint(
+        os.path.join(chunk_dir, merge_checkpoint_filename(file_identifier)),
+        checkpoint,
+    )
+
+
+def remove_merge_checkpoint(chunk_dir: str, file_identifier: str) -> None:
+    try:
+        os.remove(os.path.join(chunk_dir, merge_checkpoint_filename(file_identifier)))
+    except FileNotFoundError:
+        pass
+
+
+def advance_hash_checkpoint(
+    chunk_dir: str, file_identifier: str, total_chunks: int
+) -> None:
+    """Hashes the saved chunks of *file_identifier* which directly follow its
+    checkpoint, and saves the new checkpoint after each chunk.
+
+    Called after each chunk is saved. Only one process advances a checkpoint
+    at a time: if another one already is, this returns immediately and that
+    process picks up the newly saved chunk. Chunks arriving out of order are
+    hashed once the chunks before them have arrived, or by the merge.
+
+    Errors are logged rather than raised, since the merge can always fall back
+    to hashing every chunk.
+    """
+    if not RESUMABLE_HASH_AVAILABLE:
+        return
+    lock_path = os.path.join(chunk_dir, hash_lock_filename(file_identifier))
+    try:
+        while True:
+            with open(lock_path, "a", encoding="utf-8") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EACCES):
+                        return  # the lock holder will hash our chunk
+                    raise
+                next_chunk = _hash_available_chunks(
+                    chunk_dir, file_identifier, total_chunks
+                )
+            # a chunk saved while we held the lock was skipped by its request
+            if next_chunk > total_chunks or not is_chunk_saved(
+                chunk_dir, file_identifier, next_chunk
+            ):
+                return
+    except OSError as e:
+        logger.warning("failed to hash chunks of %s: %s", file_identifier, e)
+
+
+def _hash_available_chunks(
+    chunk_dir: str, file_identifier: str, total_chunks: int
+) -> int:
+    checkpoint = load_hash_checkpoint(chunk_dir, file_identifier)
+    if checkpoint is None:
+        checkpoint = HashCheckpoint.start()
+    buffer = memoryview(bytearray(HASH_READ_BUFFER_SIZE))
+    preallocated = is_preallocated(chunk_dir, file_identifier)
+    while checkpoint.next_chunk <= total_chunks:
+        if preallocated:
+            marker = read_chunk_marker(
+                chunk_dir, file_identifier, checkpoint.next_chunk
+            )
+            if marker is None:
+                break
+            offset, remaining = marker
+            path = preallocated_path(chunk_dir, file_identifier)
+        else:
+            offset, remaining = 0, None
+            path = os.path.join(
+                chunk_dir, chunk_filename(file_identifier, checkpoint.next_chunk)
+            )
+        try:
+            src = open(path, "rb", buffering=0)
+        except FileNotFoundError:
+            break
+        with src:
+            src.seek(offset)
+            while remaining is None or remaining > 0:
+                view = buffer if remaining is None else buffer[:remaining]
+                num_read = src.readinto(view)
+                if not num_read:
+                    break
+                for _hash in checkpoint.hashes.values():
+                    _hash.update(buffer[:num_read])
+                checkpoint.size += num_read
+                if remaining is not None:
+                    remaining -= num_read
+        checkpoint.next_chunk += 1
+        save_hash_checkpoint(chunk_dir, file_identifier, checkpoint)
+    return checkpoint.next_chunk
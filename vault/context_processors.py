@@ -12,3 +12,11 @@ def vault_version(request):
         "VAULT_VERSION": settings.VAULT_VERSION,
         "VAULT_GIT_COMMIT_HASH": settings.VAULT_GIT_COMMIT_HASH,
     }
+
+
+def flow_chunk_url(request):
+    return {
+        "FLOW_CHUNK_URL_NAME": (
+            "api_flow_chunk_async" if settings.FLOW_CHUNK_ASGI else "api_flow_chunk"
+        ),
+    }
@@ -0,0 +1,81 @@
+"""Deduplication of deposited content against content already replicated.
+
+Deposits often overlap earlier ones. A hashed DepositFile whose content
+(same sha256 and size) was already replicated for the same Organization is
+linked to the existing Petabox copy by :py:func:`link_replicas` instead of
+being uploaded again. TreeNodes are looked up by their indexed
+``sha256_sum``, and only count as replicated once their DepositFile is
+REPLICATED.
+"""
+
+import logging
+import typing
+from collections import defaultdict
+
+from django.db.models import Exists, OuterRef
+
+from vault.models import DepositFile, TreeNode
+
+logger = logging.getLogger(__name__)
+
+
+def find_replicas(
+    org_node_path: str, sha256_sums: typing.Iterable[str]
+) -> typing.Dict[typing.Tuple[str, int], str]:
+    """Returns the ``pbox_path`` of a replicated FILE under the organization
+    node at *org_node_path* for each of *sha256_sums* which has one, keyed by
+    ``(sha256_sum, size)``. A FILE is replicated once the DepositFile which
+    created it is REPLICATED.
+    """
+    replicated = DepositFile.objects.filter(
+        tree_node=OuterRef("pk"), state=DepositFile.State.REPLICATED
+    )
+    replicas = {}
+    for sha256_sum, size, pbox_path in (
+        TreeNode.objects.filter(
+            Exists(replicated),
+            path__descendant=org_node_path,
+            node_type=TreeNode.Type.FILE,
+            sha256_sum__in=set(sha256_sums),
+            pbox_path__isnull=False,
+        )
+        .order_by("id")
+        .values_list("sha256_sum", "size", "pbox_path")
+    ):
+        replicas.setdefault((sha256_sum, size), pbox_path)
+    return replicas
+
+
+def link_replicas(
+    deposit_files: typing.Iterable[DepositFile],
+) -> typing.List[DepositFile]:
+    """Points the TreeNode of each of *deposit_files* whose content was
+    already replicated for its Organization at the existing copy.
+
+    :return: the DepositFiles linked, which need no upload
+    """
+    by_org = defaultdict(list)
+    for deposit_file in deposit_files:
+        if deposit_file.tree_node_id and deposit_file.sha256_sum:
+            by_org[deposit_file.deposit.organization_id].append(deposit_file)
+
+    linked = []
+    for org_files in by_org.values():
+        org_node = org_files[0].deposit.organization.tree_node
+        if org_node is None:
+            continue
+        replicas = find_replicas(org_node.path, [f.sha256_sum for f in org_files])
+        for deposit_file in org_files:
+            pbox_path = replicas.get((deposit_file.sha256_sum, deposit_file.size))
+            if pbox_path is None or deposit_file.tree_node.pbox_path:
+                continue
+            TreeNode.objects.filter(pk=deposit_file.tree_node_id).update(
+                pbox_path=pbox_path
+            )
+            deposit_file.tree_node.pbox_path = pbox_path
+            logger.info(
+                f"DepositFile {deposit_file.id} content already replicated at "
+                f"{pbox_path}, skipping upload"
+            )
+            linked.append(deposit_file)
+    return linked
@@ -0,0 +1,332 @@
+"""Local fixity checks, which re-hash the shafs copies of the files of a
+Collection on this host instead of asking the remote Fixitter (see
+:py:mod:`vault.fixity_api`), at the speed of the local disks.
+
+:py:func:`check_collection` walks the FILE TreeNodes of a Collection in
+``path`` order and re-hashes their blobs in a pool of worker processes (see
+:py:mod:`vault.fixity_worker`), whose combined reads can be capped with
+``FIXITY_MAX_BYTES_PER_SECOND``. It saves a FIXITY Report and its
+FixityResults, like those imported from the Fixitter (see
+:py:mod:`vault.fixity_reports`).
+
+:py:func:`run_scheduled` spreads these checks over time instead: each day, it
+checks the files of each Collection which were least recently verified, up to
+a :py:func:`daily_budget` of bytes such that every file is checked once per
+period of the Collection's ``fixity_frequency``. It is meant to run daily.
+"""
+
+import itertools
+import logging
+import math
+import multiprocessing
+import typing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from vault import models, shafs
+from vault.fixity_api import (
+    FIXITY_REPORT_JSON_VERSION,
+    STREAM_BATCH_SIZE,
+    folder_prefix,
+    iter_files,
+)
+from vault.fixity_worker import BlobCheck, hash_blob
+from vault.hashing import ALGORITHMS
+
+logger = logging.getLogger(__name__)
+
+#: ``source`` of the blobs checked, in the ``sources`` of a file
+SOURCE = "SHAFS"
+
+#: time within which every file is checked, by Collection.fixity_frequency
+FIXITY_PERIODS = {
+    models.FixityFrequency.DEFAULT: timedelta(days=182),
+    models.FixityFrequency.QUARTERLY: timedelta(days=91),
+    models.FixityFrequency.MONTHLY: timedelta(days=30),
+}
+
+
+@dataclass
+class FixityTotals:
+    file_count: int = 0
+    total_size: int = 0
+    #: bytes read from disk
+    bytes_read: int = 0
+    error_count: int = 0
+    missing_location_count: int = 0
+    mismatch_count: int = 0
+
+
+def check_collection(
+    collection: models.Collection,
+    workers: typing.Optional[int] = None,
+    max_bytes_per_second: typing.Optional[float] = None,
+    files: typing.Optional[typing.Iterable[typing.Tuple[str, models.TreeNode]]] = None,
+) -> models.Report:
+    """Re-hashes the shafs copy on this host of every file of *collection*,
+    or only of *files*, ``(filename, node)`` pairs, with *workers* processes
+    reading at most *max_bytes_per_second* in total (``0`` for no limit), by
+    default ``FIXITY_WORKERS`` and ``FIXITY_MAX_BYTES_PER_SECOND``, and
+    saves the Report of the check.
+
+    Files without a copy on this host are reported as missing. The
+    ``last_verified_at`` of every file which passes its check is updated, so
+    that those which fail stay due.
+    """
+    if workers is None:
+        workers = settings.FIXITY_WORKERS
+    if max_bytes_per_second is None:
+        max_bytes_per_second = settings.FIXITY_MAX_BYTES_PER_SECOND
+    # each worker gets an equal share of the bandwidth
+    worker_bytes_per_second = max_bytes_per_second / workers
+
+    started_at = timezone.now()
+    org_id = collection.organization_id
+    if files is None:
+        files = (
+            (filename, node)
+            for _, filename, node in iter_files(collection.tree_node, "", None, True)
+        )
+    # saved first, so that its FixityResults can be saved as their files are
+    # checked, and updated with the totals once they all have been
+    report = models.Report.objects.create(
+        collection=collection,
+        report_type=models.Report.ReportType.FIXITY,
+        started_at=started_at,
+        ended_at=started_at,
+        total_size=0,
+        file_count=0,
+        collection_total_size=collection.tree_node.size or 0,
+        collection_file_count=collection.tree_node.file_count,
+        error_count=0,
+        missing_location_count=0,
+        mismatch_count=0,
+        avg_replication=0,
+        report_json_version=FIXITY_REPORT_JSON_VERSION,
+    )
+    totals = FixityTotals()
+    results = []
+    verified_ids = []
+    try:
+        for node, file_json in _iter_checks(
+            org_id, totals, files, workers, worker_bytes_per_second
+        ):
+            results.append(models.FixityResult.from_json(report, file_json))
+            if len(results) >= STREAM_BATCH_SIZE:
+                models.FixityResult.objects.bulk_create(results)
+                results = []
+            if file_json["success"]:
+                verified_ids.append(node.id)
+                if len(verified_ids) >= STREAM_BATCH_SIZE:
+                    _mark_verified(verified_ids)
+        models.FixityResult.objects.bulk_create(results)
+        _mark_verified(verified_ids)
+    except BaseException:
+        # the report of only some of the files would pass for a complete one
+        report.delete()
+        raise
+    ended_at = timezone.now()
+
+    report.ended_at = ended_at
+    report.total_size = totals.total_size
+    report.file_count = totals.file_count
+    report.error_count = totals.error_count
+    report.missing_location_count = totals.missing_location_count
+    report.mismatch_count = totals.mismatch_count
+    report.report_json = {
+        "collectionName": f"{org_id}_{collection.name}",
+        "startTime": _timestamp(started_at),
+        "endTime": _timestamp(ended_at),
+        "fileCount": totals.file_count,
+        "totalSize": totals.total_size,
+        "errorCount": totals.error_count,
+        "errors": {
+            "missingLocationCount": totals.missing_location_count,
+            "mismatchCount": totals.mismatch_count,
+        },
+    }
+    report.save()
+    seconds = (ended_at - started_at).total_seconds()
+    logger.info(
+        "Fixity of collection %s: %s files, %s bytes read in %.2fs, %s errors, "
+        "Report %s",
+        collection.id,
+        totals.file_count,
+        totals.bytes_read,
+        seconds,
+        totals.error_count,
+        report.id,
+    )
+    return report
+
+
+def daily_budget(collection: models.Collection) -> int:
+    """Returns the number of bytes of *collection* to check each day, so that
+    all of it is checked within the period of its ``fixity_frequency``.
+    """
+    period = FIXITY_PERIODS[collection.fixity_frequency]
+    return math.ceil((collection.tree_node.size or 0) / period.days)
+
+
+def due_files(
+    collection: models.Collection, budget: int
+) -> typing.Iterator[typing.Tuple[str, models.TreeNode]]:
+    """Yields ``(filename, node)`` for the files of *collection* least
+    recently verified, never verified first, until their sizes add up to
+    *budget* bytes.
+
+    Files without a copy on this host are left out: they can't pass a check,
+    so they would otherwise stay first and use up every day's budget.
+    """
+    root = collection.tree_node
+    nodes = (
+        models.TreeNode.objects.filter(
+            path__descendant=root.path, node_type=models.TreeNode.Type.FILE
+        )
+        .order_by(F("last_verified_at").asc(nulls_first=True), "path")
+        .iterator(chunk_size=STREAM_BATCH_SIZE)
+    )
+    prefixes = {root.id: ""}
+    total = 0
+    while total < budget:
+        batch = list(itertools.islice(nodes, STREAM_BATCH_SIZE))
+        if not batch:
+            return
+        present = shafs.present_sha256_sums(
+            collection.organization_id, (node.sha256_sum for node in batch)
+        )
+        for node in batch:
+            if total >= budget:
+                return
+            if node.sha256_sum not in present:
+                continue
+            if node.parent_id not in prefixes:
+                prefixes[node.parent_id] = folder_prefix(root, "", node.parent_id)
+            total += node.size or 0
+            yield prefixes[node.parent_id] + node.name, node
+
+
+def run_scheduled(
+    collections: typing.Optional[typing.Iterable[models.Collection]] = None,
+    workers: typing.Optional[int] = None,
+    max_bytes_per_second: typing.Optional[float] = None,
+) -> typing.List[models.Report]:
+    """Checks the day's slice of each of *collections*, by default all of
+    them, see :py:func:`due_files`, and returns the Reports of the checks.
+    """
+    if collections is None:
+        collections = models.Collection.objects.select_related("tree_node").order_by(
+            "id"
+        )
+    reports = []
+    for collection in collections:
+        if collection.tree_node is None:
+            continue
+        budget = daily_budget(collection)
+        if not budget:
+            continue
+        reports.append(
+            check_collection(
+                collection,
+                workers=workers,
+                max_bytes_per_second=max_bytes_per_second,
+                files=due_files(collection, budget),
+            )
+        )
+    return reports
+
+
+def _mark_verified(file_ids):
+    """Sets the ``last_verified_at`` of the TreeNodes *file_ids*, and empties
+    the list.
+    """
+    if file_ids:
+        models.TreeNode.objects.filter(id__in=file_ids).update(
+            last_verified_at=timezone.now()
+        )
+        file_ids.clear()
+
+
+def _iter_checks(org_id, totals, files, workers, worker_bytes_per_second):
+    """Yields ``(node, file_json)`` for each of *files* as it is checked, see
+    :py:func:`_check_file`, hashing their blobs in *workers* processes.
+    """
+    # worker processes are spawned, so that they don't share the DB connection
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending = deque()
+        for filename, node in files:
+            path = shafs.locate_blob(org_id, node.sha256_sum)
+            future = None
+            if path is not None:
+                future = executor.submit(hash_blob, path, worker_bytes_per_second)
+            pending.append((filename, node, path, future))
+            # keep every worker busy, without queueing the whole collection
+            while len(pending) > 2 * workers:
+                entry = pending.popleft()
+                yield entry[1], _check_file(org_id, totals, *entry)
+        while pending:
+            entry = pending.popleft()
+            yield entry[1], _check_file(org_id, totals, *entry)
+
+
+def _check_file(org_id, totals, filename, node, path, future):
+    """Returns the report JSON of the file at *filename*, whose blob at
+    *path* is being hashed by *future*, and adds it to *totals*.
+    """
+    check: typing.Optional[BlobCheck] = None if future is None else future.result()
+    canonical = [f"{name}:{getattr(node, f'{name}_sum')}" for name in ALGORITHMS]
+    file_json = {
+        "filename": filename,
+        "id": f"treeNode-{node.id}",
+        "depositTime": _timestamp(node.uploaded_at),
+        "checkTime": _timestamp(timezone.now()),
+        "size": node.size,
+        "success": False,
+        "canonicalChecksums": canonical,
+        "sources": [
+            {"source": "VAULT", "type": "prior", "time": _timestamp(node.uploaded_at)}
+        ],
+    }
+    totals.file_count += 1
+    totals.total_size += node.size or 0
+
+    path = path or shafs.blob_path(org_id, node.sha256_sum or "")
+    location = f"{settings.SHAFS_STORE_NAME}:{path}"
+    if check is None or check.error is not None:
+        if check is not None:
+            logger.warning("Fixity can't read %s: %s", path, check.error)
+        file_json["missingLocations"] = [location]
+        totals.missing_location_count += 1
+    else:
+        totals.bytes_read += check.size
+        file_json["sources"].append(
+            {"source": SOURCE, "type": "generated", "location": location}
+        )
+        computed = [f"{name}:{check.digests[name]}" for name in ALGORITHMS]
+        if computed == canonical and check.size == node.size:
+            file_json["success"] = True
+        else:
+            file_json["mismatchGroups"] = [
+                {"checksums": canonical, "locations": []},
+                {"checksums": computed, "locations": [location]},
+            ]
+            totals.mismatch_count += 1
+
+    if not file_json["success"]:
+        totals.error_count += 1
+    return file_json
+
+
+def _timestamp(value):
+    """Formats *value* like the Fixitter, e.g. ``2022-03-05T20:39:51.986Z``."""
+    if value is None:
+        return None
+    return value.isoformat(timespec="milliseconds").replace("+00:00", "Z")
@@ -2,28 +2,35 @@
 
 import json
 import logging
-import os
 import requests
 
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import MultipleObjectsReturned
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http import (
     FileResponse,
     HttpResponse,
+    HttpResponseBadRequest,
     HttpResponseForbidden,
     HttpResponseNotAllowed,
     HttpResponseNotFound,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.views.decorators.csrf import csrf_exempt
 
-from vault import models
+from vault import models, shafs
 
 logger = logging.getLogger(__name__)
 
 
-FIXITY_REPORT_JSON_VERSION = 1
+#: Since version 2, the files of a report are FixityResults rather than the
+#: ``files`` of its ``report_json``
+FIXITY_REPORT_JSON_VERSION = 2
+
+#: TreeNodes fetched per query, and files per chunk, of streamed listings
+STREAM_BATCH_SIZE = 1000
 
 
 def _api_key_required(action):
@@ -35,13 +42,9 @@ def _api_key_required(action):
     return wrapper
 
 
-def _locations(url_prefix, org_id, file):
+def _locations(url_prefix, org_id, file, in_shafs):
     accum = []
-    org_tmp_path = str(org_id)
-    shafs_root = os.path.join(settings.SHADIR_ROOT, org_tmp_path)
-    shafs_path = os.path.join(shafs_root, file.sha256_sum)
-
-    if os.path.exists(shafs_path):
+    if in_shafs:
         accum.append(f"{url_prefix}/shafs/{org_id}/{file.sha256_sum}")
     if file.pbox_path and "/" in file.pbox_path:
         accum.append(f"https://archive.org/download/{file.pbox_path}")
@@ -49,8 +52,39 @@ def _locations(url_prefix, org_id, file):
     return accum
 
 
+def _files_json(url_prefix, org_id, files):
+    """Returns the JSON of each of *files*, given as ``(filename, TreeNode)``
+    pairs, resolving their shafs locations with one query.
+    """
+    in_shafs = shafs.present_sha256_sums(org_id, [file.sha256_sum for _, file in files])
+    return [
+        _file_json(url_prefix, org_id, filename, file, file.sha256_sum in in_shafs)
+        for filename, file in files
+    ]
+
+
+def _file_json(url_prefix, org_id, filename, file, in_shafs):
+    return {
+        "id": "treeNode-" + str(file.id),
+        "name": file.name,
+        "filename": filename,
+        "size": file.size,
+        "time": file.uploaded_at,
+        "checksums": {
+            "md5": file.md5_sum,
+            "sha1": file.sha1_sum,
+            "sha256": file.sha256_sum,
+        },
+        "locations": _locations(url_prefix, org_id, file, in_shafs),
+    }
+
+
 @_api_key_required
 def list_files(request, org_id, path):
+    """Lists the files and child folders of the folder at *path*.
+
+    With ``stream=1`` the listing is streamed, see :py:func:`_stream_files`.
+    """
     org = get_object_or_404(models.Organization, id=org_id)
     parent = org.tree_node
     path = path.strip("/ ")
@@ -66,31 +100,22 @@ def list_files(request, org_id, path):
             logger.error(error_msg)
             return HttpResponseNotFound(error_msg)
 
-    files = parent.children.filter(node_type="FILE")
-    children = parent.children.exclude(node_type="FILE")
     name_prefix = "/".join(split_path[1:])
     name_prefix = name_prefix + "/" if name_prefix else ""
     url_path = path + "/" if path else ""
     url_prefix = request.build_absolute_uri().split("/files/", 1)[0]
 
+    if request.GET.get("stream") == "1":
+        return _stream_files(request, org_id, parent, name_prefix, url_path, url_prefix)
+
+    files = parent.children.filter(node_type="FILE")
+    children = parent.children.exclude(node_type="FILE")
+
     return JsonResponse(
         {
-            "files": [
-                {
-                    "id": "treeNode-" + str(file.id),
-                    "name": file.name,
-                    "filename": name_prefix + file.name,
-                    "size": file.size,
-                    "time": file.uploaded_at,
-                    "checksums": {
-                        "md5": file.md5_sum,
-                        "sha1": file.sha1_sum,
-                        "sha256": file.sha256_sum,
-                    },
-                    "locations": _locations(url_prefix, org_id, file),
-                }
-                for file in files
-            ],
+            "files": _files_json(
+                url_prefix, org_id, [(name_prefix + file.name, file) for file in files]
+            ),
             "children": {
                 child.name: f"{url_prefix}/files/{org_id}/{url_path}{child.name}"
                 for child in children
@@ -99,13 +124,137 @@ def list_files(request, org_id, path):
     )
 
 
+def _stream_files(request, org_id, parent, name_prefix, url_path, url_prefix):
+    """Streams the listing of *parent* with the same JSON shape as
+    :py:func:`list_files`, querying the files in keyset-paginated batches so
+    that memory use doesn't grow with the size of the folder.
+
+    Query parameters:
+
+    * ``recursive=1``: list every file of the subtree in a single pass, in
+      ``path`` order, instead of the files of *parent* and its children
+    * ``limit``: return at most this many files. When there are more, the
+      ``next`` key holds the URL of the next page, which keeps the
+      ``api_key`` and other parameters of the request so it can be followed
+      as is.
+    * ``after``: the cursor of the page, taken from a ``next`` URL
+    """
+    recursive = request.GET.get("recursive") == "1"
+    after = request.GET.get("after") or None
+    try:
+        limit = int(request.GET.get("limit") or 0)
+        if limit < 0:
+            raise ValueError(limit)
+    except ValueError:
+        return HttpResponseBadRequest("limit must be a non-negative integer")
+
+    children = {}
+    if not recursive and after is None:
+        children = {
+            name: f"{url_prefix}/files/{org_id}/{url_path}{name}?stream=1"
+            for name in parent.children.exclude(node_type="FILE")
+            .order_by("name")
+            .values_list("name", flat=True)
+        }
+
+    def listing():
+        yield '{"files": ['
+        count = 0
+        cursor = None
+        next_url = None
+        batch = []
+        separator = ""
+        for key, filename, file in iter_files(parent, name_prefix, after, recursive):
+            if limit and count == limit:
+                query = request.GET.copy()
+                query["after"] = cursor
+                next_url = request.build_absolute_uri("?" + query.urlencode())
+                break
+            batch.append((filename, file))
+            count += 1
+            cursor = key
+            if len(batch) == STREAM_BATCH_SIZE:
+                yield separator + _encode_files(url_prefix, org_id, batch)
+                separator = ","
+                batch = []
+        if batch:
+            yield separator + _encode_files(url_prefix, org_id, batch)
+        yield '], "children": ' + json.dumps(children)
+        yield ', "next": ' + json.dumps(next_url) + "}"
+
+    return StreamingHttpResponse(listing(), content_type="application/json")
+
+
+def _encode_files(url_prefix, org_id, files):
+    return ",".join(
+        json.dumps(file_json, cls=DjangoJSONEncoder)
+        for file_json in _files_json(url_prefix, org_id, files)
+    )
+
+
+def iter_files(parent, name_prefix, after, recursive):
+    """Yields ``(cursor, filename, file)`` for the FILE TreeNodes directly
+    under *parent*, by name, or with *recursive* under its whole subtree, by
+    path, starting after the cursor *after*. Nodes are fetched
+    :py:data:`STREAM_BATCH_SIZE` at a time.
+    """
+    if recursive:
+        nodes = (
+            models.TreeNode.objects.filter(
+                path__descendant=parent.path,
+                node_type__in=(models.TreeNode.Type.FILE, models.TreeNode.Type.FOLDER),
+            )
+            .exclude(pk=parent.pk)
+            .order_by("path")
+        )
+        key = "path"
+    else:
+        nodes = parent.children.filter(node_type=models.TreeNode.Type.FILE).order_by(
+            "name"
+        )
+        key = "name"
+
+    # the filename prefix of each folder seen, keyed by id. Folders sort
+    # before their contents by path, except at the start of a page
+    prefixes = {parent.id: name_prefix}
+    while True:
+        page = nodes.filter(**{f"{key}__gt": after}) if after is not None else nodes
+        batch = list(page[:STREAM_BATCH_SIZE])
+        for node in batch:
+            if node.parent_id not in prefixes:
+                prefixes[node.parent_id] = folder_prefix(
+                    parent, name_prefix, node.parent_id
+                )
+            prefix = prefixes[node.parent_id]
+            if node.node_type == models.TreeNode.Type.FOLDER:
+                prefixes[node.id] = f"{prefix}{node.name}/"
+            else:
+                yield getattr(node, key), prefix + node.name, node
+        if len(batch) < STREAM_BATCH_SIZE:
+            return
+        after = getattr(batch[-1], key)
+
+
+def folder_prefix(root, root_prefix, folder_id):
+    """Returns the filename prefix of the files in the folder *folder_id*
+    under *root*, whose own prefix is *root_prefix*.
+    """
+    folder = models.TreeNode.objects.get(pk=folder_id)
+    names = (
+        models.TreeNode.objects.filter(
+            path__ancestor=folder.path, path__descendant=root.path
+        )
+        .exclude(pk=root.pk)
+        .order_by("path")
+        .values_list("name", flat=True)
+    )
+    return root_prefix + "".join(f"{name}/" for name in names)
+
+
 @_api_key_required
 def stream_from_shafs(request, org_id, sha256_sum):
-    org_tmp_path = str(org_id)
-    shafs_root = os.path.join(settings.SHADIR_ROOT, org_tmp_path)
-    shafs_path = os.path.join(shafs_root, sha256_sum)
-
-    if os.path.exists(shafs_path):
+    shafs_path = shafs.locate_blob(org_id, sha256_sum)
+    if shafs_path is not None:
         return FileResponse(open(shafs_path, "rb"))
 
     return HttpResponseNotFound(f"{org_id}/{sha256_sum} not found.")
@@ -168,33 +317,15 @@ def postback(request, org_id, collection_id, token):
     except models.Collection.DoesNotExist:
         return HttpResponseNotFound()
 
-    body = json.loads(request.body)
-    report_url = body["reportUrl"]
-    api_key = settings.FIXITTER_API_KEY
-    response = requests.get(report_url, params={"apikey": api_key, "format": "json"})
-    report_json = response.json()
-    report_errors = report_json.get("errors", {})
-
-    # pylint: disable=invalid-name
-    TODO = 0
-
-    report = models.Report(
-        collection=collection,
-        report_type=models.Report.ReportType.FIXITY,
-        started_at=report_json["startTime"],
-        ended_at=report_json["endTime"],
-        total_size=report_json["totalSize"],
-        file_count=report_json["fileCount"],
-        collection_total_size=TODO,
-        collection_file_count=TODO,
-        error_count=report_json["errorCount"],
-        missing_location_count=report_errors.get("missingLocationCount", 0),
-        mismatch_count=report_errors.get("mismatchCount", 0),
-        avg_replication=TODO,
-        report_json=report_json,
-        report_json_version=FIXITY_REPORT_JSON_VERSION,
+    try:
+        report_url = json.loads(request.body)["reportUrl"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return HttpResponseBadRequest("reportUrl is required")
+
+    # reports can be too large to fetch within the request: they are imported
+    # by the import_fixity_reports management command
+    models.PendingFixityReport.objects.create(
+        collection=collection, report_url=report_url
     )
 
-    report.save()
-
     return HttpResponse(status=202)  # 202 = Accepted
@@ -0,0 +1,257 @@
+"""Imports the fixity reports posted back by the Fixitter, see
+:py:func:`vault.fixity_api.postback`.
+
+A report lists every file of a collection, so it can be too large to load
+whole. :py:func:`import_report` streams it from the Fixitter, parsing it with
+:py:func:`iter_report_items` one file at a time, and saves its files as
+:py:class:`~vault.models.FixityResult` rows in batches, in the transaction
+which saves its Report.
+"""
+
+import codecs
+import datetime
+import json
+import logging
+import re
+import typing
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from vault import models
+from vault.fixity_api import FIXITY_REPORT_JSON_VERSION
+
+logger = logging.getLogger(__name__)
+
+#: bytes read from the Fixitter at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+#: FixityResults saved per query
+BATCH_SIZE = 1000
+
+#: seconds to wait for the Fixitter to connect or to send more of a report
+FIXITTER_TIMEOUT = 60
+
+#: seconds before a failed import is retried, doubled with each failure up to
+#: RETRY_MAX_DELAY
+RETRY_DELAY = 60
+RETRY_MAX_DELAY = 24 * 60 * 60
+
+#: reports which failed to import this many times are no longer retried, and
+#: are left pending with their last error to be looked into
+MAX_IMPORT_ATTEMPTS = 20
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
+class _JSONReader:
+    """Reads JSON tokens and values from a stream of UTF-8 encoded chunks,
+    holding no more of it in memory than the value being read.
+    """
+
+    def __init__(self, chunks: typing.Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        try:
+            text = self._decoder.decode(next(self._chunks))
+        except StopIteration:
+            text = self._decoder.decode(b"", final=True)
+            self._eof = True
+        self._buffer = self._buffer[self._pos :] + text
+        self._pos = 0
+
+    def peek(self) -> str:
+        """Returns the next character which isn't whitespace."""
+        while True:
+            self._pos = _WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                raise json.JSONDecodeError("Unexpected end", self._buffer, self._pos)
+            self._fill()
+
+    def expect(self, *tokens: str) -> str:
+        """Reads the next character, which must be one of *tokens*."""
+        char = self.peek()
+        if char not in tokens:
+            raise json.JSONDecodeError(
+                f"Expecting {' or '.join(tokens)}", self._buffer, self._pos
+            )
+        self._pos += 1
+        return char
+
+    def value(self) -> typing.Any:
+        """Reads the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+                # a number at the end of the buffer may go on in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def iter_report_items(
+    chunks: typing.Iterable[bytes],
+) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    """Yields ``(key, value)`` for each key of the JSON report object read
+    from *chunks*, except ``files``, for which it yields ``("files", file)``
+    for each of its files.
+
+    :raises json.JSONDecodeError: if the report isn't a JSON object
+    """
+    reader = _JSONReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "files":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(",", "]") == "]":
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(",", "}") == "}":
+            return
+
+
+def import_report(pending: models.PendingFixityReport) -> models.Report:
+    """Imports the report *pending*, deleting it once imported."""
+    response = requests.get(
+        pending.report_url,
+        params={"apikey": settings.FIXITTER_API_KEY, "format": "json"},
+        stream=True,
+        timeout=FIXITTER_TIMEOUT,
+    )
+    response.raise_for_status()
+
+    with transaction.atomic():
+        # saved first, so that its FixityResults can refer to it, and updated
+        # from the report's fields once they have all been read
+        report = models.Report.objects.create(
+            collection_id=pending.collection_id,
+            report_type=models.Report.ReportType.FIXITY,
+            started_at=pending.received_at,
+            ended_at=pending.received_at,
+            total_size=0,
+            file_count=0,
+            collection_total_size=0,
+            collection_file_count=0,
+            error_count=0,
+            missing_location_count=0,
+            mismatch_count=0,
+            avg_replication=0,
+            report_json_version=FIXITY_REPORT_JSON_VERSION,
+        )
+        header = {}
+        batch = []
+        for key, value in iter_report_items(response.iter_content(READ_CHUNK_SIZE)):
+            if key != "files":
+                header[key] = value
+                continue
+            batch.append(models.FixityResult.from_json(report, value))
+            if len(batch) == BATCH_SIZE:
+                models.FixityResult.objects.bulk_create(batch)
+                batch = []
+        models.FixityResult.objects.bulk_create(batch)
+
+        report_errors = header.get("errors", {})
+        report.started_at = parse_datetime(header["startTime"])
+        report.ended_at = parse_datetime(header["endTime"])
+        report.total_size = header["totalSize"]
+        report.file_count = header["fileCount"]
+        report.error_count = header["errorCount"]
+        report.missing_location_count = report_errors.get("missingLocationCount", 0)
+        report.mismatch_count = report_errors.get("mismatchCount", 0)
+        report.report_json = header
+        report.save()
+        pending.delete()
+
+    logger.info(
+        "Imported fixity report %s of collection %s: %s files, %s errors",
+        report.id,
+        report.collection_id,
+        report.file_count,
+        report.error_count,
+    )
+    return report
+
+
+def import_pending_reports() -> typing.Tuple[int, int]:
+    """Imports every pending report, oldest first, skipping those being
+    imported by another process. Failed imports, whatever their error, are
+    kept to be retried later, see :py:func:`record_failed_import`.
+
+    :return: the number of reports imported and failed
+    """
+    imported = failed = 0
+    seen = set()
+    while True:
+        with transaction.atomic():
+            pending = (
+                models.PendingFixityReport.objects.select_for_update(skip_locked=True)
+                .filter(attempts__lt=MAX_IMPORT_ATTEMPTS)
+                .filter(
+                    Q(retry_after__isnull=True) | Q(retry_after__lte=timezone.now())
+                )
+                .exclude(id__in=seen)
+                .order_by("received_at")
+                .first()
+            )
+            if pending is None:
+                return imported, failed
+            seen.add(pending.id)
+            try:
+                import_report(pending)
+                imported += 1
+            # a report which can't be imported mustn't hold up the others
+            except Exception as e:
+                logger.exception("Failed to import fixity report %s", pending.id)
+                record_failed_import(pending, e)
+                failed += 1
+
+
+def record_failed_import(pending: models.PendingFixityReport, error: Exception):
+    """Records the failed import of *pending*, which is retried after a delay
+    doubling with each attempt, up to :py:data:`MAX_IMPORT_ATTEMPTS` times.
+    """
+    pending.attempts += 1
+    pending.last_error = repr(error)
+    delay = min(RETRY_DELAY * 2 ** (pending.attempts - 1), RETRY_MAX_DELAY)
+    pending.retry_after = timezone.now() + datetime.timedelta(seconds=delay)
+    if pending.attempts >= MAX_IMPORT_ATTEMPTS:
+        logger.error(
+            "Giving up on fixity report %s after %s attempts",
+            pending.id,
+            pending.attempts,
+        )
+    try:
+        with transaction.atomic():
+            pending.save(update_fields=["attempts", "last_error", "retry_after"])
+    # the report is skipped for the rest of the pass all the same
+    except DatabaseError:
+        logger.exception(
+            "Failed to record the failed import of fixity report %s", pending.id
+        )
@@ -0,0 +1,57 @@
+"""The work of the processes of a local fixity check, see
+:py:mod:`vault.fixity`.
+
+This module only depends on the standard library, so that worker processes
+are started without setting up Django.
+"""
+
+import hashlib
+import time
+import typing
+from dataclasses import dataclass, field
+
+from vault.hashing import ALGORITHMS
+
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+@dataclass
+class BlobCheck:
+    """The result of re-hashing a blob."""
+
+    #: bytes read
+    size: int
+    #: hex digests keyed by algorithm name, empty if the blob couldn't be read
+    digests: typing.Dict[str, str] = field(default_factory=dict)
+    #: why the blob couldn't be read
+    error: typing.Optional[str] = None
+
+
+def hash_blob(
+    path: str, max_bytes_per_second: float = 0, buffer_size: int = READ_BUFFER_SIZE
+) -> BlobCheck:
+    """Computes the md5, sha1 and sha256 digests of the file at *path*,
+    reading it at most *max_bytes_per_second* (if non-zero).
+    """
+    hashes = {name: hashlib.new(name) for name in ALGORITHMS}
+    view = memoryview(bytearray(buffer_size))
+    size = 0
+    start = time.monotonic()
+    try:
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                num_read = f.readinto(view)
+                if not num_read:
+                    break
+                for _hash in hashes.values():
+                    _hash.update(view[:num_read])
+                size += num_read
+                if max_bytes_per_second:
+                    ahead = size / max_bytes_per_second - (time.monotonic() - start)
+                    if ahead > 0:
+                        time.sleep(ahead)
+    except OSError as e:
+        return BlobCheck(size=size, error=str(e))
+    return BlobCheck(
+        size=size, digests={name: _hash.hexdigest() for name, _hash in hashes.items()}
+    )
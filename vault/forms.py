@@ -1,5 +1,6 @@
 # pylint: disable=too-many-instance-attributes
 
+import typing
 from dataclasses import dataclass
 
 from django.contrib.auth import password_validation
@@ -10,6 +11,7 @@ from django.forms import CheckboxSelectMultiple
 from django.utils.translation import gettext_lazy as _
 
 from vault import models
+from vault.chunks import FLOW_IDENTIFIER_REGEX
 
 
 class CreateCollectionForm(forms.Form):
@@ -90,11 +92,13 @@ class FlowChunkGet:
 @dataclass
 class FlowChunkPost(FlowChunkGet):
     file: File
+    #: digest of the chunk sent by the client, to be verified
+    sha256_sum: typing.Optional[str] = None
 
 
 class FlowChunkGetForm(forms.Form):
     depositId = forms.IntegerField()
-    flowIdentifier = forms.CharField()
+    flowIdentifier = forms.RegexField(regex=FLOW_IDENTIFIER_REGEX, max_length=255)
     flowFilename = forms.CharField()
     flowRelativePath = forms.CharField()
     flowChunkNumber = forms.IntegerField()
@@ -119,6 +123,7 @@ class FlowChunkGetForm(forms.Form):
 
 class FlowChunkPostForm(FlowChunkGetForm):
     file = forms.FileField(allow_empty_file=True)
+    flowChunkSha256 = forms.RegexField(regex=r"^[0-9a-fA-F]{64}$", required=False)
 
     def flow_chunk(self) -> FlowChunkPost:
         return FlowChunkPost(
@@ -132,6 +137,7 @@ class FlowChunkPostForm(FlowChunkGetForm):
             file_total_size=self.cleaned_data["flowTotalSize"],
             file_total_chunks=self.cleaned_data["flowTotalChunks"],
             target_chunk_size=self.cleaned_data["flowChunkSize"],
+            sha256_sum=self.cleaned_data["flowChunkSha256"].lower() or None,
         )
 
 
@@ -150,7 +156,7 @@ class RegisterDepositForm(forms.Form):
 
 
 class RegisterDepositFileForm(forms.Form):
-    flow_identifier = forms.CharField()
+    flow_identifier = forms.RegexField(regex=FLOW_IDENTIFIER_REGEX, max_length=255)
     name = forms.CharField()
     relative_path = forms.CharField()
     size = forms.IntegerField()
@@ -0,0 +1,168 @@
+"""Helpers for computing the digests Vault records for deposited files."""
+
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+#: Digest algorithms recorded for every deposited file, see
+#: :py:class:`vault.models.TreeNode`
+ALGORITHMS = ("md5", "sha1", "sha256")
+
+
+class MultiHash:
+    """Computes the md5, sha1 and sha256 digests of a byte stream, updating
+    each digest in its own thread.
+
+    hashlib releases the GIL while hashing large buffers, so the three digests
+    are computed concurrently with each other and with the caller (which is
+    typically reading the next buffer).
+
+    :py:meth:`update` returns before hashing is done: the caller must not
+    modify the passed buffer until the next call to :py:meth:`update` or
+    :py:meth:`wait`.
+    """
+
+    def __init__(
+        self,
+        algorithms: typing.Iterable[str] = ALGORITHMS,
+        hashes: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+    ):
+        """*hashes*, if given, maps algorithm names to hash objects (e.g.
+        :py:class:`ResumableHash`) to continue updating, instead of starting
+        new hashes for *algorithms*.
+        """
+        if hashes is None:
+            hashes = {name: hashlib.new(name) for name in algorithms}
+        self._hashes = dict(hashes)
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self._hashes), thread_name_prefix="hash"
+        )
+        self._pending = []
+
+    def __enter__(self) -> "MultiHash":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, data) -> None:
+        """Waits for the previous update to finish, then starts hashing
+        *data* in the background.
+        """
+        self.wait()
+        self._pending = [
+            self._executor.submit(_hash.update, data) for _hash in self._hashes.values()
+        ]
+
+    def wait(self) -> None:
+        """Blocks until all pending updates are done."""
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+    def hashes(self) -> typing.Dict[str, typing.Any]:
+        """Returns the hash objects, keyed by algorithm name, once all pending
+        updates are done.
+        """
+        self.wait()
+        return dict(self._hashes)
+
+    def hexdigests(self) -> typing.Dict[str, str]:
+        """Returns a ``dict`` of hex digests keyed by algorithm name."""
+        self.wait()
+        return {name: _hash.hexdigest() for name, _hash in self._hashes.items()}
+
+    def close(self) -> None:
+        self.wait()
+        self._executor.shutdown()
+
+
+# OpenSSL's low-level digest API keeps the whole state of a digest in a plain
+# struct, which (unlike hashlib objects) can be saved and restored as bytes.
+# name: (function prefix, sizeof(*_CTX), digest size)
+_LIBCRYPTO_DIGESTS = {
+    "md5": ("MD5", 92, 16),
+    "sha1": ("SHA1", 96, 20),
+    "sha256": ("SHA256", 112, 32),
+}
+
+
+def _load_libcrypto():
+    path = ctypes.util.find_library("crypto")
+    if not path:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+        for prefix, _, _ in _LIBCRYPTO_DIGESTS.values():
+            getattr(lib, f"{prefix}_Init").argtypes = [ctypes.c_void_p]
+            getattr(lib, f"{prefix}_Update").argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_void_p,
+                ctypes.c_size_t,
+            ]
+            getattr(lib, f"{prefix}_Final").argtypes = [
+                ctypes.c_void_p,
+                ctypes.c_void_p,
+            ]
+    except (OSError, AttributeError) as e:
+        logger.warning("libcrypto digests unavailable: %s", e)
+        return None
+    return lib
+
+
+_libcrypto = _load_libcrypto()
+
+#: Whether :py:class:`ResumableHash` can be used on this host
+RESUMABLE_HASH_AVAILABLE = _libcrypto is not None
+
+
+class ResumableHash:
+    """A hashlib-like md5, sha1 or sha256 hash whose intermediate state can
+    be saved with :py:meth:`state` and restored later, possibly by another
+    process on the same host.
+
+    Saved state is only meaningful to the libcrypto it was produced with and
+    must not be persisted beyond the lifetime of an upload.
+    """
+
+    def __init__(self, name: str, state: typing.Optional[bytes] = None):
+        if _libcrypto is None:
+            raise RuntimeError("libcrypto is not available")
+        prefix, ctx_size, self.digest_size = _LIBCRYPTO_DIGESTS[name]
+        self.name = name
+        self._update = getattr(_libcrypto, f"{prefix}_Update")
+        self._final = getattr(_libcrypto, f"{prefix}_Final")
+        if state is None:
+            self._ctx = ctypes.create_string_buffer(ctx_size)
+            getattr(_libcrypto, f"{prefix}_Init")(self._ctx)
+        else:
+            if len(state) != ctx_size:
+                raise ValueError(f"invalid {name} state")
+            self._ctx = ctypes.create_string_buffer(state, ctx_size)
+
+    def update(self, data) -> None:
+        try:
+            buffer = (ctypes.c_char * len(data)).from_buffer(data)
+        except TypeError:
+            # read-only buffers (e.g. bytes) are passed as is
+            buffer = bytes(data)
+        # ctypes releases the GIL for the duration of the call
+        self._update(self._ctx, buffer, len(data))
+
+    def state(self) -> bytes:
+        return self._ctx.raw
+
+    def digest(self) -> bytes:
+        # finalizing clobbers the context, so finalize a copy
+        ctx = ctypes.create_string_buffer(self._ctx.raw, len(self._ctx))
+        out = ctypes.create_string_buffer(self.digest_size)
+        self._final(out, ctx)
+        return out.raw
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
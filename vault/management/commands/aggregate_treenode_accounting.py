@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vault.accounting import AGGREGATE_BATCH_SIZE, aggregate_journal
+
+
+class Command(BaseCommand):
+    help = (
+        "Folds journaled TreeNode accounting deltas into the file_count and size "
+        "of their TreeNodes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=AGGREGATE_BATCH_SIZE,
+            help="journal rows folded per transaction",
+        )
+        parser.add_argument(
+            "--follow",
+            action="store_true",
+            help="keep aggregating new deltas until interrupted",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5,
+            help="seconds to wait when the journal is drained, with --follow",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            folded = aggregate_journal(options["batch_size"])
+            total += folded
+            if folded:
+                continue
+            if not options["follow"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"Folded {total} TreeNode accounting deltas.")
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vault import fixity_reports
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports the fixity reports posted back by the Fixitter into Reports and "
+        "their per-file results"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--follow",
+            action="store_true",
+            help="keep importing newly posted back reports until interrupted",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="seconds to wait between imports, with --follow",
+        )
+
+    def handle(self, *args, **options):
+        total_imported = total_failed = 0
+        while True:
+            imported, failed = fixity_reports.import_pending_reports()
+            total_imported += imported
+            total_failed += failed
+            if not options["follow"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(
+            f"{total_imported} fixity reports imported, {total_failed} failed"
+        )
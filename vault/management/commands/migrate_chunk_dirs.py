@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from vault import chunks
+from vault.models import Organization
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves flow chunks saved directly in an organization's chunks folder into "
+        "the per-file folders used since. Run once after upgrading, with uploads "
+        "and process_chunked_files stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--org",
+            dest="org_ids",
+            type=int,
+            action="append",
+            help="only move the chunks of this organization id (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        org_ids = options["org_ids"] or sorted(
+            Organization.objects.values_list("id", flat=True)
+        )
+        for org_id in org_ids:
+            moved = chunks.move_into_file_chunk_dirs(org_id)
+            self.stdout.write(
+                f"Organization {org_id}: {moved} files moved into per-file chunk folders"
+            )
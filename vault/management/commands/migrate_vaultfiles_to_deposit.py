@@ -1,8 +1,8 @@
 import os
 import re
 import unicodedata
-from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from vault.chunks import chunk_filename, file_chunk_dir
 from vault.models import (
     Collection,
     Deposit,
@@ -86,16 +86,17 @@ class Command(BaseCommand):
                     user=user,
                     parent_node=collection_node,
                 )
-                org_tmp_path = str(collection.organization_id)
-                osfs_root = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, org_tmp_path)
 
                 deposit_files = []
                 skipped_files = []
                 for file in files:
                     flow_identifier = gen_flow_identifier(file)
-                    os.makedirs(os.path.join(osfs_root, "chunks"), exist_ok=True)
-                    chunk_file_path = (
-                        os.path.join(osfs_root, "chunks", flow_identifier) + "-1.tmp"
+                    chunk_dir = file_chunk_dir(
+                        collection.organization_id, flow_identifier
+                    )
+                    os.makedirs(chunk_dir, exist_ok=True)
+                    chunk_file_path = os.path.join(
+                        chunk_dir, chunk_filename(flow_identifier, 1)
                     )
 
                     deposit_file = DepositFile(
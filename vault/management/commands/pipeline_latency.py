@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Aggregate, Avg, Count, DurationField, F, Max
+
+from vault import utils
+from vault.models import DepositFile
+
+STAGES = [
+    ("upload->hash", "uploaded_at", "hashed_at"),
+    ("hash->replicate", "hashed_at", "replicated_at"),
+    ("upload->replicate", "uploaded_at", "replicated_at"),
+]
+
+
+class Percentile(Aggregate):
+    function = "PERCENTILE_CONT"
+    name = "percentile"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = DurationField()
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=percentile, **extra)
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarizes DepositFile pipeline latency from uploaded_at to hashed_at to "
+        "replicated_at"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="only include DepositFiles uploaded in the last HOURS hours",
+        )
+
+    def handle(self, *args, **options):
+        since = utils.utcnow() - timedelta(hours=options["hours"])
+        for label, stats in pipeline_latency(since).items():
+            if not stats["count"]:
+                self.stdout.write(f"{label}: no files")
+                continue
+            self.stdout.write(
+                f"{label}: {stats['count']} files, "
+                f"avg {stats['avg']}, p50 {stats['p50']}, "
+                f"p95 {stats['p95']}, max {stats['max']}"
+            )
+
+
+def pipeline_latency(since):
+    """Returns latency statistics per pipeline stage for the DepositFiles
+    uploaded since *since* which have completed the stage.
+    """
+    latencies = {}
+    for label, start, end in STAGES:
+        latency = F(end) - F(start)
+        latencies[label] = (
+            DepositFile.objects.filter(uploaded_at__gte=since)
+            .exclude(**{f"{start}__isnull": True})
+            .exclude(**{f"{end}__isnull": True})
+            .aggregate(
+                count=Count("id"),
+                avg=Avg(latency, output_field=DurationField()),
+                p50=Percentile(latency, 0.5),
+                p95=Percentile(latency, 0.95),
+                max=Max(latency, output_field=DurationField()),
+            )
+        )
+    return latencies
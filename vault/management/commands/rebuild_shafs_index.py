@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vault import shafs
+from vault.models import Organization, ShafsBlob
+
+
+class Command(BaseCommand):
+    help = "Rebuilds this host's index of the shafs store from a scan of SHADIR_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--org",
+            dest="org_ids",
+            type=int,
+            action="append",
+            help="only rebuild the index of this organization id (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        org_ids = options["org_ids"]
+        if not org_ids:
+            # organizations whose folder is gone may still have index entries
+            org_ids = sorted(
+                set(Organization.objects.values_list("id", flat=True))
+                & shafs.org_ids_on_disk()
+                | set(
+                    ShafsBlob.objects.filter(store=settings.SHAFS_STORE_NAME)
+                    .values_list("organization_id", flat=True)
+                    .distinct()
+                )
+            )
+        for org_id in org_ids:
+            added, removed = shafs.rebuild_index(org_id)
+            self.stdout.write(
+                f"Organization {org_id}: {added} entries added, {removed} removed"
+            )
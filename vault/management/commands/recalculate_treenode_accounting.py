@@ -45,6 +45,11 @@ class Command(BaseCommand):
                 cursor.execute(
                     f'ALTER TABLE "vault_treenode" DISABLE TRIGGER {trigger};'
                 )
+            # journaled deltas are superseded by the recalculated values
+            cursor.execute(
+                'LOCK TABLE "vault_treenodeaccountingdelta" IN EXCLUSIVE MODE;'
+            )
+            cursor.execute('DELETE FROM "vault_treenodeaccountingdelta";')
 
         try:
             qs = TreeNode.objects.all()
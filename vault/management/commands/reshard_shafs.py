@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vault import shafs
+from vault.models import Organization
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves this host's shafs blobs into the layout set by SHADIR_FANOUT_LEVELS. "
+        "Safe to run while the store is in use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--org",
+            dest="org_ids",
+            type=int,
+            action="append",
+            help="only reshard the blobs of this organization id (repeatable)",
+        )
+
+    def handle(self, *args, **options):
+        org_ids = options["org_ids"]
+        if not org_ids:
+            org_ids = sorted(
+                set(Organization.objects.values_list("id", flat=True))
+                & shafs.org_ids_on_disk()
+            )
+        for org_id in org_ids:
+            moved = shafs.reshard(org_id)
+            self.stdout.write(
+                f"Organization {org_id}: {moved} blobs moved into "
+                f"{settings.SHADIR_FANOUT_LEVELS}-level layout"
+            )
@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vault import fixity
+from vault.models import Collection
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks the fixity of the shafs copies on this host of the files of "
+        "collections, and saves a FIXITY Report for each. With --scheduled, "
+        "checks only the day's slice of each collection; run it daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--collection",
+            dest="collection_ids",
+            type=int,
+            action="append",
+            help="id of a collection to check (repeatable)",
+        )
+        parser.add_argument(
+            "--scheduled",
+            action="store_true",
+            help=(
+                "check the least recently verified files of the collections, "
+                "by default all of them, up to their daily budget"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="number of processes re-hashing files (default FIXITY_WORKERS)",
+        )
+        parser.add_argument(
+            "--max-bandwidth",
+            type=int,
+            help=(
+                "combined read rate cap in bytes per second, 0 for none "
+                "(default FIXITY_MAX_BYTES_PER_SECOND)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        collection_ids = options["collection_ids"]
+        if not collection_ids and not options["scheduled"]:
+            raise CommandError("pass --collection, --scheduled or both")
+        collections = Collection.objects.select_related("tree_node").order_by("id")
+        if collection_ids:
+            collections = collections.filter(id__in=collection_ids)
+        kwargs = {
+            "workers": options["workers"],
+            "max_bytes_per_second": options["max_bandwidth"],
+        }
+
+        start = time.monotonic()
+        if options["scheduled"]:
+            reports = fixity.run_scheduled(collections, **kwargs)
+        else:
+            reports = [
+                fixity.check_collection(collection, **kwargs)
+                for collection in collections
+            ]
+        elapsed = time.monotonic() - start
+
+        for report in reports:
+            self.stdout.write(
+                f"Collection {report.collection_id}: Report {report.id}, "
+                f"{report.file_count} files, {report.total_size} bytes, "
+                f"{report.error_count} errors"
+            )
+        total_size = sum(report.total_size for report in reports)
+        self.stdout.write(
+            f"Checked {total_size} bytes in {elapsed:.1f}s "
+            f"({total_size / max(elapsed, 0.001) / 2**20:.1f} MiB/s)"
+        )
@@ -0,0 +1,206 @@
+"""Creates the TreeNodes for deposited files in bulk.
+
+Creating TreeNodes one at a time costs a ``get_or_create`` per folder of each
+file's path, and every insert fires the accounting trigger which updates all
+of the new node's ancestors. :py:func:`materialize_deposit_files` instead
+creates all the missing folders and files of a Deposit with bulk inserts, with
+the accounting triggers deferred (see :py:mod:`vault.accounting`), and then
+applies the summed file_count and size deltas to each affected ancestor with a
+single ``UPDATE``.
+"""
+
+import logging
+import typing
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from vault.accounting import (
+    Deltas,
+    add_to_ancestors,
+    apply_deltas,
+    deferred_treenode_accounting,
+)
+from vault.models import Deposit, DepositFile, TreeNode
+
+logger = logging.getLogger(__name__)
+
+#: Classid of the advisory locks serializing materialization per Collection
+MATERIALIZE_LOCK_CLASS = 7
+
+BATCH_SIZE = 1000
+
+
+def materialize_deposit_files(deposit: Deposit) -> typing.List[DepositFile]:
+    """Creates or updates the TreeNodes of every HASHED DepositFile of
+    *deposit* which has no TreeNode yet, under the Deposit's parent node.
+
+    A DepositFile whose file node already exists (i.e. was deposited before)
+    replaces the existing node's attributes.
+
+    :return: the DepositFiles given a TreeNode
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # deposits into the same collection may create the same folders
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s, %s)",
+                [MATERIALIZE_LOCK_CLASS, deposit.collection_id],
+            )
+        deposit_files = list(
+            DepositFile.objects.filter(
+                deposit=deposit,
+                state=DepositFile.State.HASHED,
+                tree_node__isnull=True,
+            ).order_by("id")
+        )
+        if not deposit_files:
+            return []
+
+        deltas = defaultdict(lambda: [0, 0])
+        with deferred_treenode_accounting():
+            folders = _make_folders(deposit, deposit_files, deltas)
+            _make_files(deposit, deposit_files, folders, deltas)
+            apply_deltas(deltas)
+        DepositFile.objects.bulk_update(
+            deposit_files, ["tree_node"], batch_size=BATCH_SIZE
+        )
+
+    logger.info(
+        f"Materialized {len(deposit_files)} TreeNode FILEs for Deposit {deposit.id}, "
+        f"updating accounting of {len(deltas)} ancestors"
+    )
+    return deposit_files
+
+
+def _folder_segments(deposit_file: DepositFile) -> typing.Tuple[str, ...]:
+    # filter and ignore empty path segments. Strip file name segment
+    return tuple(filter(None, deposit_file.relative_path.split("/")[:-1]))
+
+
+def _make_folders(
+    deposit: Deposit, deposit_files: typing.List[DepositFile], deltas: Deltas
+) -> typing.Dict[typing.Tuple[str, ...], TreeNode]:
+    """Finds or creates, one tree level at a time, every folder on the paths
+    of *deposit_files*. Returns the folders keyed by their path segments
+    relative to the Deposit's parent node.
+    """
+    folder_paths = set()
+    for deposit_file in deposit_files:
+        segments = _folder_segments(deposit_file)
+        for depth in range(1, len(segments) + 1):
+            folder_paths.add(segments[:depth])
+
+    folders = {(): TreeNode.objects.get(pk=deposit.parent_node_id)}
+    for depth in range(1, max(map(len, folder_paths), default=0) + 1):
+        level = [path for path in folder_paths if len(path) == depth]
+        parent_ids = {folders[path[:-1]].id for path in level}
+        existing = {
+            (node.parent_id, node.name): node
+            for node in TreeNode.objects.filter(
+                parent_id__in=parent_ids,
+                name__in={path[-1] for path in level},
+            ).only("id", "parent_id", "name", "path", "node_type")
+        }
+
+        missing = {}
+        for path in level:
+            key = (folders[path[:-1]].id, path[-1])
+            if key in existing:
+                folders[path] = existing[key]
+            else:
+                missing[path] = TreeNode(
+                    node_type=TreeNode.Type.FOLDER, parent_id=key[0], name=key[1]
+                )
+        created = TreeNode.objects.bulk_create(missing.values(), batch_size=BATCH_SIZE)
+        # paths are set by trigger, so aren't returned by the INSERT
+        paths = dict(
+            TreeNode.objects.filter(pk__in=[node.pk for node in created]).values_list(
+                "id", "path"
+            )
+        )
+        for path, node in missing.items():
+            node.path = paths[node.pk]
+            folders[path] = node
+            add_to_ancestors(deltas, folders[path[:-1]].path, 1, 0)
+        if missing:
+            logger.info(
+                f"Created {len(missing)} TreeNode FOLDERs at depth {depth} "
+                f"for Deposit {deposit.id}"
+            )
+    return folders
+
+
+def _make_files(
+    deposit: Deposit,
+    deposit_files: typing.List[DepositFile],
+    folders: typing.Dict[typing.Tuple[str, ...], TreeNode],
+    deltas: Deltas,
+) -> None:
+    """Creates the file nodes of *deposit_files*, or updates those which
+    already exist, and sets each DepositFile's ``tree_node``.
+    """
+    for start in range(0, len(deposit_files), BATCH_SIZE):
+        batch = deposit_files[start : start + BATCH_SIZE]
+        parents = [folders[_folder_segments(f)] for f in batch]
+        existing = {
+            (node.parent_id, node.name): node
+            for node in TreeNode.objects.filter(
+                parent_id__in={parent.id for parent in parents},
+                name__in={f.name for f in batch},
+            )
+        }
+
+        new_nodes = {}
+        replaced_nodes = {}
+        for deposit_file, parent in zip(batch, parents):
+            key = (parent.id, deposit_file.name)
+            node = new_nodes.get(key) or existing.get(key)
+            if node is None:
+                node = new_nodes[key] = TreeNode(
+                    node_type=TreeNode.Type.FILE, parent_id=parent.id, name=key[1]
+                )
+                node.size = 0
+                add_to_ancestors(deltas, parent.path, 1, 0)
+            elif key in existing:
+                # We just replaced the old file, update tree node values to match
+                logger.info(
+                    f"TreeNode entry replaced: id:{node.id} - {node.name}\n"
+                    + f"\tPrevious data was: md5_sum:{node.md5_sum} "
+                    + f"sha1_sum:{node.sha1_sum} sha256_sum:{node.sha256_sum} "
+                    + f"size:{node.size} uploaded_at:{node.uploaded_at}"
+                )
+                replaced_nodes[key] = node
+            add_to_ancestors(
+                deltas, parent.path, 0, deposit_file.size - (node.size or 0)
+            )
+            node.md5_sum = deposit_file.md5_sum
+            node.sha1_sum = deposit_file.sha1_sum
+            node.sha256_sum = deposit_file.sha256_sum
+            node.size = deposit_file.size
+            node.file_type = deposit_file.type
+            node.uploaded_at = deposit_file.uploaded_at
+            node.modified_at = deposit_file.hashed_at
+            node.pre_deposit_modified_at = deposit_file.pre_deposit_modified_at
+            node.uploaded_by_id = deposit.user_id
+            deposit_file.tree_node = node
+
+        TreeNode.objects.bulk_create(new_nodes.values(), batch_size=BATCH_SIZE)
+        # new nodes had no id yet when they were assigned
+        for deposit_file in batch:
+            deposit_file.tree_node_id = deposit_file.tree_node.id
+        TreeNode.objects.bulk_update(
+            replaced_nodes.values(),
+            [
+                "md5_sum",
+                "sha1_sum",
+                "sha256_sum",
+                "size",
+                "file_type",
+                "uploaded_at",
+                "modified_at",
+                "pre_deposit_modified_at",
+                "uploaded_by",
+            ],
+            batch_size=BATCH_SIZE,
+        )
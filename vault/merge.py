@@ -0,0 +1,391 @@
+"""Merges the uploaded chunks of a DepositFile into a single file while
+computing its digests in the same pass, or, for chunks which were written in
+place, only computes the digests.
+
+A merge can be checkpointed periodically, so that a merge which was
+interrupted resumes from its last checkpoint instead of from the first chunk,
+see :py:func:`merge_chunks`.
+"""
+
+import errno
+import logging
+import os
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+from vault.hashing import MultiHash
+
+logger = logging.getLogger(__name__)
+
+#: size of each of the two buffers chunks are read into
+READ_BUFFER_SIZE = 2 * 1024 * 1024
+
+#: bytes merged between two checkpoints of a merge
+CHECKPOINT_INTERVAL = 1024 * 1024 * 1024
+
+#: bytes at the end of a partial merge compared with the chunks before it is
+#: resumed
+VERIFY_TAIL_SIZE = 1024 * 1024
+
+#: :py:attr:`MergeResult.copy_method` of files whose chunks were written in
+#: place, so that nothing was copied
+IN_PLACE = "in_place"
+
+#: errnos indicating that a copy syscall isn't usable for a pair of files
+_COPY_UNSUPPORTED_ERRNOS = {
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    errno.EBADF,
+}
+
+
+class MergeAborted(Exception):
+    """Raised when a merge or hash is aborted through its *abort* event,
+    e.g. because the worker running it lost its lease on the DepositFile.
+    """
+
+
+class CopyMethod:
+    """How merged bytes are written to the destination file, fastest first."""
+
+    #: in-kernel copy; a metadata-only reflink on filesystems supporting it
+    COPY_FILE_RANGE = "copy_file_range"
+    #: in-kernel copy
+    SENDFILE = "sendfile"
+    #: write from the userspace buffer the bytes were hashed from
+    WRITE = "write"
+
+
+@dataclass
+class MergeTimings:
+    """Wall-clock seconds spent in each stage of a merge."""
+
+    read: float = 0.0
+    write: float = 0.0
+    #: time spent waiting for hashing which didn't overlap with reads and
+    #: writes
+    hash_wait: float = 0.0
+    total: float = 0.0
+
+
+@dataclass
+class MergeResult:
+    size: int
+    digests: typing.Dict[str, str]
+    copy_method: str
+    timings: MergeTimings = field(default_factory=MergeTimings)
+
+
+def merge_chunks(
+    chunk_paths: typing.Iterable[str],
+    dest_path: str,
+    buffer_size: int = READ_BUFFER_SIZE,
+    copy_method: str = CopyMethod.COPY_FILE_RANGE,
+    hashes: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+    hashed_chunks: int = 0,
+    merged_chunks: int = 0,
+    merged_size: int = 0,
+    checkpoint: typing.Optional[
+        typing.Callable[[int, int, typing.Mapping[str, typing.Any]], None]
+    ] = None,
+    checkpoint_interval: int = CHECKPOINT_INTERVAL,
+    abort: typing.Optional[threading.Event] = None,
+) -> MergeResult:
+    """Concatenates the files at *chunk_paths* into a new file at *dest_path*
+    and computes md5, sha1 and sha256 digests of the result.
+
+    If the first *hashed_chunks* chunks were already hashed as they were
+    uploaded, *hashes* holds the hash objects for them: those chunks are only
+    copied, and hashing continues from *hashes* with the following chunk.
+
+    If *checkpoint* is given, it is called with the number of chunks merged,
+    their size and the hash objects covering them, at the end of a chunk once
+    at least *checkpoint_interval* bytes were merged since the last call, and
+    after the destination was synced. A merge resumes from such a checkpoint
+    when passed its *merged_chunks* and *merged_size*, and its hash objects as
+    *hashes*: the destination is then truncated to *merged_size* rather than
+    to zero, and the merge continues with the following chunk.
+
+    The destination is opened (and truncated) once. Chunks are read into two
+    preallocated buffers which alternate, so that each buffer is hashed in the
+    background (see :py:class:`.MultiHash`) while the next one is read. The
+    bytes just read are copied to the destination from the page cache with
+    ``copy_file_range(2)`` or ``sendfile(2)`` where supported, falling back to
+    writing them from the buffer.
+
+    If *abort* is set, the merge stops before its next read, checkpoint or
+    chunk.
+
+    :raises: :py:exc:`OSError` if a chunk can't be read or the destination
+        can't be written
+    :raises: :py:exc:`MergeAborted` if *abort* was set
+    """
+    timings = MergeTimings()
+    start = time.perf_counter()
+    buffers = [memoryview(bytearray(buffer_size)) for _ in range(2)]
+    current = 0
+    if merged_chunks:
+        hashed_chunks = max(hashed_chunks, merged_chunks)
+        size = merged_size
+    else:
+        size = 0
+    checkpointed_size = size
+
+    with MultiHash(hashes=hashes) as hasher, open(
+        dest_path, "r+b" if merged_chunks else "wb"
+    ) as dest:
+        dest_fd = dest.fileno()
+        # drop whatever was written after the checkpoint resumed from
+        dest.truncate(size)
+        for index, chunk_path in enumerate(chunk_paths):
+            if index < merged_chunks:
+                continue
+            _check_abort(abort, dest_path)
+            if (
+                checkpoint is not None
+                and index >= hashed_chunks
+                and size - checkpointed_size >= checkpoint_interval
+            ):
+                # hashes only cover all chunks so far once past hashed_chunks
+                _checkpoint(checkpoint, hasher, dest_fd, index, size)
+                checkpointed_size = size
+            with open(chunk_path, "rb", buffering=0) as src:
+                if index < hashed_chunks:
+                    write_start = time.perf_counter()
+                    copied, copy_method = _copy_unhashed(
+                        copy_method, src, dest_fd, size, buffers[0]
+                    )
+                    timings.write += time.perf_counter() - write_start
+                    size += copied
+                    continue
+
+                src_offset = 0
+                while True:
+                    _check_abort(abort, dest_path)
+                    view = buffers[current]
+                    read_start = time.perf_counter()
+                    num_read = src.readinto(view)
+                    timings.read += time.perf_counter() - read_start
+                    if not num_read:
+                        break
+
+                    hash_start = time.perf_counter()
+                    hasher.update(view[:num_read])
+                    timings.hash_wait += time.perf_counter() - hash_start
+
+                    write_start = time.perf_counter()
+                    copy_method = _copy(
+                        copy_method,
+                        src.fileno(),
+                        src_offset,
+                        dest_fd,
+                        size,
+                        view[:num_read],
+                    )
+                    timings.write += time.perf_counter() - write_start
+
+                    src_offset += num_read
+                    size += num_read
+                    current ^= 1
+
+        hash_start = time.perf_counter()
+        digests = hasher.hexdigests()
+        timings.hash_wait += time.perf_counter() - hash_start
+
+    timings.total = time.perf_counter() - start
+    return MergeResult(
+        size=size, digests=digests, copy_method=copy_method, timings=timings
+    )
+
+
+def verify_partial_merge(
+    chunk_paths: typing.Sequence[str],
+    dest_path: str,
+    merged_chunks: int,
+    merged_size: int,
+) -> bool:
+    """Returns whether the merge of *chunk_paths* into *dest_path* can resume
+    from a checkpoint of its first *merged_chunks* chunks, of *merged_size*
+    bytes: the chunks must still add up to *merged_size*, the destination
+    must hold at least that many bytes, and its last (up to)
+    ``VERIFY_TAIL_SIZE`` bytes must match the chunk they were copied from.
+    """
+    if not 0 < merged_chunks <= len(chunk_paths):
+        return False
+    try:
+        if (
+            sum(os.path.getsize(path) for path in chunk_paths[:merged_chunks])
+            != merged_size
+            or os.path.getsize(dest_path) < merged_size
+        ):
+            return False
+        last_chunk = chunk_paths[merged_chunks - 1]
+        count = min(VERIFY_TAIL_SIZE, os.path.getsize(last_chunk))
+        with open(last_chunk, "rb") as src, open(dest_path, "rb") as dest:
+            src.seek(-count, os.SEEK_END)
+            dest.seek(merged_size - count)
+            return src.read(count) == dest.read(count)
+    except OSError as e:
+        logger.warning("can't verify partial merge %s: %s", dest_path, e)
+        return False
+
+
+def hash_in_place(
+    path: str,
+    buffer_size: int = READ_BUFFER_SIZE,
+    hashes: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+    hashed_size: int = 0,
+    abort: typing.Optional[threading.Event] = None,
+) -> MergeResult:
+    """Computes md5, sha1 and sha256 digests of the file at *path*, into
+    which chunks were written in place (see
+    :py:func:`vault.chunks.write_chunk_in_place`).
+
+    If its first *hashed_size* bytes were already hashed as they were
+    uploaded, *hashes* holds the hash objects for them, and hashing continues
+    from *hashes* with the following byte.
+
+    If *abort* is set, hashing stops before its next read.
+
+    :raises: :py:exc:`OSError` if the file can't be read
+    :raises: :py:exc:`MergeAborted` if *abort* was set
+    """
+    timings = MergeTimings()
+    start = time.perf_counter()
+    buffers = [memoryview(bytearray(buffer_size)) for _ in range(2)]
+    current = 0
+    size = hashed_size if hashes is not None else 0
+
+    with MultiHash(hashes=hashes) as hasher, open(path, "rb", buffering=0) as src:
+        src.seek(size)
+        while True:
+            _check_abort(abort, path)
+            view = buffers[current]
+            read_start = time.perf_counter()
+            num_read = src.readinto(view)
+            timings.read += time.perf_counter() - read_start
+            if not num_read:
+                break
+
+            hash_start = time.perf_counter()
+            hasher.update(view[:num_read])
+            timings.hash_wait += time.perf_counter() - hash_start
+
+            size += num_read
+            current ^= 1
+
+        hash_start = time.perf_counter()
+        digests = hasher.hexdigests()
+        timings.hash_wait += time.perf_counter() - hash_start
+
+    timings.total = time.perf_counter() - start
+    return MergeResult(
+        size=size, digests=digests, copy_method=IN_PLACE, timings=timings
+    )
+
+
+def _check_abort(abort, path):
+    if abort is not None and abort.is_set():
+        raise MergeAborted(path)
+
+
+def _checkpoint(checkpoint, hasher, dest_fd, chunks, size):
+    # the merged bytes must be durable before a checkpoint refers to them
+    hashes = hasher.hashes()
+    os.fdatasync(dest_fd)
+    checkpoint(chunks, size, hashes)
+
+
+def _copy(copy_method, src_fd, src_offset, dest_fd, dest_offset, data) -> str:
+    """Copies *data*, which was read from *src_fd* at *src_offset*, to
+    *dest_fd* at *dest_offset*. Returns the copy method to use for subsequent
+    copies, which is downgraded when *copy_method* turns out not to be
+    supported for these files.
+    """
+    copy_method = _copy_in_kernel(
+        copy_method, src_fd, src_offset, dest_fd, dest_offset, len(data)
+    )
+    if copy_method == CopyMethod.WRITE:
+        _write(dest_fd, dest_offset, data)
+    return copy_method
+
+
+def _copy_unhashed(copy_method, src, dest_fd, dest_offset, buffer):
+    """Copies the whole of *src* to *dest_fd* at *dest_offset*, without
+    reading it into userspace where possible. Returns the number of bytes
+    copied and the copy method to use for subsequent copies.
+    """
+    count = os.fstat(src.fileno()).st_size
+    copy_method = _copy_in_kernel(
+        copy_method, src.fileno(), 0, dest_fd, dest_offset, count
+    )
+    if copy_method != CopyMethod.WRITE:
+        return count, copy_method
+
+    copied = 0
+    while True:
+        num_read = src.readinto(buffer)
+        if not num_read:
+            break
+        _write(dest_fd, dest_offset + copied, buffer[:num_read])
+        copied += num_read
+    return copied, copy_method
+
+
+def _copy_in_kernel(copy_method, src_fd, src_offset, dest_fd, dest_offset, count):
+    """Copies *count* bytes with the first supported in-kernel copy method,
+    starting from *copy_method*. Returns the method used, or
+    :py:attr:`CopyMethod.WRITE` if the bytes still need to be written.
+    """
+    if copy_method == CopyMethod.COPY_FILE_RANGE:
+        try:
+            _copy_file_range(src_fd, src_offset, dest_fd, dest_offset, count)
+            return copy_method
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in _COPY_UNSUPPORTED_ERRNOS:
+                raise
+            logger.info("copy_file_range unavailable, falling back: %s", e)
+            copy_method = CopyMethod.SENDFILE
+
+    if copy_method == CopyMethod.SENDFILE:
+        try:
+            _sendfile(src_fd, src_offset, dest_fd, dest_offset, count)
+            return copy_method
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED_ERRNOS:
+                raise
+            logger.info("sendfile unavailable, falling back: %s", e)
+
+    return CopyMethod.WRITE
+
+
+def _write(dest_fd, dest_offset, data):
+    os.lseek(dest_fd, dest_offset, os.SEEK_SET)
+    while data:
+        num_written = os.write(dest_fd, data)
+        data = data[num_written:]
+
+
+def _copy_file_range(src_fd, src_offset, dest_fd, dest_offset, count):
+    while count:
+        copied = os.copy_file_range(src_fd, dest_fd, count, src_offset, dest_offset)
+        if copied == 0:
+            raise OSError(errno.EINVAL, "copy_file_range copied no bytes")
+        src_offset += copied
+        dest_offset += copied
+        count -= copied
+
+
+def _sendfile(src_fd, src_offset, dest_fd, dest_offset, count):
+    # sendfile writes at the current position of the destination
+    os.lseek(dest_fd, dest_offset, os.SEEK_SET)
+    while count:
+        sent = os.sendfile(dest_fd, src_fd, src_offset, count)
+        if sent == 0:
+            raise OSError(errno.EINVAL, "sendfile copied no bytes")
+        src_offset += sent
+        count -= sent
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.9 on 2026-10-18 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0037_unlimited_treenode_pbox_path_size"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="depositfile",
+            name="lease_expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="depositfile",
+            name="lease_owner",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="depositfile",
+            index=models.Index(
+                fields=["state", "id"], name="vault_depositfile_state_id"
+            ),
+        ),
+    ]
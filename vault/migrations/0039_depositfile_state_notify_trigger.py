@@ -0,0 +1,45 @@
+# pylint: disable=invalid-name
+
+from django.db import migrations
+
+
+SQL = """
+CREATE OR REPLACE FUNCTION _do_depositfile_state_notify() RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.state = OLD.state THEN
+        RETURN NULL;
+    END IF;
+
+    -- the payload is only the new state, so that Postgres collapses the
+    -- notifications for a batch of rows changed in the same transaction
+    PERFORM pg_notify('vault_depositfile_state', NEW.state);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER depositfile_state_notify_trg
+    AFTER INSERT OR UPDATE OF state
+    ON vault_depositfile
+    FOR EACH ROW
+    EXECUTE PROCEDURE _do_depositfile_state_notify();
+"""
+
+REVERSE_SQL = """
+DROP TRIGGER IF EXISTS depositfile_state_notify_trg ON vault_depositfile;
+DROP FUNCTION IF EXISTS _do_depositfile_state_notify;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("vault", "0038_depositfile_lease"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=SQL,
+            reverse_sql=REVERSE_SQL,
+        ),
+    ]
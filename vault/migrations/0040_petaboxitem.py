@@ -0,0 +1,60 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0039_depositfile_state_notify_trigger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PetaboxItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("prefix", models.CharField(max_length=255)),
+                ("sequence", models.PositiveIntegerField()),
+                ("file_count", models.PositiveBigIntegerField(default=0)),
+                ("size", models.PositiveBigIntegerField(default=0)),
+                ("allocated_file_count", models.PositiveBigIntegerField(default=0)),
+                ("allocated_size", models.PositiveBigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("reconciled_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="vault.organization",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="depositfile",
+            name="pbox_item",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="vault.petaboxitem",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="petaboxitem",
+            constraint=models.UniqueConstraint(
+                fields=("prefix", "sequence"), name="vault_petaboxitem_prefix_sequence"
+            ),
+        ),
+    ]
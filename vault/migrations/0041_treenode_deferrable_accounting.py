@@ -0,0 +1,63 @@
+# pylint: disable=invalid-name
+
+"""Lets a transaction skip per-row TreeNode ancestor accounting on INSERT and
+UPDATE by setting ``vault.treenode_accounting`` to ``deferred``, so that bulk
+operations can apply the accounting for a whole batch at once. See
+:py:mod:`vault.materialize`.
+"""
+
+from django.db import migrations
+
+
+SQL = """
+DROP TRIGGER IF EXISTS treenode_file_accounting_insert_trg ON vault_treenode;
+DROP TRIGGER IF EXISTS treenode_file_accounting_update_trg ON vault_treenode;
+
+CREATE TRIGGER treenode_file_accounting_insert_trg
+    AFTER INSERT ON vault_treenode
+    FOR EACH ROW
+    WHEN (
+        (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+        AND current_setting('vault.treenode_accounting', true) IS DISTINCT FROM 'deferred'
+    )
+    EXECUTE PROCEDURE _do_treenode_insert_file_accounting();
+
+CREATE TRIGGER treenode_file_accounting_update_trg
+    AFTER UPDATE ON vault_treenode
+    FOR EACH ROW
+    WHEN (
+        (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+        AND current_setting('vault.treenode_accounting', true) IS DISTINCT FROM 'deferred'
+    )
+    EXECUTE PROCEDURE _do_treenode_update_file_accounting();
+"""
+
+REVERSE_SQL = """
+DROP TRIGGER IF EXISTS treenode_file_accounting_insert_trg ON vault_treenode;
+DROP TRIGGER IF EXISTS treenode_file_accounting_update_trg ON vault_treenode;
+
+CREATE TRIGGER treenode_file_accounting_insert_trg
+    AFTER INSERT ON vault_treenode
+    FOR EACH ROW
+    WHEN (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+    EXECUTE PROCEDURE _do_treenode_insert_file_accounting();
+
+CREATE TRIGGER treenode_file_accounting_update_trg
+    AFTER UPDATE ON vault_treenode
+    FOR EACH ROW
+    WHEN (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+    EXECUTE PROCEDURE _do_treenode_update_file_accounting();
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("vault", "0040_petaboxitem"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=SQL,
+            reverse_sql=REVERSE_SQL,
+        ),
+    ]
@@ -0,0 +1,409 @@
+# pylint: disable=invalid-name
+
+"""Adds the TreeNode accounting journal: when the ``vault.treenode_accounting``
+setting is ``journal``, the accounting triggers append the deltas for each
+ancestor to ``vault_treenodeaccountingdelta`` instead of updating the
+ancestors, and :py:func:`vault.accounting.aggregate_journal` folds them in
+batches. Without the setting, the triggers behave as before.
+"""
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQL = """
+-- applies TreeNode accounting deltas to every TreeNode on the path
+-- *ancestors*, or journals them in vault_treenodeaccountingdelta when the
+-- vault.treenode_accounting setting is 'journal' (see vault.accounting)
+CREATE OR REPLACE FUNCTION _add_treenode_accounting(
+    ancestors ltree,
+    file_count_delta bigint,
+    size_delta bigint
+) RETURNS void AS
+$$
+BEGIN
+    IF ancestors IS NULL OR nlevel(ancestors) = 0
+        OR (file_count_delta = 0 AND size_delta = 0) THEN
+        RETURN;
+    END IF;
+
+    IF current_setting('vault.treenode_accounting', true) = 'journal' THEN
+        INSERT INTO vault_treenodeaccountingdelta (tree_node_id, file_count, size)
+        SELECT node_id::bigint, file_count_delta, size_delta
+        FROM unnest(string_to_array(ancestors::text, '.')) AS node_id;
+    ELSE
+        UPDATE vault_treenode
+        SET
+            file_count = file_count + file_count_delta,
+            size = COALESCE(size, 0) + size_delta
+        WHERE
+            path @> ancestors;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- performs TreeNode file accounting on INSERT
+CREATE OR REPLACE FUNCTION _do_treenode_insert_file_accounting() RETURNS TRIGGER AS
+$$
+BEGIN
+    IF NEW.deleted THEN
+        -- case: TreeNode perversely inserted as soft-deleted, in which case
+        -- its ancestors' accounting shouldn't reflect the new node
+        RETURN NULL;
+    END IF;
+
+    PERFORM _add_treenode_accounting(
+        (SELECT path FROM vault_treenode WHERE id = NEW.parent_id),
+        1,
+        COALESCE(NEW.size, 0)
+    );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- performs TreeNode file accounting on hard DELETE
+CREATE OR REPLACE FUNCTION _do_treenode_delete_file_accounting() RETURNS TRIGGER AS
+$$
+DECLARE
+    size_delta bigint;
+BEGIN
+    IF OLD.deleted THEN
+        -- case: TreeNode in question already soft-deleted; skip updating
+        -- ancestors' accounting to prevent double-counting deletion metrics
+        RETURN NULL;
+    END IF;
+
+    IF OLD.node_type != 'FILE' THEN
+        size_delta = 0;
+    ELSE
+        size_delta = COALESCE(OLD.size, 0);
+    END IF;
+
+    PERFORM _add_treenode_accounting(
+        subpath(OLD.path, 0, nlevel(OLD.path) - 1),
+        -1,
+        -1 * size_delta
+    );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- performs TreeNode file accounting on UPDATE
+CREATE OR REPLACE FUNCTION _do_treenode_update_file_accounting() RETURNS TRIGGER AS
+$$
+DECLARE
+    num_changed_attrs int = 0;
+    file_count_delta bigint;
+    size_delta bigint;
+BEGIN
+    IF pg_trigger_depth() > 1 THEN
+        -- prevent trigger recursion
+        RETURN NULL;
+    END IF;
+
+    -- assert that one and only one attribute of consequence to node file
+    -- accounting changes in a given UPDATE
+    IF OLD.deleted != NEW.deleted THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    IF OLD.parent_id != NEW.parent_id THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    IF OLD.size != NEW.size THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    if num_changed_attrs > 1 THEN
+        RAISE EXCEPTION 'At most one managed TreeNode attribute may change in a given UPDATE';
+    END IF;
+
+    IF OLD.deleted != NEW.deleted THEN
+        -- case: soft un/delete
+        IF NEW.deleted THEN
+            size_delta = -1 * COALESCE(NEW.size, 0);
+            file_count_delta = -1;
+        ELSE
+            size_delta = 1 * COALESCE(NEW.size, 0);
+            file_count_delta = 1;
+        END IF;
+
+        -- Only propagate size changes to ancestors for FILE node deletions.
+        -- This is necessary to avoid double-counting sizes which exist not
+        -- only for FILE nodes, but for all non-FILE ancestors.
+        if NEW.node_type != 'FILE' THEN
+            size_delta = 0;
+        END IF;
+
+        PERFORM _add_treenode_accounting(
+            subpath(NEW.path, 0, nlevel(NEW.path) - 1),
+            file_count_delta,
+            size_delta
+        );
+
+    ELSIF OLD.parent_id != NEW.parent_id THEN
+        -- case: move
+
+        -- the moved node's own accounting may still have journaled deltas
+        SELECT
+            OLD.file_count + COALESCE(SUM(delta.file_count), 0),
+            COALESCE(OLD.size, 0) + COALESCE(SUM(delta.size), 0)
+        FROM vault_treenodeaccountingdelta AS delta
+        WHERE delta.tree_node_id = OLD.id
+        INTO file_count_delta, size_delta;
+
+        IF NEW.node_type = 'FOLDER' THEN
+            -- case: +1 for FOLDER nodes because parents' file_count includes
+            -- folders because the behavior of
+            -- _do_treenode_insert_file_accounting() increments ancestors'
+            -- file_count on creation of all children, regardless of node_type
+            file_count_delta = file_count_delta + 1;
+        END IF;
+
+        -- decrement old ancestors
+        PERFORM _add_treenode_accounting(
+            (SELECT path FROM vault_treenode WHERE id = OLD.parent_id),
+            -1 * file_count_delta,
+            -1 * size_delta
+        );
+
+        -- increment new ancestors
+        PERFORM _add_treenode_accounting(
+            (SELECT path FROM vault_treenode WHERE id = NEW.parent_id),
+            file_count_delta,
+            size_delta
+        );
+
+    ELSIF OLD.size != NEW.size THEN
+        -- case: size change
+        IF NEW.node_type != 'FILE' THEN
+            RAISE EXCEPTION 'size of non-FILE nodes may not be explicitly modified';
+        END IF;
+
+        PERFORM _add_treenode_accounting(
+            subpath(NEW.path, 0, nlevel(NEW.path) - 1),
+            0,
+            COALESCE(NEW.size, 0) - COALESCE(OLD.size, 0)
+        );
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+#: The previous definition of these trigger functions, introduced in
+#: ./0033_treenode_file_accounting_triggers.py and
+#: ./0036_correct_treenode_hard_deletion_accounting.py
+REVERSE_SQL = """
+-- performs TreeNode file accounting on INSERT
+CREATE OR REPLACE FUNCTION _do_treenode_insert_file_accounting() RETURNS TRIGGER AS
+$$
+BEGIN
+    IF NEW.deleted THEN
+        -- case: TreeNode perversely inserted as soft-deleted, in which case
+        -- its ancestors' accounting shouldn't reflect the new node
+        RETURN NULL;
+    END IF;
+
+    UPDATE vault_treenode
+    SET
+        file_count = file_count + 1,
+        size = COALESCE(size, 0) + COALESCE(NEW.size, 0)
+    WHERE
+        path @> (
+            SELECT path
+            FROM vault_treenode
+            WHERE id = NEW.parent_id
+        );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- performs TreeNode file accounting on hard DELETE
+CREATE OR REPLACE FUNCTION _do_treenode_delete_file_accounting() RETURNS TRIGGER AS
+$$
+DECLARE
+    size_delta int;
+BEGIN
+    IF OLD.deleted THEN
+        -- case: TreeNode in question already soft-deleted; skip updating
+        -- ancestors' accounting to prevent double-counting deletion metrics
+        RETURN NULL;
+    END IF;
+
+    IF OLD.node_type != 'FILE' THEN
+        size_delta = 0;
+    ELSE
+        size_delta = COALESCE(OLD.size, 0);
+    END IF;
+
+    UPDATE vault_treenode
+    SET
+        file_count = file_count - 1,
+        size = COALESCE(size, 0) - size_delta
+    WHERE
+        path @> OLD.path
+    AND
+        path != OLD.path;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- performs TreeNode file accounting on UPDATE
+CREATE OR REPLACE FUNCTION _do_treenode_update_file_accounting() RETURNS TRIGGER AS
+$$
+DECLARE
+    num_changed_attrs int = 0;
+    file_count_delta int;
+    size_delta int;
+BEGIN
+    IF pg_trigger_depth() > 1 THEN
+        -- prevent trigger recursion
+        RETURN NULL;
+    END IF;
+
+    -- assert that one and only one attribute of consequence to node file
+    -- accounting changes in a given UPDATE
+    IF OLD.deleted != NEW.deleted THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    IF OLD.parent_id != NEW.parent_id THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    IF OLD.size != NEW.size THEN
+        num_changed_attrs = num_changed_attrs + 1;
+    END IF;
+    if num_changed_attrs > 1 THEN
+        RAISE EXCEPTION 'At most one managed TreeNode attribute may change in a given UPDATE';
+    END IF;
+
+    IF OLD.deleted != NEW.deleted THEN
+        -- case: soft un/delete
+        IF NEW.deleted THEN
+            size_delta = -1 * COALESCE(NEW.size, 0);
+            file_count_delta = -1;
+        ELSE
+            size_delta = 1 * COALESCE(NEW.size, 0);
+            file_count_delta = 1;
+        END IF;
+
+        -- Only propagate size changes to ancestors for FILE node deletions.
+        -- This is necessary to avoid double-counting sizes which exist not
+        -- only for FILE nodes, but for all non-FILE ancestors.
+        if NEW.node_type != 'FILE' THEN
+            size_delta = 0;
+        END IF;
+
+        UPDATE vault_treenode
+        SET
+            file_count = file_count + file_count_delta,
+            size = COALESCE(size, 0) + size_delta
+        WHERE
+            path @> NEW.path
+        AND
+            path != NEW.path;
+
+    ELSIF OLD.parent_id != NEW.parent_id THEN
+        -- case: move
+
+        IF NEW.node_type = 'FOLDER' THEN
+            -- case: +1 for FOLDER nodes because parents' file_count includes
+            -- folders because the behavior of
+            -- _do_treenode_insert_file_accounting() increments ancestors'
+            -- file_count on creation of all children, regardless of node_type
+            file_count_delta = OLD.file_count + 1;
+        ELSE
+            file_count_delta = OLD.file_count;
+        END IF;
+
+        -- decrement old ancestors
+        UPDATE vault_treenode AS self
+        SET
+            file_count = self.file_count - file_count_delta,
+            size = COALESCE(self.size, 0) - COALESCE(OLD.size, 0)
+        FROM
+            vault_treenode as old_parent
+        WHERE
+            old_parent.id = OLD.parent_id
+        AND
+            self.path @> old_parent.path
+        AND
+            self.id != OLD.id;
+
+        -- increment new ancestors
+        UPDATE vault_treenode AS self
+        SET
+            file_count = self.file_count + file_count_delta,
+            size = COALESCE(self.size, 0) + COALESCE(NEW.size, 0)
+        FROM
+            vault_treenode as new_parent
+        WHERE
+            new_parent.id = NEW.parent_id
+        AND
+            self.path @> new_parent.path
+        AND
+            self.id != NEW.id;
+
+    ELSIF OLD.size != NEW.size THEN
+        -- case: size change
+        IF NEW.node_type != 'FILE' THEN
+            RAISE EXCEPTION 'size of non-FILE nodes may not be explicitly modified';
+        END IF;
+
+        UPDATE vault_treenode
+        SET
+            size = COALESCE(size, 0) - COALESCE(OLD.size, 0) + COALESCE(NEW.size, 0)
+        WHERE
+            path @> NEW.path
+        AND
+            path != NEW.path;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS _add_treenode_accounting(ltree, bigint, bigint);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0041_treenode_deferrable_accounting"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TreeNodeAccountingDelta",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file_count", models.BigIntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0)),
+                (
+                    "tree_node",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="vault.treenode",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunSQL(
+            sql=SQL,
+            reverse_sql=REVERSE_SQL,
+        ),
+    ]
@@ -0,0 +1,23 @@
+# pylint: disable=invalid-name
+
+"""Adds a btree index on TreeNode.path, which the streamed recursive file
+listing of the fixity API orders and paginates by.
+"""
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("vault", "0042_treenode_accounting_journal"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS vault_treenode_path_btree "
+            "ON vault_treenode USING btree (path);",
+            reverse_sql="DROP INDEX CONCURRENTLY IF EXISTS vault_treenode_path_btree;",
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:16
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0043_treenode_path_btree_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ShafsBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("store", models.CharField(max_length=255)),
+                (
+                    "sha256_sum",
+                    models.CharField(
+                        max_length=64,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "^[a-zA-Z0-9]{64}$",
+                                "only hex-encoded sha256 hashes are allowed",
+                            )
+                        ],
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="vault.organization",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="shafsblob",
+            constraint=models.UniqueConstraint(
+                fields=("store", "organization", "sha256_sum"),
+                name="vault_shafsblob_store_organization_sha256_sum",
+            ),
+        ),
+    ]
@@ -0,0 +1,110 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQL = """
+CREATE OR REPLACE FUNCTION _do_depositfile_state_count() RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.state = OLD.state AND NEW.size = OLD.size
+            AND NEW.deposit_id = OLD.deposit_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE vault_depositfilestatecount
+        SET file_count = file_count - 1, size = size - OLD.size
+        WHERE deposit_id = OLD.deposit_id AND state = OLD.state;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO vault_depositfilestatecount (deposit_id, state, file_count, size)
+        VALUES (NEW.deposit_id, NEW.state, 1, NEW.size)
+        ON CONFLICT (deposit_id, state) DO UPDATE
+        SET file_count = vault_depositfilestatecount.file_count + 1,
+            size = vault_depositfilestatecount.size + EXCLUDED.size;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- no DepositFile may change between the backfill and the trigger taking over
+LOCK TABLE vault_depositfile IN SHARE ROW EXCLUSIVE MODE;
+
+INSERT INTO vault_depositfilestatecount (deposit_id, state, file_count, size)
+SELECT deposit_id, state, count(*), coalesce(sum(size), 0)
+FROM vault_depositfile
+GROUP BY deposit_id, state;
+
+CREATE TRIGGER depositfile_state_count_trg
+    AFTER INSERT OR UPDATE OF state, size, deposit_id OR DELETE
+    ON vault_depositfile
+    FOR EACH ROW
+    EXECUTE PROCEDURE _do_depositfile_state_count();
+"""
+
+REVERSE_SQL = """
+DROP TRIGGER IF EXISTS depositfile_state_count_trg ON vault_depositfile;
+DROP FUNCTION IF EXISTS _do_depositfile_state_count;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0044_shafsblob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DepositFileStateCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("REGISTERED", "Registered"),
+                            ("UPLOADED", "Uploaded"),
+                            ("HASHED", "Hashed"),
+                            ("REPLICATED", "Replicated"),
+                            ("ERROR", "Error"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("file_count", models.BigIntegerField(default=0)),
+                ("size", models.BigIntegerField(default=0)),
+                (
+                    "deposit",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_state_counts",
+                        to="vault.deposit",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="depositfilestatecount",
+            constraint=models.UniqueConstraint(
+                fields=("deposit", "state"),
+                name="vault_depositfilestatecount_deposit_state",
+            ),
+        ),
+        migrations.RunSQL(
+            sql=SQL,
+            reverse_sql=REVERSE_SQL,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0045_depositfilestatecount"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="treenode",
+            name="last_verified_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
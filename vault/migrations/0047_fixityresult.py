@@ -0,0 +1,101 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0046_treenode_last_verified_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingFixityReport",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("report_url", models.TextField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("retry_after", models.DateTimeField(blank=True, null=True)),
+                (
+                    "collection",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="vault.collection",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="FixityResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filename", models.TextField()),
+                ("size", models.PositiveBigIntegerField(blank=True, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("OK", "OK"),
+                            ("MISSING", "Missing"),
+                            ("MISMATCH", "Mismatch"),
+                            ("ERROR", "Error"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("deposited_at", models.DateTimeField(blank=True, null=True)),
+                ("checked_at", models.DateTimeField(blank=True, null=True)),
+                ("canonical_checksums", models.JSONField(default=list)),
+                ("sources", models.JSONField(default=list)),
+                ("missing_locations", models.JSONField(blank=True, null=True)),
+                ("mismatch_groups", models.JSONField(blank=True, null=True)),
+                (
+                    "report",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="file_results",
+                        to="vault.report",
+                    ),
+                ),
+                (
+                    "tree_node",
+                    models.ForeignKey(
+                        blank=True,
+                        db_constraint=False,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="vault.treenode",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="fixityresult",
+            index=models.Index(
+                fields=["report", "status", "id"], name="vault_fixityresult_report_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.9 on 2026-10-18 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("vault", "0047_fixityresult"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="deposit",
+            index=models.Index(
+                fields=["organization", "registered_at", "id"],
+                name="vault_deposit_org_registered",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deposit",
+            index=models.Index(
+                fields=["collection", "registered_at", "id"],
+                name="vault_deposit_coll_registered",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="report",
+            index=models.Index(
+                fields=["collection", "started_at", "id"],
+                name="vault_report_coll_started",
+            ),
+        ),
+    ]
@@ -3,16 +3,29 @@
 import logging
 import re
 import typing
+from collections import defaultdict
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import FieldError
 from django.core.mail import send_mail
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import UniqueConstraint, IntegerChoices, Sum, Count
+from django.db import connection, models, transaction
+from django.db.models import (
+    UniqueConstraint,
+    IntegerChoices,
+    F,
+    Q,
+    Sum,
+    Count,
+    ExpressionWrapper,
+    OuterRef,
+    Subquery,
+)
 from django.db.models.functions import Coalesce
 from django.dispatch import receiver
+from django.utils.dateparse import parse_datetime
 from django.db.models.signals import (
     pre_save,
     post_save,
@@ -92,6 +105,21 @@ class User(AbstractUser):
         return self.username
 
 
+class CollectionQuerySet(models.QuerySet):
+    def with_exact_accounting(self) -> "CollectionQuerySet":
+        """Annotates each Collection with the ``exact_file_count`` and
+        ``exact_size`` of its TreeNode, see
+        :py:meth:`TreeNodeQuerySet.with_exact_accounting`.
+        """
+        nodes = TreeNode.objects.with_exact_accounting().filter(
+            pk=OuterRef("tree_node_id")
+        )
+        return self.annotate(
+            exact_file_count=Coalesce(Subquery(nodes.values("exact_file_count")), 0),
+            exact_size=Coalesce(Subquery(nodes.values("exact_size")), 0),
+        )
+
+
 class Collection(models.Model):
     name = models.CharField(max_length=255)
     organization = models.ForeignKey(
@@ -108,6 +136,8 @@ class Collection(models.Model):
         "TreeNode", blank=True, null=True, on_delete=models.PROTECT
     )
 
+    objects = CollectionQuerySet.as_manager()
+
     def filepath(self):
         collection_name = re.sub(r"[^a-zA-Z0-9_\-\/\.]", "_", self.name)
         return f"{self.organization.filepath()}{collection_name}/"
@@ -168,9 +198,173 @@ class Report(models.Model):
 
     objects = DeferredJSONReportManager()
 
+    class Meta:
+        # for the timeline, see vault.timeline
+        indexes = [
+            models.Index(
+                fields=("collection", "started_at", "id"),
+                name="vault_report_coll_started",
+            ),
+        ]
+
+    #: filters of :py:meth:`files_page`, by name
+    FILE_FILTERS = {
+        "errors": lambda file_json: not file_json.get("success"),
+        "mismatches": lambda file_json: (
+            not file_json.get("success") and bool(file_json.get("mismatchGroups"))
+        ),
+    }
+
     def __str__(self):
         return f"{self.report_type}-{self.collection.pk}-{self.started_at}"
 
+    def files_page(
+        self, file_filter: typing.Optional[str], after: int, limit: int
+    ) -> typing.Tuple[typing.List[dict], typing.Optional[int]]:
+        """Returns the JSON of up to *limit* files of this report after the
+        cursor *after* (``0`` for the first page), only those matching
+        *file_filter* (a key of :py:attr:`FILE_FILTERS`) if given, and the
+        cursor of the next page, or ``None`` if this is the last.
+        """
+        if (self.report_json_version or 1) < 2:
+            # older reports keep their files in report_json, cursors are
+            # indexes into them
+            files = list(enumerate((self.report_json or {}).get("files", []), 1))
+            if file_filter:
+                files = [
+                    (index, file_json)
+                    for index, file_json in files
+                    if self.FILE_FILTERS[file_filter](file_json)
+                ]
+            page = [(index, file_json) for index, file_json in files if index > after]
+            page_files = [file_json for _, file_json in page[:limit]]
+            return page_files, page[limit - 1][0] if len(page) > limit else None
+
+        results = self.file_results.filter(id__gt=after).order_by("id")
+        if file_filter == "errors":
+            results = results.exclude(status=FixityResult.Status.OK)
+        elif file_filter == "mismatches":
+            results = results.filter(status=FixityResult.Status.MISMATCH)
+        page = list(results[: limit + 1])
+        next_after = page[limit - 1].id if len(page) > limit else None
+        return [result.to_json() for result in page[:limit]], next_after
+
+
+class FixityResult(models.Model):
+    """The result of checking one file in a FIXITY Report.
+
+    Reports with ``report_json_version`` 2 keep their files here rather than
+    in ``report_json``, so that they can be paged through and filtered
+    without loading the whole report. :py:meth:`from_json` and
+    :py:meth:`to_json` convert from and to the JSON of a file in a report.
+    """
+
+    class Status(models.TextChoices):
+        OK = "OK", "OK"
+        # missing from some of its locations
+        MISSING = "MISSING", "Missing"
+        # with other checksums at some of its locations
+        MISMATCH = "MISMATCH", "Mismatch"
+        # unsuccessful for another reason
+        ERROR = "ERROR", "Error"
+
+    report = models.ForeignKey(
+        Report, on_delete=models.CASCADE, related_name="file_results", db_index=False
+    )  # index (report, status, id) created separately
+    #: not a constraint, as reports may name TreeNodes since hard deleted
+    tree_node = models.ForeignKey(
+        "TreeNode",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    filename = models.TextField()
+    size = models.PositiveBigIntegerField(blank=True, null=True)
+    status = models.CharField(choices=Status.choices, max_length=20)
+    deposited_at = models.DateTimeField(blank=True, null=True)
+    checked_at = models.DateTimeField(blank=True, null=True)
+    canonical_checksums = models.JSONField(default=list)
+    sources = models.JSONField(default=list)
+    missing_locations = models.JSONField(blank=True, null=True)
+    mismatch_groups = models.JSONField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["report", "status", "id"],
+                name="vault_fixityresult_report_idx",
+            )
+        ]
+
+    @classmethod
+    def from_json(cls, report: Report, file_json: dict) -> "FixityResult":
+        """Returns an unsaved FixityResult of *report* for *file_json*."""
+        if file_json.get("success"):
+            status = cls.Status.OK
+        elif file_json.get("mismatchGroups"):
+            status = cls.Status.MISMATCH
+        elif file_json.get("missingLocations"):
+            status = cls.Status.MISSING
+        else:
+            status = cls.Status.ERROR
+        tree_node_id = None
+        file_id = file_json.get("id") or ""
+        if file_id.startswith("treeNode-") and file_id[9:].isdigit():
+            tree_node_id = int(file_id[9:])
+        return cls(
+            report=report,
+            tree_node_id=tree_node_id,
+            filename=file_json.get("filename", ""),
+            size=file_json.get("size"),
+            status=status,
+            deposited_at=parse_datetime(file_json.get("depositTime") or ""),
+            checked_at=parse_datetime(file_json.get("checkTime") or ""),
+            canonical_checksums=file_json.get("canonicalChecksums", []),
+            sources=file_json.get("sources", []),
+            missing_locations=file_json.get("missingLocations"),
+            mismatch_groups=file_json.get("mismatchGroups"),
+        )
+
+    def to_json(self) -> dict:
+        """Returns the JSON of this file in a report."""
+        file_json = {
+            "filename": self.filename,
+            "id": f"treeNode-{self.tree_node_id}" if self.tree_node_id else None,
+            "depositTime": self.deposited_at,
+            "checkTime": self.checked_at,
+            "size": self.size,
+            "success": self.status == self.Status.OK,
+            "canonicalChecksums": self.canonical_checksums,
+            "sources": self.sources,
+        }
+        if self.missing_locations is not None:
+            file_json["missingLocations"] = self.missing_locations
+        if self.mismatch_groups is not None:
+            file_json["mismatchGroups"] = self.mismatch_groups
+        return file_json
+
+
+class PendingFixityReport(models.Model):
+    """A report posted back by the Fixitter, which is yet to be imported
+    into a Report and its FixityResults by the ``import_fixity_reports``
+    management command.
+    """
+
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    report_url = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    #: the error of the last failed import, if any
+    last_error = models.TextField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    #: failed imports aren't retried before this time
+    retry_after = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.collection_id}-{self.received_at}"
+
 
 md5_validator = RegexValidator(
     r"^[a-zA-Z0-9]{32}$", "only hex-encoded md5 hashes are allowed"
@@ -245,10 +439,39 @@ class Deposit(models.Model):
     hashed_at = models.DateTimeField(blank=True, null=True)
     replicated_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        # for the timeline, see vault.timeline
+        indexes = [
+            models.Index(
+                fields=("organization", "registered_at", "id"),
+                name="vault_deposit_org_registered",
+            ),
+            models.Index(
+                fields=("collection", "registered_at", "id"),
+                name="vault_deposit_coll_registered",
+            ),
+        ]
+
     def __str__(self):
         reg_dt = self.registered_at.strftime("%Y-%m-%d %H:%M:%S")
         return f"Deposit-{self.organization_id}-{self.collection_id}-{reg_dt}"
 
+    def file_state_totals(
+        self,
+    ) -> typing.Tuple[typing.DefaultDict[str, int], typing.DefaultDict[str, int]]:
+        """Returns the number of files and the bytes of this Deposit in each
+        :py:class:`.DepositFile.State`, from its
+        :py:class:`.DepositFileStateCount` rows.
+        """
+        state_count = defaultdict(int)
+        state_sizes = defaultdict(int)
+        for state, file_count, size in self.file_state_counts.values_list(
+            "state", "file_count", "size"
+        ):
+            state_count[state] = file_count
+            state_sizes[state] = size
+        return state_count, state_sizes
+
     def make_deposit_report(self):
         deposit_stats = TreeNode.objects.filter(depositfile__deposit=self).aggregate(
             total_size=Coalesce(Sum("size"), 0), file_count=Coalesce(Count("*"), 0)
@@ -302,6 +525,181 @@ Vault team
         )
 
 
+class PetaboxItem(models.Model):
+    """A Petabox item which DepositFiles are uploaded into.
+
+    Files are allocated to items by :py:meth:`.allocate` using running counts
+    kept in this table, so that no Petabox metadata needs to be fetched per
+    file. The counts are periodically reconciled against Petabox, see
+    :py:func:`vault.petabox.reconcile_items`.
+    """
+
+    #: An item is full once it holds this many files...
+    MAX_FILES = 10000
+    #: ...or this many bytes
+    MAX_BYTES = 100 * 1024 * 1024 * 1024  # 100GiB
+
+    organization = models.ForeignKey(Organization, on_delete=models.PROTECT)
+    name = models.CharField(max_length=255, unique=True)
+    #: Item names are ``f"{prefix}-{sequence:05d}"``
+    prefix = models.CharField(max_length=255)
+    sequence = models.PositiveIntegerField()
+
+    #: Files and bytes successfully uploaded to the item
+    file_count = models.PositiveBigIntegerField(default=0)
+    size = models.PositiveBigIntegerField(default=0)
+    #: Files and bytes allocated to the item, including those not uploaded yet
+    allocated_file_count = models.PositiveBigIntegerField(default=0)
+    allocated_size = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    reconciled_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["prefix", "sequence"], name="vault_petaboxitem_prefix_sequence"
+            )
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def item_name(prefix: str, sequence: int) -> str:
+        return f"{prefix}-{sequence:05d}"
+
+    def has_room_for(self, size: int) -> bool:
+        if self.allocated_file_count == 0:
+            return True  # any file fits in an empty item
+        return (
+            self.allocated_file_count < self.MAX_FILES
+            and self.allocated_size + size <= self.MAX_BYTES
+        )
+
+    @classmethod
+    def allocate(
+        cls,
+        organization_id: int,
+        prefix: str,
+        deposit_files: typing.Iterable["DepositFile"],
+    ) -> typing.List["PetaboxItem"]:
+        """Assigns each of *deposit_files* to an item named after *prefix*,
+        filling items in sequence and creating new ones as they fill up.
+
+        Allocations for the same prefix are serialized with a transaction
+        level advisory lock.
+
+        :return: the items allocated to
+        """
+        allocated = {}
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [prefix])
+            items = list(cls.objects.filter(prefix=prefix).order_by("sequence"))
+            # items before the first with room are full and stay full
+            index = next(
+                (i for i, item in enumerate(items) if item.has_room_for(0)),
+                len(items),
+            )
+            updated_files = []
+            for deposit_file in deposit_files:
+                while index < len(items) and not items[index].has_room_for(
+                    deposit_file.size
+                ):
+                    index += 1
+                if index == len(items):
+                    sequence = items[-1].sequence + 1 if items else 1
+                    items.append(
+                        cls.objects.create(
+                            organization_id=organization_id,
+                            name=cls.item_name(prefix, sequence),
+                            prefix=prefix,
+                            sequence=sequence,
+                        )
+                    )
+                item = items[index]
+                item.allocated_file_count += 1
+                item.allocated_size += deposit_file.size
+                allocated[item.pk] = item
+                deposit_file.pbox_item = item
+                updated_files.append(deposit_file)
+
+            DepositFile.objects.bulk_update(updated_files, ["pbox_item"])
+            for item in allocated.values():
+                cls.objects.filter(pk=item.pk).update(
+                    allocated_file_count=item.allocated_file_count,
+                    allocated_size=item.allocated_size,
+                )
+        return list(allocated.values())
+
+    @classmethod
+    def record_upload(cls, item_id: int, size: int) -> None:
+        """Counts a file of *size* bytes successfully uploaded to an item."""
+        cls.objects.filter(pk=item_id).update(
+            file_count=F("file_count") + 1, size=F("size") + size
+        )
+
+    @classmethod
+    def release(cls, deposit_files: typing.Iterable["DepositFile"]) -> None:
+        """Gives back the room allocated to each of *deposit_files* which
+        won't be uploaded after all, because its content was already
+        replicated or it failed, and clears their ``pbox_item``.
+
+        Allocations are read from the database, since *deposit_files* may
+        have been loaded before they were allocated.
+        """
+        deposit_files = list(deposit_files)
+        with transaction.atomic():
+            allocations = list(
+                DepositFile.objects.select_for_update()
+                .filter(pk__in=[f.pk for f in deposit_files], pbox_item__isnull=False)
+                .values_list("pk", "pbox_item_id", "size")
+            )
+            released = defaultdict(lambda: [0, 0])
+            for _, item_id, size in allocations:
+                released[item_id][0] += 1
+                released[item_id][1] += size
+            DepositFile.objects.filter(pk__in=[pk for pk, _, _ in allocations]).update(
+                pbox_item=None
+            )
+            for item_id, (file_count, size) in released.items():
+                cls.objects.filter(pk=item_id).update(
+                    allocated_file_count=F("allocated_file_count") - file_count,
+                    allocated_size=F("allocated_size") - size,
+                )
+        for deposit_file in deposit_files:
+            deposit_file.pbox_item = None
+
+
+class ShafsBlob(models.Model):
+    """A blob present in the shafs store (``SHADIR_ROOT``) of a host, keyed
+    by the name of the store, ``SHAFS_STORE_NAME``.
+
+    Kept up to date by :py:mod:`vault.shafs` as blobs are moved into the
+    store, so that the locations of many files can be
+    resolved with one query instead of a ``stat`` each. The
+    ``rebuild_shafs_index`` management command rebuilds the index of a host
+    from a scan of its store.
+    """
+
+    store = models.CharField(max_length=255)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    sha256_sum = models.CharField(max_length=64, validators=[sha256_validator])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["store", "organization", "sha256_sum"],
+                name="vault_shafsblob_store_organization_sha256_sum",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.store}:{self.organization_id}/{self.sha256_sum}"
+
+
 class DepositFile(models.Model):
     class State(models.TextChoices):
         REGISTERED = "REGISTERED", "Registered"
@@ -335,14 +733,157 @@ class DepositFile(models.Model):
     tree_node = models.ForeignKey(
         "TreeNode", blank=True, null=True, on_delete=models.PROTECT
     )
+    #: Petabox item this file is to be uploaded into
+    pbox_item = models.ForeignKey(
+        PetaboxItem, blank=True, null=True, on_delete=models.PROTECT
+    )
 
     registered_at = models.DateTimeField(auto_now_add=True)
     uploaded_at = models.DateTimeField(blank=True, null=True)
     hashed_at = models.DateTimeField(blank=True, null=True)
     replicated_at = models.DateTimeField(blank=True, null=True)
 
+    #: Identifier of the pipeline worker which currently holds a lease on
+    #: this DepositFile. See :py:meth:`.DepositFile.claim_next`.
+    lease_owner = models.CharField(max_length=255, blank=True, null=True)
+    #: Instant after which the lease held by *lease_owner* is considered
+    #: abandoned and the DepositFile may be claimed by another worker.
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=("state", "id"), name="vault_depositfile_state_id"),
+        ]
 
-class DeletionAwareTreeNodeManager(models.Manager):
+    @classmethod
+    def claim_next(
+        cls,
+        state: "DepositFile.State",
+        worker_id: str,
+        lease_seconds: int,
+        exclude_ids: typing.Iterable[int] = (),
+    ) -> typing.Optional["DepositFile"]:
+        """Leases the oldest unleased :py:class:`.DepositFile` in *state* to
+        the worker identified by *worker_id*.
+
+        Candidate rows are selected with ``SELECT ... FOR UPDATE SKIP
+        LOCKED`` so that concurrent workers, on this host or any other, never
+        claim the same row. Rows whose lease has expired (e.g. because the
+        holding worker crashed) are claimable again.
+
+        :param state: the state of DepositFiles eligible to be claimed
+        :param worker_id: identifier of the claiming worker
+        :param lease_seconds: duration of the lease; the worker must call
+            :py:meth:`.renew_lease` before it elapses
+        :param exclude_ids: ids of DepositFiles which should not be claimed
+
+        :return: the claimed DepositFile, or ``None`` when none is available
+        """
+        now = utils.utcnow()
+        with transaction.atomic():
+            deposit_file = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(state=state)
+                .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now))
+                .exclude(pk__in=exclude_ids)
+                .order_by("id")
+                .first()
+            )
+            if deposit_file is None:
+                return None
+            deposit_file.lease_owner = worker_id
+            deposit_file.lease_expires_at = now + timedelta(seconds=lease_seconds)
+            deposit_file.save(update_fields=["lease_owner", "lease_expires_at"])
+        return deposit_file
+
+    def renew_lease(self, worker_id: str, lease_seconds: int) -> bool:
+        """Extends the lease held by *worker_id* on this DepositFile by
+        *lease_seconds* from now.
+
+        :return: ``False`` when *worker_id* no longer holds the lease
+        """
+        lease_expires_at = utils.utcnow() + timedelta(seconds=lease_seconds)
+        renewed = DepositFile.objects.filter(pk=self.pk, lease_owner=worker_id).update(
+            lease_expires_at=lease_expires_at
+        )
+        if renewed:
+            self.lease_expires_at = lease_expires_at
+        return bool(renewed)
+
+    def save_if_leased(
+        self, worker_id: str, update_fields: typing.Iterable[str]
+    ) -> bool:
+        """Saves the *update_fields* of this DepositFile only if *worker_id*
+        still holds its lease, so that a worker whose lease expired can't
+        overwrite the work of the worker which claimed it since.
+
+        :return: ``False`` when *worker_id* no longer holds the lease, and
+            nothing was saved
+        """
+        saved = DepositFile.objects.filter(pk=self.pk, lease_owner=worker_id).update(
+            **{name: getattr(self, name) for name in update_fields}
+        )
+        return bool(saved)
+
+    def release_lease(self, worker_id: str) -> None:
+        """Releases the lease held by *worker_id* on this DepositFile, if any."""
+        DepositFile.objects.filter(pk=self.pk, lease_owner=worker_id).update(
+            lease_owner=None, lease_expires_at=None
+        )
+        self.lease_owner = None
+        self.lease_expires_at = None
+
+
+class DepositFileStateCount(models.Model):
+    """The number and total size of the DepositFiles of a Deposit in a
+    state.
+
+    Maintained by a trigger on DepositFile as files are added, change state
+    and are removed, so that the progress of a Deposit is read from a row per
+    state instead of a scan of its files. See
+    :py:meth:`.Deposit.file_state_totals`.
+    """
+
+    deposit = models.ForeignKey(
+        Deposit, on_delete=models.CASCADE, related_name="file_state_counts"
+    )
+    state = models.CharField(choices=DepositFile.State.choices, max_length=50)
+    file_count = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["deposit", "state"],
+                name="vault_depositfilestatecount_deposit_state",
+            )
+        ]
+
+
+class TreeNodeQuerySet(models.QuerySet):
+    def with_exact_accounting(self) -> "TreeNodeQuerySet":
+        """Annotates each TreeNode with ``exact_file_count`` and ``exact_size``:
+        its ``file_count`` and ``size`` plus the deltas journaled for it which
+        haven't been aggregated yet. See :py:mod:`vault.accounting`.
+        """
+        pending = (
+            TreeNodeAccountingDelta.objects.filter(tree_node_id=OuterRef("pk"))
+            .values("tree_node_id")
+            .annotate(file_count=Sum("file_count"), size=Sum("size"))
+        )
+        return self.annotate(
+            exact_file_count=ExpressionWrapper(
+                F("file_count") + Coalesce(Subquery(pending.values("file_count")), 0),
+                output_field=models.BigIntegerField(),
+            ),
+            exact_size=ExpressionWrapper(
+                Coalesce(F("size"), 0) + Coalesce(Subquery(pending.values("size")), 0),
+                output_field=models.BigIntegerField(),
+            ),
+        )
+
+
+class DeletionAwareTreeNodeManager(models.Manager.from_queryset(TreeNodeQuerySet)):
     """TreeNode model manager which hides soft-deleted rows."""
 
     def get_queryset(self):
@@ -412,6 +953,9 @@ class TreeNode(models.Model):
         auto_now=True, blank=True, null=True
     )  # if the file was modified on the server.
     deleted_at = models.DateTimeField(blank=True, null=True)
+    #: For FILE: when its content was last checked by a local fixity check,
+    #: see :py:mod:`vault.fixity`
+    last_verified_at = models.DateTimeField(blank=True, null=True)
 
     uploaded_by = models.ForeignKey(
         User, on_delete=models.PROTECT, blank=True, null=True
@@ -541,6 +1085,22 @@ class TreeNode(models.Model):
         )
 
 
+class TreeNodeAccountingDelta(models.Model):
+    """A change to the ``file_count`` and ``size`` of a TreeNode which hasn't
+    been applied yet. Rows are appended by the TreeNode accounting triggers
+    when accounting is journaled, and folded into the TreeNode and deleted by
+    :py:func:`vault.accounting.aggregate_journal`.
+    """
+
+    # no constraint, so that journaling takes no locks on the TreeNode and
+    # deltas for deleted nodes are simply dropped by aggregation
+    tree_node = models.ForeignKey(
+        TreeNode, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
+    file_count = models.BigIntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+
+
 ###############################################################################
 # Signal Handlers
 ###############################################################################
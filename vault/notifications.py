@@ -0,0 +1,115 @@
+"""Wakes pipeline workers when DepositFiles change state.
+
+A trigger on ``vault_depositfile`` (see migration 0039) sends a Postgres
+``NOTIFY`` on :py:data:`DEPOSIT_FILE_STATE_CHANNEL`, with the new state as the
+payload, whenever a DepositFile is inserted or changes state. Workers wait on
+a :py:class:`StateListener` instead of sleeping between polls.
+"""
+
+import logging
+import select
+import threading
+import time
+import typing
+
+import psycopg2
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+DEPOSIT_FILE_STATE_CHANNEL = "vault_depositfile_state"
+
+#: how often a waiting listener checks whether it should stop waiting
+_SHUTDOWN_CHECK_SECONDS = 1
+
+
+def notify_state(state: str) -> None:
+    """Wakes the workers listening for DepositFiles in *state*, e.g. after
+    changing DepositFiles in ways other than their state.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [DEPOSIT_FILE_STATE_CHANNEL, state])
+
+
+class StateListener:
+    """Listens for DepositFiles entering any of *states*.
+
+    The listener uses its own connection, since notifications are only
+    delivered to a session outside of a transaction. If the connection can't
+    be established or is lost, :py:meth:`wait` degrades to sleeping and the
+    connection is retried on the next call.
+    """
+
+    def __init__(
+        self,
+        states: typing.Iterable[str],
+        shutdown: typing.Optional[threading.Event] = None,
+        using: str = "default",
+    ):
+        self.states = set(states)
+        self.shutdown = shutdown or threading.Event()
+        self.using = using
+        self._conn = None
+
+    def __enter__(self) -> "StateListener":
+        # start listening right away, so that notifications sent before the
+        # first call to wait() aren't missed
+        self._ensure_connection()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _ensure_connection(self) -> bool:
+        if self._conn is None:
+            try:
+                params = connections[self.using].get_connection_params()
+                conn = psycopg2.connect(**params)
+                conn.set_session(autocommit=True)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {DEPOSIT_FILE_STATE_CHANNEL};")
+            except psycopg2.Error as e:
+                logger.warning("Can't listen for DepositFile state changes: %s", e)
+                return False
+            self._conn = conn
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        """Blocks until a DepositFile enters one of the listened states, the
+        shutdown event is set or *timeout* seconds pass.
+
+        Returns ``True`` if woken by a notification.
+        """
+        if not self._ensure_connection():
+            self.shutdown.wait(timeout)
+            return False
+
+        deadline = time.monotonic() + timeout
+        while not self.shutdown.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            interval = min(remaining, _SHUTDOWN_CHECK_SECONDS)
+            try:
+                if select.select([self._conn], [], [], interval)[0]:
+                    self._conn.poll()
+                    notified = any(
+                        n.payload in self.states for n in self._conn.notifies
+                    )
+                    self._conn.notifies.clear()
+                    if notified:
+                        return True
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Lost DepositFile state listener connection: %s", e)
+                self.close()
+                self.shutdown.wait(remaining)
+                return False
+        return False
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
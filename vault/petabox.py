@@ -0,0 +1,418 @@
+"""Allocation of deposited files to Petabox items, and concurrent uploads
+of them.
+
+:py:class:`PetaboxUploader` runs uploads in a bounded thread pool sharing one
+``internetarchive`` session (and so one HTTP connection pool). Concurrency is
+bounded per item, by holding back the uploads to an item until one of its
+uploads in flight finishes, and overall by an :py:class:`AIMDLimiter` which
+backs off when Petabox answers 503 Slow Down and creeps back up while uploads
+succeed.
+
+Files are allocated to items with :py:func:`allocate_deposit`, which packs
+all the files of a deposit using the counts recorded in
+:py:class:`vault.models.PetaboxItem` rather than fetching item metadata.
+"""
+
+import logging
+import os
+import threading
+import time
+import typing
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.utils import dateformat
+from internetarchive import get_session
+from requests.exceptions import HTTPError
+
+from vault import utils
+from vault.models import Deposit, DepositFile, PetaboxItem
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = 4
+PER_ITEM_UPLOADS = 2
+MAX_SLOWDOWN_RETRIES = 5
+SLOWDOWN_BACKOFF_SECONDS = 5
+MAX_SLOWDOWN_BACKOFF_SECONDS = 120
+#: How often the counts of items which still have room are reconciled
+#: against Petabox
+RECONCILE_INTERVAL = timedelta(hours=6)
+
+
+class AIMDLimiter:
+    """Limits the number of concurrent uploads with additive increase,
+    multiplicative decrease.
+
+    Each successful upload raises the limit by ``1 / limit``, i.e. by about
+    one per round of uploads, up to *max_limit*. Each slow down halves the
+    limit and pauses new uploads for a backoff which doubles with every
+    consecutive slow down.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        backoff_seconds: float = SLOWDOWN_BACKOFF_SECONDS,
+        max_backoff_seconds: float = MAX_SLOWDOWN_BACKOFF_SECONDS,
+    ):
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.base_backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._backoff_seconds = backoff_seconds
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, shutdown: threading.Event) -> bool:
+        """Blocks until an upload may start. Returns ``False`` if *shutdown*
+        was set while waiting.
+        """
+        with self._cond:
+            while not shutdown.is_set():
+                delay = self._resume_at - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(min(delay, 1))
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return True
+                else:
+                    self._cond.wait(1)
+            return False
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def on_success(self) -> None:
+        with self._cond:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._backoff_seconds = self.base_backoff_seconds
+            self._cond.notify()
+
+    def on_slowdown(self) -> float:
+        """Records a slow down; returns the seconds uploads are paused for."""
+        with self._cond:
+            self.limit = max(1.0, self.limit / 2)
+            backoff = self._backoff_seconds
+            self._resume_at = max(self._resume_at, time.monotonic() + backoff)
+            self._backoff_seconds = min(
+                self._backoff_seconds * 2, self.max_backoff_seconds
+            )
+            return backoff
+
+
+@dataclass
+class UploadResult:
+    status_code: int
+    item_file_path: typing.Optional[str]
+
+
+class UploadStats:
+    """Thread-safe upload counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.failures = 0
+        self.slowdowns = 0
+        self.retries = 0
+
+    def add(self, **counts) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def throughput(self) -> typing.Tuple[float, float]:
+        """Returns (bytes per second, files per second) since creation."""
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return self.bytes / elapsed, self.files / elapsed
+
+    def summary(self) -> str:
+        bytes_per_second, files_per_second = self.throughput()
+        return (
+            f"{self.files} files, {self.bytes} bytes uploaded "
+            f"({bytes_per_second / 1024 / 1024:.2f} MiB/s, "
+            f"{files_per_second:.2f} files/s), {self.failures} failures, "
+            f"{self.slowdowns} slow downs, {self.retries} retries"
+        )
+
+
+class PetaboxUploader:
+    """Uploads files to Petabox items with up to *workers* uploads in
+    flight, at most *per_item* of them to the same item.
+
+    Use as a context manager; :py:meth:`submit` returns a
+    :py:class:`~concurrent.futures.Future` of an :py:class:`UploadResult`.
+    Uploads to an item which already has *per_item* uploads scheduled are
+    held back rather than handed to the thread pool, so that no worker thread
+    waits on an item while uploads to other items could run.
+    """
+
+    def __init__(
+        self,
+        workers: int = UPLOAD_WORKERS,
+        per_item: int = PER_ITEM_UPLOADS,
+        shutdown: typing.Optional[threading.Event] = None,
+        max_retries: int = MAX_SLOWDOWN_RETRIES,
+    ):
+        self.workers = workers
+        self.per_item = per_item
+        self.shutdown = shutdown or threading.Event()
+        self.max_retries = max_retries
+        self.limiter = AIMDLimiter(workers)
+        self.stats = UploadStats()
+        self.session = get_session(
+            config_file=settings.IA_CONFIG_PATH,
+            http_adapter_kwargs={"pool_connections": workers, "pool_maxsize": workers},
+        )
+        # uploads scheduled in the thread pool, and held back, by item
+        self._item_scheduled = defaultdict(int)
+        self._item_held_back = defaultdict(deque)
+        self._scheduled = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="pbox-upload"
+        )
+
+    def __enter__(self) -> "PetaboxUploader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            held_back = [
+                future
+                for uploads in self._item_held_back.values()
+                for future, _ in uploads
+            ]
+            self._item_held_back.clear()
+        for future in held_back:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+
+    @property
+    def scheduled(self) -> int:
+        """The number of uploads running or waiting for a worker thread, not
+        counting those held back.
+        """
+        return self._scheduled
+
+    def submit(
+        self,
+        item_name: str,
+        pbox_file_path: str,
+        file_path: str,
+        size: int,
+        md5_sum: typing.Optional[str],
+        metadata: typing.Dict[str, str],
+    ) -> "Future[UploadResult]":
+        future = Future()
+        args = (item_name, pbox_file_path, file_path, size, md5_sum, metadata)
+        with self._lock:
+            if self._item_scheduled[item_name] < self.per_item:
+                self._item_scheduled[item_name] += 1
+                self._schedule(future, args)
+            else:
+                self._item_held_back[item_name].append((future, args))
+        return future
+
+    def _schedule(self, future, args) -> None:
+        """Hands the upload of *args* to the thread pool. Called with the
+        lock held.
+        """
+        self._scheduled += 1
+        self._executor.submit(self._run, future, args)
+
+    def _run(self, future, args) -> None:
+        item_name = args[0]
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._upload(*args))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._scheduled -= 1
+                held_back = self._item_held_back.get(item_name)
+                if held_back:
+                    # the item's slot passes on to its next upload
+                    self._schedule(*held_back.popleft())
+                else:
+                    self._item_held_back.pop(item_name, None)
+                    self._item_scheduled[item_name] -= 1
+                    if not self._item_scheduled[item_name]:
+                        del self._item_scheduled[item_name]
+
+    def _upload(
+        self, item_name, pbox_file_path, file_path, size, md5_sum, metadata
+    ) -> UploadResult:
+        item_file_path = os.path.join(item_name, pbox_file_path)
+        headers = {"x-archive-check-file": "0"}
+        if md5_sum:
+            # Petabox verifies the body against Content-MD5, which saves the
+            # library from reading the whole file to compute it (verify=True).
+            # Like the library, it is sent as hex digits
+            headers["Content-MD5"] = md5_sum
+
+        for attempt in range(self.max_retries + 1):
+            if not self.limiter.acquire(self.shutdown):
+                return UploadResult(0, item_file_path)
+            try:
+                status_code = self._put(
+                    item_name, pbox_file_path, file_path, metadata, headers
+                )
+            finally:
+                self.limiter.release()
+
+            if status_code == 200:
+                self.limiter.on_success()
+                self.stats.add(files=1, bytes=size)
+                return UploadResult(status_code, item_file_path)
+            if status_code != 503:
+                self.stats.add(failures=1)
+                return UploadResult(status_code, item_file_path)
+
+            backoff = self.limiter.on_slowdown()
+            self.stats.add(slowdowns=1)
+            logger.warning(
+                "Petabox returning 503 Slow Down for %s. "
+                "Concurrency limit %d, pausing uploads for %ss",
+                item_file_path,
+                int(self.limiter.limit),
+                backoff,
+            )
+            if attempt < self.max_retries:
+                self.stats.add(retries=1)
+
+        self.stats.add(failures=1)
+        return UploadResult(503, item_file_path)
+
+    def _put(self, item_name, pbox_file_path, file_path, metadata, headers) -> int:
+        item = self.session.get_item(item_name)
+        try:
+            with open(file_path, mode="rb") as deposit_file_handle:
+                responses = item.upload(
+                    {pbox_file_path: deposit_file_handle},
+                    queue_derive=False,
+                    verify="Content-MD5" not in headers,
+                    metadata=metadata,
+                    headers=headers,
+                )
+        except HTTPError as e:
+            logger.error("Error uploading to petabox: %s", e)
+            return e.response.status_code if e.response is not None else 0
+        except Exception as e:
+            logger.error("Error uploading to petabox: %s", e)
+            return 0
+        if responses and len(responses) == 1:
+            return responses[0].status_code
+        return 0
+
+
+def item_prefix(deposit: Deposit) -> str:
+    """Returns the prefix of the names of the items *deposit* is uploaded
+    into, e.g. ``DPS-VAULT-QA-1-20220401``.
+    """
+    datestamp = dateformat.format(deposit.registered_at, "Ymd")
+    environment = (
+        "-" + settings.DEPLOYMENT_ENVIRONMENT
+        if settings.DEPLOYMENT_ENVIRONMENT != "PROD"
+        else ""
+    )
+    return f"DPS-VAULT{environment}-{deposit.organization_id}-{datestamp}"
+
+
+def allocate_deposit(deposit: Deposit, ia_session) -> None:
+    """Allocates every file of *deposit* which isn't allocated or replicated
+    yet to a Petabox item, so that the whole deposit is packed up front.
+    """
+    prefix = item_prefix(deposit)
+    if not PetaboxItem.objects.filter(prefix=prefix).exists():
+        seed_items(deposit.organization_id, prefix, ia_session)
+    deposit_files = (
+        DepositFile.objects.filter(deposit=deposit, pbox_item__isnull=True)
+        .exclude(state__in=(DepositFile.State.REPLICATED, DepositFile.State.ERROR))
+        .order_by("id")
+    )
+    items = PetaboxItem.allocate(deposit.organization_id, prefix, deposit_files)
+    logger.info(
+        "Allocated Deposit %s to items: %s", deposit.id, ", ".join(map(str, items))
+    )
+
+
+def seed_items(organization_id: int, prefix: str, ia_session) -> None:
+    """Records the items named after *prefix* which already exist in Petabox,
+    which were allocated before items were tracked locally.
+    """
+    sequence = 1
+    while True:
+        name = PetaboxItem.item_name(prefix, sequence)
+        item = ia_session.get_item(name)
+        if not item.exists:
+            return
+        file_count, size = item.files_count or 0, item.item_size or 0
+        PetaboxItem.objects.get_or_create(
+            name=name,
+            defaults=dict(
+                organization_id=organization_id,
+                prefix=prefix,
+                sequence=sequence,
+                file_count=file_count,
+                size=size,
+                allocated_file_count=file_count,
+                allocated_size=size,
+                reconciled_at=utils.utcnow(),
+            ),
+        )
+        sequence += 1
+
+
+def reconcile_items(ia_session, interval: timedelta = RECONCILE_INTERVAL) -> None:
+    """Updates the counts of items which still have room and weren't
+    reconciled in the last *interval* from their Petabox metadata.
+
+    Allocated counts are only ever raised, since files allocated to an item
+    may not have been uploaded yet.
+    """
+    now = utils.utcnow()
+    items = PetaboxItem.objects.filter(
+        Q(reconciled_at__isnull=True) | Q(reconciled_at__lt=now - interval),
+        allocated_file_count__lt=PetaboxItem.MAX_FILES,
+        allocated_size__lt=PetaboxItem.MAX_BYTES,
+    )
+    for item in items:
+        ia_item = ia_session.get_item(item.name)
+        if not ia_item.exists:
+            PetaboxItem.objects.filter(pk=item.pk).update(reconciled_at=now)
+            continue
+        file_count, size = ia_item.files_count or 0, ia_item.item_size or 0
+        if (file_count, size) != (item.file_count, item.size):
+            logger.info(
+                "Reconciled item %s: %s files, %s bytes recorded; "
+                "%s files, %s bytes in Petabox",
+                item.name,
+                item.file_count,
+                item.size,
+                file_count,
+                size,
+            )
+        PetaboxItem.objects.filter(pk=item.pk).update(
+            file_count=file_count,
+            size=size,
+            allocated_file_count=Greatest("allocated_file_count", file_count),
+            allocated_size=Greatest("allocated_size", size),
+            reconciled_at=now,
+        )
@@ -0,0 +1,245 @@
+"""The shafs store: the blobs of deposited files, named after their sha256
+digest, on the local disk of each host under ``SHADIR_ROOT/<org id>``.
+
+Blobs are fanned out under ``SHADIR_FANOUT_LEVELS`` levels of directories
+named after successive pairs of hex digits of the digest, e.g.
+``<org id>/ab/cd/abcd...`` for two levels, so that no directory grows to
+millions of entries. :py:func:`blob_path` is where a blob is stored and
+:py:func:`locate_blob` where it can be found: blobs stored with another number
+of levels are found too, until :py:func:`reshard` moves them.
+
+Which blobs a host has is indexed in :py:class:`vault.models.ShafsBlob`,
+under the name of its store, ``SHAFS_STORE_NAME``, so that callers can
+resolve the presence of many blobs with one query, see
+:py:func:`present_sha256_sums`. Blobs added to the store are recorded with
+:py:func:`record_blob`; :py:func:`rebuild_index` brings the index back in line
+with the disk, e.g. after blobs were removed by hand.
+"""
+
+import logging
+import os
+import re
+import shutil
+import typing
+
+from django.conf import settings
+
+from vault.file_management import hash_to_idx_list
+from vault.models import ShafsBlob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+#: locate_blob looks for blobs stored with up to this many levels
+MAX_FANOUT_LEVELS = 3
+
+_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+_SHARD_RE = re.compile(r"[0-9a-f]{2}")
+
+
+def shafs_folder(org_id: int) -> str:
+    return os.path.join(settings.SHADIR_ROOT, str(org_id))
+
+
+def org_ids_on_disk() -> typing.Set[int]:
+    """Returns the ids of the organizations with a folder in this host's
+    store.
+    """
+    try:
+        return {
+            int(name) for name in os.listdir(settings.SHADIR_ROOT) if name.isdigit()
+        }
+    except FileNotFoundError:
+        return set()
+
+
+def blob_path(
+    org_id: int, sha256_sum: str, fanout_levels: typing.Optional[int] = None
+) -> str:
+    """Returns the path at which the blob *sha256_sum* of *org_id* is stored,
+    with *fanout_levels* or by default ``SHADIR_FANOUT_LEVELS`` levels.
+    """
+    if fanout_levels is None:
+        fanout_levels = settings.SHADIR_FANOUT_LEVELS
+    shards = hash_to_idx_list(sha256_sum)[:fanout_levels]
+    return os.path.join(shafs_folder(org_id), *shards, sha256_sum)
+
+
+def locate_blob(org_id: int, sha256_sum: str) -> typing.Optional[str]:
+    """Returns the path of the blob *sha256_sum* of *org_id* in this host's
+    store, or ``None`` if it isn't there.
+    """
+    if not sha256_sum or not _SHA256_RE.fullmatch(sha256_sum):
+        return None
+    configured = settings.SHADIR_FANOUT_LEVELS
+    others = [levels for levels in range(MAX_FANOUT_LEVELS + 1) if levels != configured]
+    # look in the configured layout again last, in case the blob was moved
+    # into it by reshard() while we were looking elsewhere
+    for levels in [configured, *others, configured]:
+        path = blob_path(org_id, sha256_sum, levels)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def iter_blobs(org_id: int) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Yields ``(sha256_sum, path)`` for every blob in this host's store for
+    *org_id*, whatever its layout.
+    """
+    folders = [shafs_folder(org_id)]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if _SHARD_RE.fullmatch(entry.name):
+                            folders.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and _SHA256_RE.fullmatch(
+                        entry.name
+                    ):
+                        yield entry.name, entry.path
+        except FileNotFoundError:
+            continue
+
+
+def add_blob(org_id: int, sha256_sum: str, src_path: str) -> str:
+    """Moves the file at *src_path*, whose digest is *sha256_sum*, into the
+    store of *org_id* and records it. If the store already has the blob, the
+    file is deleted instead. Returns the path of the blob.
+    """
+    path = locate_blob(org_id, sha256_sum)
+    if path is not None:
+        # identical content is already in the store
+        os.remove(src_path)
+    else:
+        path = blob_path(org_id, sha256_sum)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(src_path, path)
+    record_blob(org_id, sha256_sum)
+    return path
+
+
+def record_blob(org_id: int, sha256_sum: str) -> None:
+    """Records that the blob *sha256_sum* was added to the store of *org_id*."""
+    ShafsBlob.objects.bulk_create(
+        [
+            ShafsBlob(
+                store=settings.SHAFS_STORE_NAME,
+                organization_id=org_id,
+                sha256_sum=sha256_sum,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def present_sha256_sums(
+    org_id: int, sha256_sums: typing.Iterable[typing.Optional[str]]
+) -> typing.Set[str]:
+    """Returns those of *sha256_sums* which are in this host's store for
+    *org_id*.
+
+    If the store has no index of *org_id* at all, e.g. because it wasn't
+    built yet, each blob is looked for on disk with :py:func:`locate_blob`.
+    """
+    sha256_sums = {sha256_sum for sha256_sum in sha256_sums if sha256_sum}
+    if not sha256_sums:
+        return set()
+    org_blobs = ShafsBlob.objects.filter(
+        store=settings.SHAFS_STORE_NAME, organization_id=org_id
+    )
+    present = set(
+        org_blobs.filter(sha256_sum__in=sha256_sums).values_list(
+            "sha256_sum", flat=True
+        )
+    )
+    if present or org_blobs.exists():
+        return present
+    return {
+        sha256_sum
+        for sha256_sum in sha256_sums
+        if locate_blob(org_id, sha256_sum) is not None
+    }
+
+
+def rebuild_index(org_id: int) -> typing.Tuple[int, int]:
+    """Makes this host's index for *org_id* match a scan of its store.
+
+    Safe to run while blobs are added: the index is read before the scan, so
+    blobs recorded during the scan are never dropped.
+
+    :return: the number of entries added and removed
+    """
+    indexed = set(
+        ShafsBlob.objects.filter(
+            store=settings.SHAFS_STORE_NAME, organization_id=org_id
+        ).values_list("sha256_sum", flat=True)
+    )
+    found = {sha256_sum for sha256_sum, _ in iter_blobs(org_id)}
+
+    added = sorted(found - indexed)
+    for start in range(0, len(added), BATCH_SIZE):
+        ShafsBlob.objects.bulk_create(
+            [
+                ShafsBlob(
+                    store=settings.SHAFS_STORE_NAME,
+                    organization_id=org_id,
+                    sha256_sum=sha256_sum,
+                )
+                for sha256_sum in added[start : start + BATCH_SIZE]
+            ],
+            ignore_conflicts=True,
+        )
+    removed = sorted(indexed - found)
+    for start in range(0, len(removed), BATCH_SIZE):
+        ShafsBlob.objects.filter(
+            store=settings.SHAFS_STORE_NAME,
+            organization_id=org_id,
+            sha256_sum__in=removed[start : start + BATCH_SIZE],
+        ).delete()
+
+    logger.info(
+        "Rebuilt shafs index of organization %s in store %s: "
+        "%s blobs, %s added, %s removed",
+        org_id,
+        settings.SHAFS_STORE_NAME,
+        len(found),
+        len(added),
+        len(removed),
+    )
+    return len(added), len(removed)
+
+
+def reshard(org_id: int) -> int:
+    """Moves every blob of *org_id* which isn't stored at its
+    :py:func:`blob_path` there, and removes the directories left empty.
+
+    Safe to run while the store is in use: each blob is moved with an atomic
+    rename, and :py:func:`locate_blob` finds blobs in either layout.
+
+    :return: the number of blobs moved
+    """
+    root = shafs_folder(org_id)
+    moved = 0
+    for sha256_sum, path in iter_blobs(org_id):
+        target = blob_path(org_id, sha256_sum)
+        if path == target:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(path, target)
+        moved += 1
+        folder = os.path.dirname(path)
+        while folder != root:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break  # not empty
+            folder = os.path.dirname(folder)
+    logger.info(
+        "Resharded %s blobs of organization %s in store %s",
+        moved,
+        org_id,
+        settings.SHAFS_STORE_NAME,
+    )
+    return moved
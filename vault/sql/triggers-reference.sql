@@ -42,6 +42,36 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- applies TreeNode accounting deltas to every TreeNode on the path
+-- *ancestors*, or journals them in vault_treenodeaccountingdelta when the
+-- vault.treenode_accounting setting is 'journal' (see vault.accounting)
+CREATE OR REPLACE FUNCTION _add_treenode_accounting(
+    ancestors ltree,
+    file_count_delta bigint,
+    size_delta bigint
+) RETURNS void AS
+$$
+BEGIN
+    IF ancestors IS NULL OR nlevel(ancestors) = 0
+        OR (file_count_delta = 0 AND size_delta = 0) THEN
+        RETURN;
+    END IF;
+
+    IF current_setting('vault.treenode_accounting', true) = 'journal' THEN
+        INSERT INTO vault_treenodeaccountingdelta (tree_node_id, file_count, size)
+        SELECT node_id::bigint, file_count_delta, size_delta
+        FROM unnest(string_to_array(ancestors::text, '.')) AS node_id;
+    ELSE
+        UPDATE vault_treenode
+        SET
+            file_count = file_count + file_count_delta,
+            size = COALESCE(size, 0) + size_delta
+        WHERE
+            path @> ancestors;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
 -- performs TreeNode file accounting on INSERT
 CREATE OR REPLACE FUNCTION _do_treenode_insert_file_accounting() RETURNS TRIGGER AS
 $$
@@ -52,16 +82,11 @@ BEGIN
         RETURN NULL;
     END IF;
 
-    UPDATE vault_treenode
-    SET
-        file_count = file_count + 1,
-        size = COALESCE(size, 0) + COALESCE(NEW.size, 0)
-    WHERE
-        path @> (
-            SELECT path
-            FROM vault_treenode
-            WHERE id = NEW.parent_id
-        );
+    PERFORM _add_treenode_accounting(
+        (SELECT path FROM vault_treenode WHERE id = NEW.parent_id),
+        1,
+        COALESCE(NEW.size, 0)
+    );
 
     RETURN NULL;
 END;
@@ -71,7 +96,7 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION _do_treenode_delete_file_accounting() RETURNS TRIGGER AS
 $$
 DECLARE
-    size_delta int;
+    size_delta bigint;
 BEGIN
     IF OLD.deleted THEN
         -- case: TreeNode in question already soft-deleted; skip updating
@@ -85,14 +110,11 @@ BEGIN
         size_delta = COALESCE(OLD.size, 0);
     END IF;
 
-    UPDATE vault_treenode
-    SET
-        file_count = file_count - 1,
-        size = COALESCE(size, 0) - size_delta
-    WHERE
-        path @> OLD.path
-    AND
-        path != OLD.path;
+    PERFORM _add_treenode_accounting(
+        subpath(OLD.path, 0, nlevel(OLD.path) - 1),
+        -1,
+        -1 * size_delta
+    );
 
     RETURN NULL;
 END;
@@ -102,8 +124,8 @@ $$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION _do_treenode_update_file_accounting() RETURNS TRIGGER AS
 $$
 DECLARE
-    file_count_delta int;
-    size_delta int;
+    file_count_delta bigint;
+    size_delta bigint;
 BEGIN
     IF pg_trigger_depth() > 1 THEN
         -- prevent trigger recursion
@@ -127,55 +149,44 @@ BEGIN
             size_delta = 0;
         END IF;
 
-        UPDATE vault_treenode
-        SET
-            file_count = file_count + file_count_delta,
-            size = COALESCE(size, 0) + size_delta
-        WHERE
-            path @> NEW.path
-        AND
-            path != NEW.path;
+        PERFORM _add_treenode_accounting(
+            subpath(NEW.path, 0, nlevel(NEW.path) - 1),
+            file_count_delta,
+            size_delta
+        );
 
     ELSIF OLD.parent_id != NEW.parent_id THEN
         -- case: move
 
+        -- the moved node's own accounting may still have journaled deltas
+        SELECT
+            OLD.file_count + COALESCE(SUM(delta.file_count), 0),
+            COALESCE(OLD.size, 0) + COALESCE(SUM(delta.size), 0)
+        FROM vault_treenodeaccountingdelta AS delta
+        WHERE delta.tree_node_id = OLD.id
+        INTO file_count_delta, size_delta;
+
         IF NEW.node_type = 'FOLDER' THEN
             -- case: +1 for FOLDER nodes because parents' file_count includes
             -- folders because the behavior of
             -- _do_treenode_insert_file_accounting() increments ancestors'
             -- file_count on creation of all children, regardless of node_type
-            file_count_delta = OLD.file_count + 1;
-        ELSE
-            file_count_delta = OLD.file_count;
+            file_count_delta = file_count_delta + 1;
         END IF;
 
         -- decrement old ancestors
-        UPDATE vault_treenode AS self
-        SET
-            file_count = self.file_count - file_count_delta,
-            size = COALESCE(self.size, 0) - COALESCE(OLD.size, 0)
-        FROM
-            vault_treenode as old_parent
-        WHERE
-            old_parent.id = OLD.parent_id
-        AND
-            self.path @> old_parent.path
-        AND
-            self.id != OLD.id;
+        PERFORM _add_treenode_accounting(
+            (SELECT path FROM vault_treenode WHERE id = OLD.parent_id),
+            -1 * file_count_delta,
+            -1 * size_delta
+        );
 
         -- increment new ancestors
-        UPDATE vault_treenode AS self
-        SET
-            file_count = self.file_count + file_count_delta,
-            size = COALESCE(self.size, 0) + COALESCE(NEW.size, 0)
-        FROM
-            vault_treenode as new_parent
-        WHERE
-            new_parent.id = NEW.parent_id
-        AND
-            self.path @> new_parent.path
-        AND
-            self.id != NEW.id;
+        PERFORM _add_treenode_accounting(
+            (SELECT path FROM vault_treenode WHERE id = NEW.parent_id),
+            file_count_delta,
+            size_delta
+        );
 
     ELSIF OLD.size != NEW.size THEN
         -- case: size change
@@ -183,13 +194,11 @@ BEGIN
             RAISE EXCEPTION 'size of non-FILE nodes may not be explicitly modified';
         END IF;
 
-        UPDATE vault_treenode
-        SET
-            size = COALESCE(size, 0) - COALESCE(OLD.size, 0) + COALESCE(NEW.size, 0)
-        WHERE
-            path @> NEW.path
-        AND
-            path != NEW.path;
+        PERFORM _add_treenode_accounting(
+            subpath(NEW.path, 0, nlevel(NEW.path) - 1),
+            0,
+            COALESCE(NEW.size, 0) - COALESCE(OLD.size, 0)
+        );
     END IF;
 
     RETURN NULL;
@@ -242,18 +251,26 @@ CREATE TRIGGER treenode_path_prevent_null_trg
     WHEN (NEW.path IS NULL)
     EXECUTE PROCEDURE _reject_null_treenode_path();
 
--- do TreeNode accounting on INSERT
+-- do TreeNode accounting on INSERT, unless the transaction has deferred it
+-- (see vault.accounting)
 CREATE TRIGGER treenode_file_accounting_insert_trg
     AFTER INSERT ON vault_treenode
     FOR EACH ROW
-    WHEN (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+    WHEN (
+        (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+        AND current_setting('vault.treenode_accounting', true) IS DISTINCT FROM 'deferred'
+    )
     EXECUTE PROCEDURE _do_treenode_insert_file_accounting();
 
--- do TreeNode accounting on UPDATE
+-- do TreeNode accounting on UPDATE, unless the transaction has deferred it
+-- (see vault.accounting)
 CREATE TRIGGER treenode_file_accounting_update_trg
     AFTER UPDATE ON vault_treenode
     FOR EACH ROW
-    WHEN (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+    WHEN (
+        (NEW.node_type = 'FILE' OR NEW.node_type = 'FOLDER')
+        AND current_setting('vault.treenode_accounting', true) IS DISTINCT FROM 'deferred'
+    )
     EXECUTE PROCEDURE _do_treenode_update_file_accounting();
 
 -- do TreeNode accounting on DELETE
@@ -0,0 +1,147 @@
+"""The timeline of an Organization or a Collection: its Deposits, by
+``registered_at``, and its Reports, by ``started_at``, merged in one order.
+
+:py:func:`events_page` merges and paginates them in Postgres with a single
+``UNION ALL`` query, keyset-paginated by ``(time, model, id)``, so that a
+page costs the same however long the timeline is. Pages are continued from
+the opaque cursor of their last event, see :py:func:`parse_cursor`.
+"""
+
+import typing
+
+from django.db import connection
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from vault import models
+
+#: Deposits ``15`` to ``96`` on the production environment are files migrated
+#: from the old system into the new system
+MIGRATION_DEPOSIT_IDS = (15, 96)
+
+#: ``model`` of each kind of event, which breaks ties between a Deposit and a
+#: Report at the same time
+DEPOSIT = "deposit"
+REPORT = "report"
+
+Event = typing.Union[models.Deposit, models.Report]
+
+
+def parse_cursor(cursor: str) -> typing.Tuple:
+    """Returns the keyset of the *cursor* of a page.
+
+    :raises ValueError: if *cursor* isn't one returned by :py:func:`events_page`
+    """
+    time, model, event_id = cursor.split("|")
+    time = parse_datetime(time)
+    if time is None or model not in (DEPOSIT, REPORT):
+        raise ValueError(cursor)
+    return time, model, int(event_id)
+
+
+def _cursor(event: Event) -> str:
+    if isinstance(event, models.Deposit):
+        return f"{event.registered_at.isoformat()}|{DEPOSIT}|{event.id}"
+    return f"{event.started_at.isoformat()}|{REPORT}|{event.id}"
+
+
+def events_page(
+    organization_id: int,
+    collection_id: typing.Optional[int] = None,
+    newest_first: bool = True,
+    after: typing.Optional[str] = None,
+    limit: int = 100,
+    include_migrations: bool = False,
+) -> typing.Tuple[typing.List[Event], typing.Optional[str]]:
+    """Returns up to *limit* Deposits and Reports of *organization_id*, or
+    only of *collection_id*, after the cursor *after*, and the cursor of the
+    next page, or ``None`` if this is the last.
+
+    Deposits are annotated with their ``file_count``, ``total_size`` and
+    ``error_count``. Migration deposits are left out unless
+    *include_migrations*.
+
+    :raises ValueError: if *after* isn't a valid cursor
+    """
+    order = "DESC" if newest_first else "ASC"
+    compare = "<" if newest_first else ">"
+    keyset = parse_cursor(after) if after else None
+
+    deposit_where = ["d.organization_id = %s"]
+    deposit_params = [organization_id]
+    report_where = ["c.organization_id = %s"]
+    report_params = [organization_id]
+    if collection_id is not None:
+        deposit_where.append("d.collection_id = %s")
+        deposit_params.append(collection_id)
+        report_where.append("r.collection_id = %s")
+        report_params.append(collection_id)
+    if not include_migrations:
+        deposit_where.append("d.id NOT BETWEEN %s AND %s")
+        deposit_params.extend(MIGRATION_DEPOSIT_IDS)
+    if keyset is not None:
+        deposit_where.append(f"(d.registered_at, %s, d.id) {compare} (%s, %s, %s)")
+        deposit_params.extend([DEPOSIT, *keyset])
+        report_where.append(f"(r.started_at, %s, r.id) {compare} (%s, %s, %s)")
+        report_params.extend([REPORT, *keyset])
+
+    # each branch is ordered and limited on its own, so that it reads no
+    # more than a page from its index
+    sql = f"""
+        (
+            SELECT d.registered_at AS event_time, %s AS model, d.id
+            FROM vault_deposit d
+            WHERE {" AND ".join(deposit_where)}
+            ORDER BY d.registered_at {order}, d.id {order}
+            LIMIT %s
+        )
+        UNION ALL
+        (
+            SELECT r.started_at AS event_time, %s AS model, r.id
+            FROM vault_report r
+            JOIN vault_collection c ON c.id = r.collection_id
+            WHERE {" AND ".join(report_where)}
+            ORDER BY r.started_at {order}, r.id {order}
+            LIMIT %s
+        )
+        ORDER BY event_time {order}, model {order}, id {order}
+        LIMIT %s
+    """
+    params = [
+        DEPOSIT,
+        *deposit_params,
+        limit + 1,
+        REPORT,
+        *report_params,
+        limit + 1,
+        limit + 1,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        keys = [(model, event_id) for _, model, event_id in cursor.fetchall()]
+
+    page_keys = keys[:limit]
+    deposits = models.Deposit.objects.filter(
+        id__in=[event_id for model, event_id in page_keys if model == DEPOSIT]
+    ).annotate(
+        file_count=Coalesce(Sum("file_state_counts__file_count"), 0),
+        total_size=Coalesce(Sum("file_state_counts__size"), 0),
+        error_count=Coalesce(
+            Sum(
+                "file_state_counts__file_count",
+                filter=Q(file_state_counts__state=models.DepositFile.State.ERROR),
+            ),
+            0,
+        ),
+    )
+    reports = models.Report.objects.filter(
+        id__in=[event_id for model, event_id in page_keys if model == REPORT]
+    )
+    events = {(DEPOSIT, deposit.id): deposit for deposit in deposits}
+    events.update({(REPORT, report.id): report for report in reports})
+    # events deleted since the first query are left out
+    page = [events[key] for key in page_keys if key in events]
+
+    next_cursor = _cursor(page[-1]) if page and len(keys) > limit else None
+    return page, next_cursor
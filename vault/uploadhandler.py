@@ -0,0 +1,102 @@
+"""Upload handling which writes each uploaded byte to disk once.
+
+Django's :py:class:`~django.core.files.uploadhandler.TemporaryFileUploadHandler`
+streams each uploaded file into a temporary file under
+``FILE_UPLOAD_TEMP_DIR``. :py:class:`HashingFileUploadHandler` also hashes it
+as it is received, and :py:func:`save_upload` renames the temporary file into
+its destination, which is on the same filesystem, instead of copying it.
+"""
+
+import errno
+import hashlib
+import os
+import tempfile
+import typing
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+#: digests computed of every uploaded file
+UPLOAD_ALGORITHMS = ("sha256",)
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """Streams uploaded files to temporary files, like the Django handler,
+    and sets ``hashes``, a dict of hash objects by algorithm name, on each
+    uploaded file.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashes = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hashes = {name: hashlib.new(name) for name in UPLOAD_ALGORITHMS}
+
+    def receive_data_chunk(self, raw_data, start):
+        for _hash in self.hashes.values():
+            _hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.hashes = self.hashes
+        return uploaded_file
+
+
+def upload_hexdigest(uploaded_file: UploadedFile, algorithm: str) -> str:
+    """Returns the *algorithm* digest of *uploaded_file*, computed as it was
+    received where possible.
+    """
+    hashes = getattr(uploaded_file, "hashes", {})
+    if algorithm in hashes:
+        return hashes[algorithm].hexdigest()
+    _hash = hashlib.new(algorithm)
+    for data in uploaded_file.chunks():
+        _hash.update(data)
+    return _hash.hexdigest()
+
+
+def save_upload(uploaded_file: UploadedFile, dest_path: typing.Union[str, os.PathLike]):
+    """Durably saves *uploaded_file* at *dest_path*, which appears atomically.
+
+    The temporary file of an upload is synced and renamed into place; other
+    uploads (e.g. held in memory) are written to a temporary file next to
+    *dest_path* first.
+    """
+    if hasattr(uploaded_file, "temporary_file_path"):
+        uploaded_file.file.flush()
+        # temporary files are only readable by their owner
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.fchmod(uploaded_file.file.fileno(), settings.FILE_UPLOAD_PERMISSIONS)
+        os.fsync(uploaded_file.file.fileno())
+        try:
+            os.replace(uploaded_file.temporary_file_path(), dest_path)
+            # closed now, as the file it would delete when collected is gone
+            uploaded_file.close()
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # on another filesystem, copy it instead
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(dest_path), prefix=".upload-", suffix=".out"
+    )
+    try:
+        if settings.FILE_UPLOAD_PERMISSIONS is not None:
+            os.fchmod(fd, settings.FILE_UPLOAD_PERMISSIONS)
+        with os.fdopen(fd, "wb") as out:
+            for data in uploaded_file.chunks():
+                out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -7,29 +7,66 @@
 
 import argparse
 import logging
+import multiprocessing
 import os
-import shutil
 import signal
+import socket
 import sys
-import hashlib
 import math
 import threading
 import time
+from contextlib import contextmanager
 
 from django.db.models import Max
-from fs.errors import ResourceNotFound
-from fs.osfs import OSFS
 
 os.environ["DJANGO_SETTINGS_MODULE"] = "vault_site.settings"
 import django
 
 django.setup()
-from django.conf import settings
+from django import db
+from django.db import DatabaseError
 from django.utils import timezone
-from vault.models import DepositFile, Deposit, TreeNode, Collection, Organization
+from vault.chunks import (
+    HashCheckpoint,
+    chunk_filename,
+    file_chunk_dir,
+    incoming_dir,
+    is_preallocated,
+    load_hash_checkpoint,
+    load_merge_checkpoint,
+    preallocated_path,
+    read_chunk_marker,
+    remove_chunk_digests,
+    remove_chunk_markers,
+    remove_chunk_progress,
+    remove_hash_checkpoint,
+    remove_merge_checkpoint,
+    save_merge_checkpoint,
+    saved_chunk_paths,
+)
+from vault.hashing import RESUMABLE_HASH_AVAILABLE
+from vault.materialize import materialize_deposit_files
+from vault.merge import (
+    MergeAborted,
+    hash_in_place,
+    merge_chunks,
+    verify_partial_merge,
+)
+from vault.models import DepositFile, Deposit, PetaboxItem
+from vault.notifications import StateListener, notify_state
+from vault import shafs
 
 SLEEP_TIME = 20
-READ_BUFFER_SIZE = 2 * 1024 * 1024
+# Workers are woken by DepositFile state notifications; polling only catches
+# anything missed, e.g. while the listener connection was down.
+POLL_INTERVAL = 5 * 60
+LEASE_SECONDS = 5 * 60
+# TreeNodes for hashed files are created in bulk after this many files or
+# seconds, whichever comes first, and at the end of each pass
+MATERIALIZE_BATCH_FILES = 1000
+MATERIALIZE_INTERVAL = 30
+# fields of a DepositFile saved once it is hashed
+HASHED_FIELDS = ["md5_sum", "sha1_sum", "sha256_sum", "hashed_at", "state"]
 logger = logging.getLogger(__name__)
 
 shutdown = threading.Event()
@@ -48,208 +85,364 @@ shutdown = threading.Event()
 
 
 def process_uploaded_deposit_files(args):
-    while True:
-        for deposit_file in DepositFile.objects.filter(
-            state=DepositFile.State.UPLOADED
-        ):
-            org_id = deposit_file.deposit.organization_id
-            org_tmp_path = str(org_id)
-
-            # Check if we have all chunks for the file. They may be on another node.
-            osfs_root = os.path.join(settings.FILE_UPLOAD_TEMP_DIR, org_tmp_path)
-            with OSFS(osfs_root) as org_fs:
-                org_fs.makedir("/merged", recreate=True)
-                chunk_list = []
-                try:
-                    chunk_list = [
-                        c
-                        for c in org_fs.filterdir(
-                            "/chunks",
-                            files=[deposit_file.flow_identifier + "-*.tmp"],
-                            namespaces=["details"],
-                        )
-                        if not c.is_dir
-                    ]
-                except (FileNotFoundError, ResourceNotFound) as e:
-                    logging.warning(f"Error listing files in /chunks {e}")
-
-                chunk_count = len(chunk_list)
-
-                # If the chunks for this DepositFile are not on this machine
-                if chunk_count == 0:
-                    continue
-
-                logger.debug(f"Calculating chunk size.")
-                combined_chunk_size = sum(
-                    org_fs.getsize("/chunks/" + c.name) for c in chunk_list
-                )
-                logger.info(
-                    f"Processing UPLOADED DepositFile {deposit_file.flow_identifier}"
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} started")
+    with StateListener([DepositFile.State.UPLOADED], shutdown) as listener:
+        while True:
+            process_uploaded_deposit_files_pass(args, worker_id)
+            logger.debug(
+                f"waiting up to {args.poll_interval} sec for UPLOADED DepositFiles"
+            )
+            listener.wait(args.poll_interval)
+            if shutdown.is_set():
+                return
+
+
+def process_uploaded_deposit_files_pass(args, worker_id):
+    # DepositFiles this worker could not process during this pass, e.g.
+    # because their chunks live on another node. They are retried on the
+    # next pass.
+    skipped_ids = set()
+    processed_since_materialize = 0
+    last_materialize = time.monotonic()
+    while not shutdown.is_set():
+        deposit_file = DepositFile.claim_next(
+            DepositFile.State.UPLOADED,
+            worker_id,
+            args.lease_seconds,
+            exclude_ids=skipped_ids,
+        )
+        if deposit_file is None:
+            break
+        try:
+            with lease_heartbeat(
+                deposit_file, worker_id, args.lease_seconds
+            ) as lease_lost:
+                processed = process_uploaded_deposit_file(
+                    deposit_file, worker_id, lease_lost
                 )
+        finally:
+            deposit_file.release_lease(worker_id)
+        if not processed:
+            skipped_ids.add(deposit_file.id)
+            continue
+
+        processed_since_materialize += 1
+        if (
+            processed_since_materialize >= MATERIALIZE_BATCH_FILES
+            or time.monotonic() - last_materialize >= MATERIALIZE_INTERVAL
+        ):
+            materialize_pending()
+            processed_since_materialize = 0
+            last_materialize = time.monotonic()
 
-                if combined_chunk_size != deposit_file.size:
+    materialize_pending()
+
+
+def materialize_pending():
+    """Creates the TreeNodes of all HASHED DepositFiles which don't have one
+    yet, a Deposit at a time, and finalizes those Deposits.
+
+    This picks up files hashed by any worker, including workers which died
+    before materializing them.
+    """
+    deposit_ids = (
+        DepositFile.objects.filter(
+            state=DepositFile.State.HASHED, tree_node__isnull=True
+        )
+        .values_list("deposit_id", flat=True)
+        .distinct()
+    )
+    for deposit in Deposit.objects.filter(pk__in=list(deposit_ids)).order_by("id"):
+        db_time = time.perf_counter()
+        try:
+            deposit_files = materialize_deposit_files(deposit)
+        except DatabaseError as e:
+            logger.error(f"Error creating TreeNodes for Deposit {deposit.id} - {e}")
+            continue
+        logger.info(
+            f"Deposit {deposit.id} TREENODE materialization time: {time.perf_counter() - db_time:.2f}s"
+        )
+        if deposit_files:
+            # TreeNodes only become visible to replication now
+            notify_state(DepositFile.State.HASHED)
+            finalize_deposit(deposit_files[-1])
+
+
+@contextmanager
+def lease_heartbeat(deposit_file, worker_id, lease_seconds):
+    """Periodically renews the lease held by *worker_id* on *deposit_file*
+    while the body of the ``with`` block runs, so that long merges are not
+    taken over by other workers.
+
+    Yields an event which is set once the lease can't be renewed: another
+    worker may claim the file from then on, so the body must stop working on
+    it.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def renew():
+        try:
+            while not stop.wait(lease_seconds / 3):
+                if not deposit_file.renew_lease(worker_id, lease_seconds):
                     logger.error(
-                        f"Chunk marked as UPLOADED, but sizes don't match: {deposit_file.flow_identifier}"
-                    )
-                    deposit_file.state = deposit_file.State.ERROR
-                    deposit_file.save()
-                    finalize_deposit(deposit_file)
-                    continue
-
-                logger.debug(f"Chunk sizes match. Merging...")
-                merged_filename = deposit_file.flow_identifier + ".merged.tmp"
-                md5_hash = hashlib.md5()
-                sha1_hash = hashlib.sha1()
-                sha256_hash = hashlib.sha256()
-
-                file_start_time = time.perf_counter()
-                file_read_time = 0
-                file_merge_time = 0
-                file_md5_time = 0
-                file_sha1_time = 0
-                file_sha256_time = 0
-                for i in range(1, chunk_count + 1):
-                    chunk_filename = (
-                        "chunks/" + deposit_file.flow_identifier + "-" + str(i) + ".tmp"
-                    )
-                    chunk_path = os.path.join(osfs_root, chunk_filename)
-                    merged_chunk_path = os.path.join(
-                        osfs_root, "chunks", merged_filename
-                    )
-                    try:
-                        with open(chunk_path, "rb") as f:
-                            while True:
-                                read_start = time.perf_counter()
-                                bytes = f.read(READ_BUFFER_SIZE)
-                                file_read_time += time.perf_counter() - read_start
-                                if bytes:
-                                    merge_start = time.perf_counter()
-                                    org_fs.appendbytes(
-                                        "/chunks/" + merged_filename, bytes
-                                    )
-                                    file_merge_time += time.perf_counter() - merge_start
-                                    hash_start = time.perf_counter()
-                                    md5_hash.update(bytes)
-                                    file_md5_time += time.perf_counter() - hash_start
-                                    hash_start = time.perf_counter()
-                                    sha1_hash.update(bytes)
-                                    file_sha1_time += time.perf_counter() - hash_start
-                                    hash_start = time.perf_counter()
-                                    sha256_hash.update(bytes)
-                                    file_sha256_time += time.perf_counter() - hash_start
-                                elif 0 == deposit_file.size:
-                                    with open(merged_chunk_path, mode="a"):
-                                        pass
-                                    md5_hash.update(b"")
-                                    sha1_hash.update(b"")
-                                    sha256_hash.update(b"")
-                                    break
-                                else:
-                                    break
-
-                    except Exception as e:
-                        logger.error(
-                            f"Error trying to read chunk file {chunk_filename}"
-                        )
-                        break
-                else:  # if chunk loop did not break
-                    file_time_delta = time.perf_counter() - file_start_time
-                    rate = deposit_file.size / file_time_delta
-                    pretty_rate = convert_size(rate) + "/s"
-                    logger.info(f"{merged_filename} read time: {file_read_time:.2f}s")
-                    logger.info(f"{merged_filename} write time: {file_merge_time:.2f}s")
-                    logger.info(
-                        f"{merged_filename} hash time (md5): {file_md5_time:.2f}s"
-                    )
-                    logger.info(
-                        f"{merged_filename} hash time (sha1): {file_sha1_time:.2f}s"
-                    )
-                    logger.info(
-                        f"{merged_filename} hash time (sha256): {file_sha256_time:.2f}s"
-                    )
-                    logger.info(
-                        f"Processed file {merged_filename}. {deposit_file.size} bytes in {file_time_delta:.2f} seconds - {pretty_rate}"
+                        f"Worker {worker_id} lost lease on DepositFile {deposit_file.id}"
                     )
+                    return
+        finally:
+            if not stop.is_set():
+                # renewal failed, or raised
+                lost.set()
+            # Django opens a DB connection per thread
+            db.connection.close()
+
+    heartbeat = threading.Thread(target=renew, daemon=True)
+    heartbeat.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def process_uploaded_deposit_file(deposit_file, worker_id, lease_lost):
+    """Merges and hashes the chunks of a single UPLOADED DepositFile claimed
+    by *worker_id*, stopping if *lease_lost* is set.
+
+    Returns ``False`` when the DepositFile could not be processed by this
+    worker and should be retried later.
+    """
+    org_id = deposit_file.deposit.organization_id
 
-                    deposit_file.md5_sum = md5_hash.hexdigest()
-                    deposit_file.sha1_sum = sha1_hash.hexdigest()
-                    deposit_file.sha256_sum = sha256_hash.hexdigest()
-                    deposit_file.hashed_at = timezone.now()
-                    try:
-                        move_into_shafs(
-                            deposit_file, org_fs.getospath("/chunks/" + merged_filename)
-                        )
-                    except OSError as err:
-                        logger.error(
-                            f"Error moving merged file to destination {merged_filename} - {err}"
-                        )
-                        deposit_file.state = DepositFile.State.ERROR
-                        deposit_file.save()
-                        finalize_deposit(deposit_file)
-                        continue
-
-                    db_time = time.perf_counter()
-                    parent_node = make_or_find_parent_node(deposit_file)
-                    parent_lookup_time = time.perf_counter() - db_time
-                    logger.info(
-                        f"{merged_filename} TREENODE Parent lookup time: {parent_lookup_time:.2f}s"
-                    )
-                    db_time = time.perf_counter()
-                    file_node, file_node_created = make_or_find_file_node(
-                        deposit_file, parent_node
-                    )
-                    treenode_insert_time = time.perf_counter() - db_time
-                    logger.info(
-                        f"{merged_filename} TREENODE insert time: {treenode_insert_time:.2f}s"
-                    )
+    try:
+        preallocated = is_preallocated(
+            incoming_dir(org_id), deposit_file.flow_identifier
+        )
+        chunk_dir = file_chunk_dir(org_id, deposit_file.flow_identifier)
+    except ValueError as e:
+        # registered before flow identifiers were validated
+        logger.error(f"Unsafe flow identifier of DepositFile {deposit_file.id}: {e}")
+        mark_error(deposit_file, worker_id)
+        return True
+    if preallocated:
+        return process_preallocated_deposit_file(
+            deposit_file, incoming_dir(org_id), worker_id, lease_lost
+        )
 
-                    if not file_node_created:
-                        # We just replaced the old file, update tree node values to match
-                        logger.info(
-                            f"TreeNode entry replaced: id:{file_node.id} - {file_node.name}\n"
-                            + "\tPrevious data was:"
-                        )
-                        logger.info(
-                            f"\tmd5_sum:{file_node.md5_sum}\n"
-                            + f"\tsha1_sum:{file_node.sha1_sum}\n"
-                            + f"\tsha256_sum:{file_node.sha256_sum}\n"
-                            + f"\tsize:{file_node.size}\n"
-                            + f"\tfile_type:{file_node.file_type}\n"
-                            + f"\tuploaded_at:{file_node.uploaded_at}\n"
-                            + f"\tmodified_at:{file_node.modified_at}\n"
-                            + f"\tpre_deposit_modified_at:{file_node.pre_deposit_modified_at}\n"
-                            + f"\tuploaded_by:{file_node.uploaded_by}\n"
-                        )
-                        file_node.md5_sum = deposit_file.md5_sum
-                        file_node.sha1_sum = deposit_file.sha1_sum
-                        file_node.sha256_sum = deposit_file.sha256_sum
-                        file_node.size = deposit_file.size
-                        file_node.file_type = deposit_file.type
-                        file_node.uploaded_at = deposit_file.uploaded_at
-                        file_node.modified_at = deposit_file.hashed_at
-                        file_node.pre_deposit_modified_at = (
-                            deposit_file.pre_deposit_modified_at
-                        )
-                        file_node.uploaded_by = deposit_file.deposit.user
-                        try:
-                            file_node.save()
-                        except Exception as e:
-                            logger.error(
-                                f"Problem saving FileNode {file_node.id} {file_node.name}"
-                            )
-
-                    deposit_file.tree_node = file_node
-                    deposit_file.state = DepositFile.State.HASHED
-                    deposit_file.save()
-                    finalize_deposit(deposit_file)
-
-                    logger.info(
-                        f"Chunked file merged {deposit_file.flow_identifier} - {deposit_file.sha256_sum}"
-                    )
+    # Check if we have all chunks for the file. They may be on another node.
+    chunk_paths = saved_chunk_paths(chunk_dir, deposit_file.flow_identifier)
+    chunk_count = len(chunk_paths)
+
+    # If the chunks for this DepositFile are not on this machine
+    if chunk_count == 0:
+        return False
+
+    logger.debug(f"Calculating chunk size.")
+    combined_chunk_size = sum(os.path.getsize(path) for path in chunk_paths)
+    logger.info(f"Processing UPLOADED DepositFile {deposit_file.flow_identifier}")
+
+    if combined_chunk_size != deposit_file.size:
+        logger.error(
+            f"Chunk marked as UPLOADED, but sizes don't match: {deposit_file.flow_identifier}"
+        )
+        mark_error(deposit_file, worker_id)
+        return True
+
+    logger.debug(f"Chunk sizes match. Merging...")
+    merged_filename = deposit_file.flow_identifier + ".merged.tmp"
+    merged_chunk_path = os.path.join(chunk_dir, merged_filename)
+    # a missing chunk fails the merge, so that it is retried
+    chunk_paths = [
+        os.path.join(chunk_dir, chunk_filename(deposit_file.flow_identifier, i))
+        for i in range(1, chunk_count + 1)
+    ]
+    hashes, hashed_chunks = None, 0
+    merged_chunks, merged_size = 0, 0
+    resumed = load_merge_checkpoint(chunk_dir, deposit_file.flow_identifier)
+    if resumed is not None:
+        if verify_partial_merge(
+            chunk_paths, merged_chunk_path, resumed.hashed_chunks, resumed.size
+        ):
+            hashes = resumed.hashes
+            merged_chunks, merged_size = resumed.hashed_chunks, resumed.size
+            logger.info(
+                f"{merged_filename} resuming merge after {merged_chunks}/{chunk_count} chunks"
+            )
+        else:
+            logger.warning(
+                f"Merge checkpoint doesn't match merged file, merging again: {merged_filename}"
+            )
+    checkpoint = (
+        load_hash_checkpoint(chunk_dir, deposit_file.flow_identifier)
+        if hashes is None
+        else None
+    )
+    if checkpoint is not None:
+        if checkpoint.hashed_chunks <= chunk_count and checkpoint.size == sum(
+            os.path.getsize(path) for path in chunk_paths[: checkpoint.hashed_chunks]
+        ):
+            hashes, hashed_chunks = checkpoint.hashes, checkpoint.hashed_chunks
+            logger.info(
+                f"{merged_filename} {hashed_chunks}/{chunk_count} chunks hashed during upload"
+            )
+        else:
+            logger.warning(
+                f"Hash checkpoint doesn't match chunks, rehashing: {merged_filename}"
+            )
+    save_checkpoint = None
+    if RESUMABLE_HASH_AVAILABLE:
+        if hashes is None:
+            # resumable hashes, so that the merge can be checkpointed
+            hashes = HashCheckpoint.start().hashes
+
+        def save_checkpoint(chunks, size, hashes):
+            save_merge_checkpoint(
+                chunk_dir,
+                deposit_file.flow_identifier,
+                HashCheckpoint(next_chunk=chunks + 1, size=size, hashes=hashes),
+            )
+
+    try:
+        result = merge_chunks(
+            chunk_paths,
+            merged_chunk_path,
+            hashes=hashes,
+            hashed_chunks=hashed_chunks,
+            merged_chunks=merged_chunks,
+            merged_size=merged_size,
+            checkpoint=save_checkpoint,
+            abort=lease_lost,
+        )
+    except MergeAborted:
+        logger.error(f"Lease lost, abandoning merge of {merged_filename}")
+        return False
+    except OSError as e:
+        logger.error(f"Error trying to merge chunk files {merged_filename} - {e}")
+        return False
+    remove_merge_checkpoint(chunk_dir, deposit_file.flow_identifier)
+    remove_hash_checkpoint(chunk_dir, deposit_file.flow_identifier)
+    remove_chunk_progress(chunk_dir, deposit_file.flow_identifier)
+    remove_chunk_digests(chunk_dir, deposit_file.flow_identifier)
+    return finish_hashing(
+        deposit_file, result, merged_chunk_path, worker_id, lease_lost
+    )
+
+
+def process_preallocated_deposit_file(deposit_file, chunk_dir, worker_id, lease_lost):
+    """Hashes an UPLOADED DepositFile claimed by *worker_id* whose chunks were
+    written in place into its preallocated file, see :py:mod:`vault.chunks`.
+    There is nothing to merge: once hashed, the file is renamed into shafs.
 
-        logger.debug(f"forever loop sleeping {SLEEP_TIME} sec before iterating")
-        if shutdown.wait(SLEEP_TIME):
-            return
+    Returns ``False`` when the DepositFile should be retried later.
+    """
+    identifier = deposit_file.flow_identifier
+    path = preallocated_path(chunk_dir, identifier)
+    logger.info(f"Processing UPLOADED DepositFile {identifier}")
+
+    if os.path.getsize(path) != deposit_file.size:
+        logger.error(
+            f"Preallocated file marked as UPLOADED, but sizes don't match: {identifier}"
+        )
+        mark_error(deposit_file, worker_id)
+        return True
+
+    hashes, hashed_size = None, 0
+    checkpoint = load_hash_checkpoint(chunk_dir, identifier)
+    if checkpoint is not None:
+        last_hashed = read_chunk_marker(chunk_dir, identifier, checkpoint.hashed_chunks)
+        if checkpoint.hashed_chunks == 0 or (
+            last_hashed is not None and checkpoint.size == sum(last_hashed)
+        ):
+            hashes, hashed_size = checkpoint.hashes, checkpoint.size
+            logger.info(
+                f"{identifier} {hashed_size}/{deposit_file.size} bytes hashed during upload"
+            )
+        else:
+            logger.warning(
+                f"Hash checkpoint doesn't match chunks, rehashing: {identifier}"
+            )
+    try:
+        result = hash_in_place(
+            path, hashes=hashes, hashed_size=hashed_size, abort=lease_lost
+        )
+    except MergeAborted:
+        logger.error(f"Lease lost, abandoning hashing of {path}")
+        return False
+    except OSError as e:
+        logger.error(f"Error trying to hash preallocated file {path} - {e}")
+        return False
+    remove_hash_checkpoint(chunk_dir, identifier)
+    remove_chunk_markers(chunk_dir, identifier)
+    remove_chunk_progress(chunk_dir, identifier)
+    remove_chunk_digests(chunk_dir, identifier)
+    return finish_hashing(deposit_file, result, path, worker_id, lease_lost)
+
+
+def finish_hashing(deposit_file, result, file_path, worker_id, lease_lost):
+    """Records the digests of *deposit_file* from the :py:class:`.MergeResult`
+    *result* and moves the file at *file_path* into shafs, unless
+    *worker_id* lost its lease on *deposit_file*, see :py:func:`lease_heartbeat`.
+    """
+    merged_filename = os.path.basename(file_path)
+
+    timings = result.timings
+    rate = deposit_file.size / timings.total if timings.total else 0
+    pretty_rate = convert_size(rate) + "/s"
+    logger.info(f"{merged_filename} read time: {timings.read:.2f}s")
+    logger.info(
+        f"{merged_filename} write time ({result.copy_method}): {timings.write:.2f}s"
+    )
+    logger.info(
+        f"{merged_filename} hash wait time (md5, sha1, sha256 in parallel): {timings.hash_wait:.2f}s"
+    )
+    logger.info(
+        f"Processed file {merged_filename}. {deposit_file.size} bytes in {timings.total:.2f} seconds - {pretty_rate}"
+    )
+
+    deposit_file.md5_sum = result.digests["md5"]
+    deposit_file.sha1_sum = result.digests["sha1"]
+    deposit_file.sha256_sum = result.digests["sha256"]
+    deposit_file.hashed_at = timezone.now()
+    if lease_lost.is_set():
+        logger.error(f"Lease lost, dropping result of {merged_filename}")
+        return False
+    try:
+        move_into_shafs(deposit_file, file_path)
+    except OSError as err:
+        logger.error(
+            f"Error moving merged file to destination {merged_filename} - {err}"
+        )
+        mark_error(deposit_file, worker_id, HASHED_FIELDS)
+        return True
+
+    # TreeNodes are created in bulk per Deposit, see materialize_pending
+    deposit_file.state = DepositFile.State.HASHED
+    if not deposit_file.save_if_leased(worker_id, HASHED_FIELDS):
+        logger.error(f"Lease lost, dropping result of {merged_filename}")
+        return False
+
+    logger.info(
+        f"Chunked file merged {deposit_file.flow_identifier} - {deposit_file.sha256_sum}"
+    )
+    if deposit_file.uploaded_at:
+        latency = deposit_file.hashed_at - deposit_file.uploaded_at
+        logger.info(
+            f"{merged_filename} latency uploaded_at->hashed_at: {latency.total_seconds():.2f}s"
+        )
+    return True
+
+
+def mark_error(deposit_file, worker_id, update_fields=()):
+    """Marks *deposit_file* ERROR, along with its *update_fields*, and gives
+    back its Petabox allocation, unless *worker_id* lost its lease on it.
+    """
+    deposit_file.state = DepositFile.State.ERROR
+    if not deposit_file.save_if_leased(worker_id, ["state", *update_fields]):
+        logger.error(f"Lease lost, not marking {deposit_file.flow_identifier} ERROR")
+        return
+    PetaboxItem.release([deposit_file])
+    finalize_deposit(deposit_file)
 
 
 def finalize_deposit(deposit_file):
@@ -274,93 +467,28 @@ def finalize_deposit(deposit_file):
 
 def is_deposit_uploaded(deposit):
     if deposit.state in (Deposit.State.REGISTERED, Deposit.State.UPLOADED):
-        if 0 == len(
-            DepositFile.objects.filter(
-                deposit=deposit,
-                state__in=(
-                    DepositFile.State.REGISTERED,
-                    DepositFile.State.UPLOADED,
-                ),
-            )
+        state_count, _ = deposit.file_state_totals()
+        if (
+            state_count[DepositFile.State.REGISTERED]
+            or state_count[DepositFile.State.UPLOADED]
         ):
-            return True
+            return False
+        # HASHED files are only done once they have a TreeNode, see
+        # materialize_pending
+        return not DepositFile.objects.filter(
+            deposit=deposit, state=DepositFile.State.HASHED, tree_node__isnull=True
+        ).exists()
     return False
 
 
 def move_into_shafs(deposit_file, current_file_path):
-    shafs_root = get_shafs_folder(deposit_file)
-    os.makedirs(shafs_root, exist_ok=True)
-    shutil.move(
+    shafs.add_blob(
+        deposit_file.deposit.organization_id,
+        deposit_file.sha256_sum,
         current_file_path,
-        os.path.join(shafs_root, deposit_file.sha256_sum),
     )
 
 
-# TODO expand this in the future for shafs folder structure
-def get_shafs_folder(deposit_file):
-    org_id = deposit_file.deposit.organization_id
-    org_tmp_path = str(org_id)
-    return os.path.join(settings.SHADIR_ROOT, org_tmp_path)
-
-
-def make_or_find_file_node(deposit_file, parent):
-    file_node, created = TreeNode.objects.get_or_create(
-        parent=parent,
-        name=deposit_file.name,
-        defaults=dict(
-            node_type=TreeNode.Type.FILE,
-            md5_sum=deposit_file.md5_sum,
-            sha1_sum=deposit_file.sha1_sum,
-            sha256_sum=deposit_file.sha256_sum,
-            size=deposit_file.size,
-            file_type=deposit_file.type,
-            uploaded_at=deposit_file.uploaded_at,
-            modified_at=deposit_file.hashed_at,
-            pre_deposit_modified_at=deposit_file.pre_deposit_modified_at,
-            uploaded_by=deposit_file.deposit.user,
-        ),
-    )
-    msg = "created" if created else "already exists"
-    logger.info(f"TreeNode FILE {deposit_file.sha256_sum} {deposit_file.name} {msg}")
-
-    return file_node, created
-
-
-def make_or_find_parent_node(deposit_file):
-    organization = Organization.objects.get(id=deposit_file.deposit.organization_id)
-    collection = Collection.objects.get(id=deposit_file.deposit.collection_id)
-    deposit_parent_node = deposit_file.deposit.parent_node
-
-    # Make collection and org tree nodes if non existent
-    if organization.tree_node is None:
-        org_tree_node = TreeNode.objects.create(
-            node_type=TreeNode.Type.ORGANIZATION, name=organization.name
-        )
-        organization.tree_node = org_tree_node
-        organization.save()
-    if collection.tree_node is None:
-        collection_tree_node = TreeNode.objects.create(
-            node_type=TreeNode.Type.COLLECTION,
-            name=collection.name,
-            parent=organization.tree_node,
-        )
-        collection.tree_node = collection_tree_node
-        collection.save()
-
-    # filter and ignore empty path segments. Strip file name segment
-    parent_segment = deposit_parent_node
-    for segment in filter(None, deposit_file.relative_path.split("/")[:-1]):
-        parent_segment, created = TreeNode.objects.get_or_create(
-            parent=parent_segment,
-            name=segment,
-            defaults={"node_type": TreeNode.Type.FOLDER},
-        )
-        msg = "created" if created else "already exists"
-        logger.info(f"TreeNode FOLDER {segment} for {deposit_file.sha256_sum} {msg}")
-
-    return parent_segment
-
-
 # via https://stackoverflow.com/questions/5194057/better-way-to-convert-file-sizes-in-python
 def convert_size(size_bytes):
     if size_bytes == 0:
@@ -388,6 +516,25 @@ def main(argv=None):
         const=logging.DEBUG,
         help="verbose logging",
     )
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes merging files concurrently",
+    )
+    arg_parser.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=LEASE_SECONDS,
+        help="seconds after which a crashed worker's DepositFile may be reclaimed",
+    )
+    arg_parser.add_argument(
+        "--poll-interval",
+        type=int,
+        default=POLL_INTERVAL,
+        help="seconds between scans for UPLOADED files when no notification arrives",
+    )
     args = arg_parser.parse_args(args=sys.argv[1:])
 
     logging.root.setLevel(level=args.log_level)
@@ -402,7 +549,39 @@ def main(argv=None):
     signal.signal(signal.SIGHUP, sig_handler)
     signal.signal(signal.SIGQUIT, sig_handler)
 
-    process_uploaded_deposit_files(args)
+    if args.workers > 1:
+        run_worker_pool(args)
+    else:
+        process_uploaded_deposit_files(args)
+
+
+def run_worker_pool(args):
+    """Runs *args.workers* worker processes, replacing any which die, until
+    shutdown is requested.
+    """
+    # forked children must not share the parent's DB connection
+    db.connections.close_all()
+    ctx = multiprocessing.get_context("fork")
+
+    def start_worker():
+        worker = ctx.Process(target=process_uploaded_deposit_files, args=(args,))
+        worker.start()
+        return worker
+
+    workers = [start_worker() for _ in range(args.workers)]
+    while not shutdown.wait(SLEEP_TIME):
+        for i, worker in enumerate(workers):
+            if not worker.is_alive():
+                logger.error(
+                    f"Worker pid {worker.pid} exited with {worker.exitcode}. Restarting."
+                )
+                workers[i] = start_worker()
+
+    for worker in workers:
+        if worker.is_alive():
+            os.kill(worker.pid, signal.SIGTERM)
+    for worker in workers:
+        worker.join()
 
 
 def sig_handler(signum, frame):
@@ -9,19 +9,32 @@ import os
 import signal
 import sys
 import threading
-from internetarchive import get_session
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
 
 os.environ["DJANGO_SETTINGS_MODULE"] = "vault_site.settings"
 import django
 
 django.setup()
 from django.conf import settings
-from django.utils import dateformat
-from vault.models import DepositFile, Deposit
-
-SLEEP_TIME = 20
-MAX_PBOX_ITEM_FILES = 10000
-MAX_PBOX_ITEM_BYTES = 100 * 1024 * 1024 * 1024  # 100GiB
+from django.utils import timezone
+from vault.dedup import link_replicas
+from vault.models import DepositFile, Deposit, PetaboxItem
+from vault.notifications import StateListener
+from vault import shafs
+from vault.petabox import (
+    PER_ITEM_UPLOADS,
+    UPLOAD_WORKERS,
+    PetaboxUploader,
+    allocate_deposit,
+    reconcile_items,
+)
+
+# Replication is woken by DepositFile state notifications; polling only
+# catches anything missed, e.g. while the listener connection was down.
+POLL_INTERVAL = 5 * 60
+# uploads submitted and not handled yet, including those the uploader holds
+# back until their item has room
+MAX_PENDING_UPLOADS = 1000
 
 logger = logging.getLogger(__name__)
 
@@ -33,167 +46,210 @@ shutdown = threading.Event()
 # if pbox path update status of DepositFile and Deposit
 
 
-def process_hashed_deposit_files():
-
-    while True:
-        for deposit_file in DepositFile.objects.filter(
-            state=DepositFile.State.HASHED
-        ).order_by("id"):
-            org_id = deposit_file.deposit.organization_id
-            org_tmp_path = str(org_id)
-
-            # Check if we have the hashed file. It may be on another node.
-            sha_file_path = os.path.join(
-                get_shafs_folder(deposit_file), deposit_file.sha256_sum
+def process_hashed_deposit_files(args):
+    if not os.path.isfile(settings.IA_CONFIG_PATH):
+        logger.error(f"IA config path not found: {settings.IA_CONFIG_PATH}")
+        return
+    with StateListener(
+        [DepositFile.State.HASHED], shutdown
+    ) as listener, PetaboxUploader(
+        workers=args.upload_workers, per_item=args.per_item_uploads, shutdown=shutdown
+    ) as uploader:
+        while True:
+            stopped = process_hashed_deposit_files_pass(uploader)
+            logger.info(f"Petabox uploads: {uploader.stats.summary()}")
+            reconcile_items(uploader.session)
+            if stopped:
+                return
+            logger.debug(
+                f"waiting up to {args.poll_interval} sec for HASHED DepositFiles"
             )
-
-            if not os.path.isfile(path=sha_file_path):
-                continue
-
-            if deposit_file.tree_node and not deposit_file.tree_node.pbox_path:
-                status_code, item_file_path = try_upload_to_pbox(
-                    deposit_file, sha_file_path
-                )
-                if status_code == 200:
-                    deposit_file.tree_node.pbox_path = item_file_path
-                    deposit_file.tree_node.save()
-                    logger.info(
-                        f"Upload success. Status:{status_code} - item {item_file_path}"
-                    )
-                else:
-                    logger.error(
-                        f"Error uploading to petabox. DepositFile: {deposit_file.id} - Status:{status_code} - item {item_file_path}"
-                    )
-                    if status_code == 503:
-                        logger.error(
-                            f"Petabox returning 503 Slow Down. Taking a break."
-                        )
-                        if shutdown.wait(2 * SLEEP_TIME):
-                            return
-                        continue
-
-            if deposit_file.tree_node and deposit_file.tree_node.pbox_path:
-                deposit_file.state = DepositFile.State.REPLICATED
-                deposit_file.save()
-
-                # if all deposit_files in this deposit are REPLICATED, then set Deposit.state=REPLICATED
-                # todo should this just be a trigger on deposit_file.state?
-                if 0 == len(
-                    DepositFile.objects.filter(
-                        deposit=deposit_file.deposit,
-                        state__in=(
-                            DepositFile.State.REGISTERED,
-                            DepositFile.State.UPLOADED,
-                            DepositFile.State.HASHED,
-                        ),
-                    )
-                ):
-                    deposit_file.deposit.state = Deposit.State.REPLICATED
-                    deposit_file.deposit.save()
+            listener.wait(args.poll_interval)
             if shutdown.is_set():
                 logger.debug(f"Shutdown signal received. Stopping.")
                 return
 
-        logger.debug(f"forever loop sleeping {SLEEP_TIME} sec before iterating")
-        if shutdown.wait(SLEEP_TIME):
-            logger.debug(f"Shutdown signal received. Stopping.")
-            return
 
+def process_hashed_deposit_files_pass(uploader):
+    """Replicates every HASHED DepositFile found on this node. Returns
+    ``True`` if shutdown was requested.
+    """
+    deposit_files = list(
+        DepositFile.objects.filter(state=DepositFile.State.HASHED)
+        .select_related("tree_node", "deposit__organization__tree_node")
+        .order_by("id")
+    )
+    # Link content which is already replicated before any file of the pass is
+    # allocated to an item, so that linked files take up no room in items
+    linked_ids = set()
+    for deposit_file in link_and_release(deposit_files):
+        mark_replicated(deposit_file)
+        linked_ids.add(deposit_file.id)
+
+    pending = {}
+    # Deposits allocated to items in this pass, see submit_upload_to_pbox
+    allocated_deposit_ids = set()
+    # same content as a file uploaded in this pass, linked once it's uploaded
+    twins = []
+    queued_contents = set()
+    for deposit_file in deposit_files:
+        if deposit_file.id in linked_ids:
+            continue
+        # Check if we have the hashed file. It may be on another node.
+        sha_file_path = shafs.locate_blob(
+            deposit_file.deposit.organization_id, deposit_file.sha256_sum
+        )
+        if sha_file_path is None:
+            continue
 
-# TODO expand this in the future for shafs folder structure
-def get_shafs_folder(deposit_file):
-    org_id = deposit_file.deposit.organization_id
-    org_tmp_path = str(org_id)
-    return os.path.join(settings.SHADIR_ROOT, org_tmp_path)
+        if deposit_file.tree_node and not deposit_file.tree_node.pbox_path:
+            twin_key = (deposit_file.deposit.organization_id, deposit_file.sha256_sum)
+            if twin_key in queued_contents:
+                twins.append(deposit_file)
+                continue
+            future = submit_upload_to_pbox(
+                uploader, deposit_file, sha_file_path, allocated_deposit_ids
+            )
+            if future is not None:
+                pending[future] = deposit_file
+                queued_contents.add(twin_key)
+            # don't queue up much more work than there are uploaders. Uploads
+            # held back because their item is saturated don't count, so that
+            # files of other items are submitted meanwhile, up to a limit
+            if (
+                uploader.scheduled >= 2 * uploader.workers
+                or len(pending) >= MAX_PENDING_UPLOADS
+            ):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    handle_upload_result(pending.pop(future), future.result())
+        elif deposit_file.tree_node and deposit_file.tree_node.pbox_path:
+            mark_replicated(deposit_file)
+
+        if shutdown.is_set():
+            logger.debug(f"Shutdown signal received. Stopping.")
+            break
+
+    for future in as_completed(pending):
+        handle_upload_result(pending[future], future.result())
+    for deposit_file in link_and_release(twins):
+        mark_replicated(deposit_file)
+    return shutdown.is_set()
+
+
+def link_and_release(deposit_files):
+    """Links *deposit_files* whose content is already replicated, see
+    :py:func:`vault.dedup.link_replicas`, and gives back the room they were
+    allocated in Petabox items. Returns the DepositFiles linked.
+    """
+    linked = link_replicas(deposit_files)
+    PetaboxItem.release(linked)
+    return linked
+
+
+def handle_upload_result(deposit_file, result):
+    if result.status_code == 200:
+        deposit_file.tree_node.pbox_path = result.item_file_path
+        deposit_file.tree_node.save()
+        PetaboxItem.record_upload(deposit_file.pbox_item_id, deposit_file.size)
+        logger.info(
+            f"Upload success. Status:{result.status_code} - item {result.item_file_path}"
+        )
+        mark_replicated(deposit_file)
+    else:
+        logger.error(
+            f"Error uploading to petabox. DepositFile: {deposit_file.id} - Status:{result.status_code} - item {result.item_file_path}"
+        )
 
 
-def try_upload_to_pbox(deposit_file, file_path):
+def mark_replicated(deposit_file):
+    deposit_file.state = DepositFile.State.REPLICATED
+    deposit_file.replicated_at = timezone.now()
+    deposit_file.save()
+    log_latency(deposit_file)
+
+    # if all deposit_files in this deposit are REPLICATED, then set Deposit.state=REPLICATED
+    state_count, _ = deposit_file.deposit.file_state_totals()
+    if not any(
+        state_count[state]
+        for state in (
+            DepositFile.State.REGISTERED,
+            DepositFile.State.UPLOADED,
+            DepositFile.State.HASHED,
+        )
+    ):
+        deposit_file.deposit.state = Deposit.State.REPLICATED
+        deposit_file.deposit.replicated_at = timezone.now()
+        deposit_file.deposit.save()
+
+
+def log_latency(deposit_file):
+    stages = [
+        ("uploaded_at", deposit_file.uploaded_at),
+        ("hashed_at", deposit_file.hashed_at),
+        ("replicated_at", deposit_file.replicated_at),
+    ]
+    latencies = [
+        f"{start_name}->{end_name}: {(end - start).total_seconds():.2f}s"
+        for (start_name, start), (end_name, end) in zip(stages, stages[1:])
+        if start and end
+    ]
+    if latencies:
+        logger.info(f"DepositFile {deposit_file.id} latency {', '.join(latencies)}")
+
+
+def submit_upload_to_pbox(uploader, deposit_file, file_path, allocated_deposit_ids):
+    """Queues the upload of *deposit_file* from *file_path*. Returns a
+    Future of its :py:class:`vault.petabox.UploadResult`, or ``None`` if the
+    file can't be uploaded.
+
+    The Deposit of *deposit_file* is allocated to items unless its id is in
+    *allocated_deposit_ids*, to which it is then added.
+    """
     org_id = deposit_file.deposit.organization_id
-    col_id = deposit_file.deposit.collection_id
     deposit_id = deposit_file.deposit.id
 
-    item_name = get_pbox_item_name(deposit_file)
+    if deposit_file.deposit.organization.pbox_collection is None:
+        logger.error(
+            f"Deposit organization has no petabox collection set: organization.id={org_id}"
+        )
+        return None
+    if deposit_file.pbox_item_id is None:
+        # the whole Deposit is allocated at once, so the other files of the
+        # pass loaded before it was only need to be refreshed
+        if deposit_file.deposit_id not in allocated_deposit_ids:
+            allocate_deposit(deposit_file.deposit, uploader.session)
+            allocated_deposit_ids.add(deposit_file.deposit_id)
+        deposit_file.refresh_from_db(fields=["pbox_item"])
+    item_name = deposit_file.pbox_item.name
     logger.info(
         f"Uploading file to petabox: {item_name}/{deposit_file.sha256_sum} - {deposit_file.size} bytes"
     )
-    if item_name is not None:
-        if not os.path.isfile(settings.IA_CONFIG_PATH):
-            logger.error(f"IA config path not found: {settings.IA_CONFIG_PATH}")
-            return 0, None
-        ia_session = get_session(config_file=settings.IA_CONFIG_PATH)
-        item = ia_session.get_item(item_name)
-        pbox_file_path = os.path.join(
-            "Deposit:" + str(deposit_id), deposit_file.relative_path
-        )
-        item_file_path = os.path.join(item_name, pbox_file_path)
-        if len(item_file_path) >= 255:
-            logger.error(
-                f"deposit file id={deposit_file.id} item_file_path length is too long: {item_file_path}"
-            )
-            return 0, None
-
-        metadata = dict(
-            collection=deposit_file.deposit.organization.pbox_collection,
-            mediatype="data",
-            noindex="true",
-            creator="Vault",
-            description=f"Data files for Vault digital preservation service - {org_id}",
-        )
-        headers = {"x-archive-check-file": "0"}
-        responses = []
-        try:
-            with open(file_path, mode="rb") as deposit_file_handle:
-                responses = item.upload(
-                    {pbox_file_path: deposit_file_handle},
-                    queue_derive=False,
-                    verify=True,
-                    metadata=metadata,
-                    headers=headers,
-                )
-        except Exception as e:
-            logger.error(f"Error uploading to petabox: {e}")
-
-        if responses and len(responses) == 1:
-            return responses[0].status_code, item_file_path
-        else:
-            return 0, item_file_path
-    else:
-        return 0, None
-
-
-# Return the first pbox item that has room whether it exists or not.
-def get_pbox_item_name(deposit_file):
-    if deposit_file.deposit.organization.pbox_collection is None:
+    pbox_file_path = os.path.join(
+        "Deposit:" + str(deposit_id), deposit_file.relative_path
+    )
+    item_file_path = os.path.join(item_name, pbox_file_path)
+    if len(item_file_path) >= 255:
         logger.error(
-            f"Deposit organization has no petabox collection set: organization.id={deposit_file.deposit.organization.id}"
+            f"deposit file id={deposit_file.id} item_file_path length is too long: {item_file_path}"
         )
         return None
-    org_id = deposit_file.deposit.organization_id
-    datestamp = dateformat.format(deposit_file.deposit.registered_at, "Ymd")
-    environment = (
-        "-" + settings.DEPLOYMENT_ENVIRONMENT
-        if settings.DEPLOYMENT_ENVIRONMENT != "PROD"
-        else ""
+
+    metadata = dict(
+        collection=deposit_file.deposit.organization.pbox_collection,
+        mediatype="data",
+        noindex="true",
+        creator="Vault",
+        description=f"Data files for Vault digital preservation service - {org_id}",
+    )
+    return uploader.submit(
+        item_name,
+        pbox_file_path,
+        file_path,
+        size=deposit_file.size,
+        md5_sum=deposit_file.md5_sum,
+        metadata=metadata,
     )
-    prefix = f"DPS-VAULT{environment}-{org_id}-{datestamp}"
-    count = 1
-
-    ia_session = get_session(config_file=settings.IA_CONFIG_PATH)
-
-    while True:
-        item_name = prefix + f"-{count:05d}"
-        item = ia_session.get_item(item_name)
-        if not item.exists:
-            return item_name
-        else:
-            if (item.item_size is not None and item.files_count is not None) and (
-                item.item_size > MAX_PBOX_ITEM_BYTES
-                or item.files_count > MAX_PBOX_ITEM_FILES
-            ):
-                count += 1
-                continue
-            else:
-                return item_name
 
 
 def main(argv=None):
@@ -212,6 +268,25 @@ def main(argv=None):
         const=logging.DEBUG,
         help="verbose logging",
     )
+    arg_parser.add_argument(
+        "--poll-interval",
+        type=int,
+        default=POLL_INTERVAL,
+        help="seconds between scans for HASHED files when no notification arrives",
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--upload-workers",
+        type=int,
+        default=UPLOAD_WORKERS,
+        help="maximum number of concurrent Petabox uploads",
+    )
+    arg_parser.add_argument(
+        "--per-item-uploads",
+        type=int,
+        default=PER_ITEM_UPLOADS,
+        help="maximum number of concurrent uploads to the same Petabox item",
+    )
     args = arg_parser.parse_args(args=sys.argv[1:])
 
     logging.root.setLevel(level=args.log_level)
@@ -224,7 +299,7 @@ def main(argv=None):
     signal.signal(signal.SIGHUP, sig_handler)
     signal.signal(signal.SIGQUIT, sig_handler)
 
-    process_hashed_deposit_files()
+    process_hashed_deposit_files(args)
 
 
 def sig_handler(signum, frame):
@@ -4,11 +4,8 @@ import logging
 import os
 import random
 import time
-from collections import defaultdict
 from functools import reduce
-from itertools import chain
 from typing import Optional
-from typing import Union
 from typing import cast
 from typing import Dict
 
@@ -16,7 +13,7 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import MultipleObjectsReturned
-from django.db.models import Count, Max, Q, Sum
+from django.db.models import Count, Max, Sum
 from django.db.models.functions import Coalesce
 from django.http import Http404
 from django.http import HttpRequest
@@ -31,13 +28,22 @@ from fs.osfs import OSFS
 
 import requests
 
+from vault import chunks
 from vault import forms
 from vault import models
+from vault import timeline
 from vault.basicauth import basic_auth_required
 from vault.file_management import generate_hashes, move_temp_file
+from vault.uploadhandler import save_upload, upload_hexdigest
 
 logger = logging.getLogger(__name__)
 
+#: events per page of a collection's events
+COLLECTION_EVENTS_PAGE_SIZE = 100
+
+#: files per page of a fixity report
+FIXITY_REPORT_PAGE_SIZE = 100
+
 
 def index(request):
     return redirect("dashboard")
@@ -98,6 +104,8 @@ def collections(request):
 
     form = forms.CreateCollectionForm()
     org_root = str(org.tree_node_id)
+    # file counts and sizes are the accounting of the collection nodes, plus
+    # their deltas not aggregated yet, see TreeNodeQuerySet.with_exact_accounting
     _collections = models.TreeNode.objects.raw(
         """
     select coll.id as collection_id,
@@ -106,16 +114,25 @@ def collections(request):
     from vault_collection coll
         join (
             select colln.*,
-                   Cast(coalesce(sum(descn.size), 0) as bigint) as total_size,
-                   -- subtract 1 from file_count as nodes are own descendants
-                   -- could also filter on node_type to disallow FOLDER
-                   count(descn.id) - 1 as file_count,
-                   max(descn.modified_at) as last_modified
-            from vault_treenode colln, vault_treenode descn
+                   Cast(coalesce(colln.size, 0) + coalesce(journal.size, 0)
+                        as bigint) as total_size,
+                   colln.file_count + coalesce(journal.file_count, 0)
+                       as file_count,
+                   (
+                       select max(descn.modified_at)
+                       from vault_treenode descn
+                       where descn.path <@ colln.path
+                   ) as last_modified
+            from vault_treenode colln
+                left join (
+                    select tree_node_id,
+                           sum(file_count) as file_count,
+                           sum(size) as size
+                    from vault_treenodeaccountingdelta
+                    group by tree_node_id
+                ) journal on journal.tree_node_id = colln.id
             where colln.node_type = 'COLLECTION'
-                  and descn.path <@ colln.path
                   and colln.path <@ Cast(%s as ltree)
-            group by colln.id
         ) stats on coll.tree_node_id = stats.id""",
         [org_root],
     )
@@ -151,14 +168,16 @@ def collection(request, collection_id):
             _collection.save()
             messages.success(request, "Collection settings updated.")
 
-    collection_stats = models.TreeNode.objects.filter(
-        path__descendant=_collection.tree_node.path
-    ).aggregate(
-        file_count=Coalesce(Count("pk"), 0),
-        total_size=Coalesce(Sum("size"), 0),
-        last_modified=Max("modified_at"),
+    collection_node = models.TreeNode.objects.with_exact_accounting().get(
+        pk=_collection.tree_node_id
     )
-    collection_stats["file_count"] -= 1  # Collection's TreeNode included in count
+    collection_stats = {
+        "file_count": collection_node.exact_file_count,
+        "total_size": collection_node.exact_size,
+        "last_modified": models.TreeNode.objects.filter(
+            path__descendant=collection_node.path
+        ).aggregate(last_modified=Max("modified_at"))["last_modified"],
+    }
     form = forms.EditCollectionSettingsForm(
         initial=(
             {
@@ -168,20 +187,16 @@ def collection(request, collection_id):
             }
         )
     )
-    reports = models.Report.objects.filter(collection=_collection.pk)
-    deposits = models.Deposit.objects.filter(collection=_collection).annotate(
-        file_count=Count("files"),
-        total_size=Coalesce(Sum("files__size"), 0),
-        error_count=Count("pk", filter=Q(files__state=models.DepositFile.State.ERROR)),
-    )
-
-    def event_sort(event: Union[models.Deposit, models.Report]):
-        if isinstance(event, models.Deposit):
-            return event.registered_at
-
-        return event.started_at
-
-    events = sorted(chain(deposits, reports), key=event_sort, reverse=True)
+    try:
+        events, next_cursor = timeline.events_page(
+            org_id,
+            collection_id=_collection.id,
+            after=request.GET.get("after") or None,
+            limit=COLLECTION_EVENTS_PAGE_SIZE,
+            include_migrations=True,
+        )
+    except ValueError:
+        return HttpResponseBadRequest("invalid events cursor")
 
     return TemplateResponse(
         request,
@@ -192,6 +207,7 @@ def collection(request, collection_id):
             "collection_id": str(_collection.id),
             "form": form,
             "events": events,
+            "next_cursor": next_cursor,
         },
     )
 
@@ -221,14 +237,9 @@ def deposit_report(request, deposit_id):
     _deposit = get_object_or_404(models.Deposit, pk=deposit_id, organization_id=org_id)
     _collection = _deposit.collection
     deposit_files = _deposit.files.all()
-    file_count = len(deposit_files)
-    total_size = 0
-    state_count = defaultdict(int)
-    state_sizes = defaultdict(float)
-    for deposit_file in deposit_files:
-        total_size += deposit_file.size
-        state_count[deposit_file.state] += 1
-        state_sizes[deposit_file.state] += deposit_file.size
+    state_count, state_sizes = _deposit.file_state_totals()
+    file_count = sum(state_count.values())
+    total_size = sum(state_sizes.values())
     processed_states = (
         models.DepositFile.State.HASHED,
         models.DepositFile.State.REPLICATED,
@@ -274,12 +285,23 @@ def fixity_report(request, report_id):
         report_type=models.Report.ReportType.FIXITY,
     )
     coll = rep.collection
+    file_filter = request.GET.get("filter") or None
+    if file_filter not in models.Report.FILE_FILTERS:
+        file_filter = None
+    try:
+        after = max(int(request.GET.get("after") or 0), 0)
+    except ValueError:
+        after = 0
+    files, next_after = rep.files_page(file_filter, after, FIXITY_REPORT_PAGE_SIZE)
     return TemplateResponse(
         request,
         "vault/fixity_report.html",
         {
             "collection": coll,
             "report": rep,
+            "files": files,
+            "file_filter": file_filter,
+            "next_after": next_after,
         },
     )
 
@@ -509,24 +531,19 @@ def deposit_compat(request):
 
     # Write out file so that "process_chunked_files.py" will pick it up. We use
     # chunk subdir, but we only really have one chunk per file.
-    with OSFS(settings.FILE_UPLOAD_TEMP_DIR) as tmp_fs:
-        chunk_path = os.path.join(str(request.user.organization.id), "chunks")
-        with tmp_fs.makedirs(chunk_path, recreate=True) as chunk_fs:
-            temp_fname = f"{dummy_flow_identifier}.uploading"
-            fout = chunk_fs.openbin(temp_fname, mode="a")
-            for chunk in request.FILES[filekey].chunks():
-                fout.write(chunk)
-            fout.flush()
-            os.fsync(fout.fileno())
-            fout.close()
-            # the vault/utilities/process_chunked_files.py will look for
-            # [flow-id]-[#].tmp files
-            dst = f"{dummy_flow_identifier}-1.tmp"
-            chunk_fs.move(temp_fname, dst, overwrite=True)
-            # DOAJ has confirmed they are not providing `size`, so we substitute.
-            size = chunk_fs.getsize(dst)
-            if sha256sum != chunk_fs.hash(dst, "sha256"):
-                return HttpResponse(status=409)  # CONFLICT
+    chunk_dir = chunks.file_chunk_dir(
+        request.user.organization.id, dummy_flow_identifier
+    )
+    with OSFS(chunk_dir, create=True) as chunk_fs:
+        # the vault/utilities/process_chunked_files.py will look for
+        # [flow-id]-[#].tmp files
+        dst = chunks.chunk_filename(dummy_flow_identifier, 1)
+        save_upload(request.FILES[filekey], chunk_fs.getsyspath(dst))
+        # DOAJ has confirmed they are not providing `size`, so we substitute.
+        size = chunk_fs.getsize(dst)
+        # hashed as it was received
+        if sha256sum != upload_hexdigest(request.FILES[filekey], "sha256"):
+            return HttpResponse(status=409)  # CONFLICT
 
     # > I think we should make a new Deposit for every call to your endpoint;
     # so 1 new Deposit and 1 new DepositFile
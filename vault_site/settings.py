@@ -16,8 +16,21 @@ Environment Variables
     * ``MEDIA_ROOT`` -- path to directory in which files are stored
     * ``SHADIR_ROOT`` -- path to directory into which content-addressible deposit
       files are stored
+    * ``SHADIR_FANOUT_LEVELS`` -- number of levels of two-hex-digit
+      directories into which ``SHADIR_ROOT`` blobs are fanned out, see
+      ``vault.shafs``; run the ``reshard_shafs`` command after changing it
+    * ``SHAFS_STORE_NAME`` -- name under which the blobs of this host's
+      ``SHADIR_ROOT`` are indexed, by default the hostname; hosts sharing a
+      store must share its name, and a renamed host must keep it
     * ``FILE_UPLOAD_TEMP_DIR`` -- path to directory into which deposited flow
       chunks are saved
+    * ``CHUNK_STORAGE`` -- ``files`` (the default) to save each flow chunk to
+      its own file, or ``preallocated`` to write chunks in place into a file
+      preallocated under ``SHADIR_ROOT``, see ``vault.chunks``
+    * ``FLOW_CHUNK_ASGI`` -- ``true`` when the deposit page should upload
+      chunks to ``api/flow_chunk_async``, served by the ASGI server
+    * ``FLOW_CHUNK_ORG_CONCURRENCY`` -- number of chunks of an organization
+      which ``api/flow_chunk_async`` saves at once, per process
     * ``SECRET_KEY`` -- Django SECRET_KEY
     * ``DEBUG`` -- ``true`` when Django should operate in debug mode
     * ``SENTRY_DSN`` -- Sentry DSN to which to report exceptions
@@ -33,9 +46,14 @@ Environment Variables
       fixity API
     * ``FIXITTER_API_KEY`` -- preshared auth key accepted by the fixity
       checking service
+    * ``FIXITY_WORKERS`` -- number of processes re-hashing files in local
+      fixity checks
+    * ``FIXITY_MAX_BYTES_PER_SECOND`` -- cap on the combined read rate of local
+      fixity checks, 0 for no cap
 """
 
 import os
+import socket
 from pathlib import Path
 
 import sentry_sdk
@@ -52,7 +70,12 @@ with open(os.environ.get("AIT_CONF", "/etc/vault.yml"), encoding="utf-8") as f:
 
 MEDIA_ROOT = Path(conf.get("MEDIA_ROOT", "/opt/DPS/files/"))
 SHADIR_ROOT = Path(conf.get("SHADIR_ROOT", "/opt/DPS/SHA_DIR/"))
+SHADIR_FANOUT_LEVELS = int(conf.get("SHADIR_FANOUT_LEVELS", 2))
+SHAFS_STORE_NAME = conf.get("SHAFS_STORE_NAME", socket.gethostname())
 FILE_UPLOAD_TEMP_DIR = Path(conf.get("FILE_UPLOAD_TEMP_DIR", "/opt/DPS/tmp/"))
+CHUNK_STORAGE = conf.get("CHUNK_STORAGE", "files")
+FLOW_CHUNK_ASGI = conf.get("FLOW_CHUNK_ASGI", False)
+FLOW_CHUNK_ORG_CONCURRENCY = int(conf.get("FLOW_CHUNK_ORG_CONCURRENCY", 16))
 PETABOX_SECRET = bytes(conf["PETABOX_SECRET"], "ascii")
 
 
@@ -91,7 +114,8 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = None  # Defaults to 2.5MB
 
 FILE_UPLOAD_HANDLERS = [
     # 'django.core.files.uploadhandler.MemoryFileUploadHandler',
-    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+    # TemporaryFileUploadHandler, also hashing uploads as they are received
+    "vault.uploadhandler.HashingFileUploadHandler",
 ]
 
 # Application definition
@@ -143,6 +167,7 @@ TEMPLATES = [
                 "django.contrib.messages.context_processors.messages",
                 "vault.context_processors.sentry_dsn",
                 "vault.context_processors.vault_version",
+                "vault.context_processors.flow_chunk_url",
             ],
         },
     },
@@ -181,6 +206,16 @@ DATABASES = {
     }
 }
 
+# How TreeNode accounting triggers update the ancestors of changed nodes:
+# "immediate", or "journal" to append deltas which the
+# aggregate_treenode_accounting management command folds in. See
+# vault/accounting.py
+TREENODE_ACCOUNTING = conf.get("TREENODE_ACCOUNTING", "immediate")
+if TREENODE_ACCOUNTING == "journal":
+    DATABASES["default"]["OPTIONS"] = {
+        "options": "-c vault.treenode_accounting=journal"
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -327,6 +362,10 @@ FIXITY_API_KEY = conf.get("FIXITY_API_KEY", "FIXITY_API_KEY")
 FIXITTER_URL_PREFIX = "https://webdata.archive-it.org/jobman"
 # Preshared auth key accepted by the fixity checking service
 FIXITTER_API_KEY = conf.get("FIXITTER_API_KEY", "FIXITTER_API_KEY")
+# Processes re-hashing files in local fixity checks, see vault.fixity
+FIXITY_WORKERS = int(conf.get("FIXITY_WORKERS", os.cpu_count() or 1))
+# Cap on the combined read rate of local fixity checks, 0 for no cap
+FIXITY_MAX_BYTES_PER_SECOND = int(conf.get("FIXITY_MAX_BYTES_PER_SECOND", 0))
 
 # To disable basic auth support for DOAJ endpoint, or any view using the
 # @basic_auth_required decorator, uncomment the following line
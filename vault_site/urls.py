@@ -106,6 +106,16 @@ urlpatterns = [
         api.flow_chunk,
         name="api_flow_chunk",
     ),
+    path(
+        "api/flow_chunk_async",
+        api.flow_chunk_async,
+        name="api_flow_chunk_async",
+    ),
+    path(
+        "api/flow_chunks_saved",
+        api.flow_chunks_saved,
+        name="api_flow_chunks_saved",
+    ),
     path("api/get_events/<collection_id>", api.get_events, name="api_get_events"),
     path("api/register_deposit", api.register_deposit, name="api_register_deposit"),
     path("api/deposit_status", api.hashed_status, name="api_deposit_status"),